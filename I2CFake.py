@@ -0,0 +1,290 @@
+# NOTE - TESTING PURPOSES ONlY
+# This script emulates ADS1115/ADS1015 boards on an I2C bus so the logger can be run and benchmarked without a Pi
+# Unlike ADS1115Fake and AnalogInFake, it works at the register level, so the unmodified adafruit_ads1x15 driver,
+# the acquisition engine and Logger.log all run against it exactly as they would on the Pi
+# It emulates:
+# - the pointer, config and conversion registers of each board
+# - single-shot and continuous conversions, taking one conversion period for the data rate set in the config
+# - the OS bit, which reads 0 whilst a conversion is in progress
+# - the time each bus transaction takes at the bus frequency, plus a fixed overhead for each transaction
+# Values are worked out from the number of conversions each board has done rather than the time,
+# so the same sequence of reads always gives the same values
+#
+# To run the logger against emulated boards, set the LOGGER_EMULATOR environment variable before starting it
+# LOGGER_EMULATOR=1 emulates four ADS1115 boards, or give the board at each address from 0x48 to 0x4b, e.g.
+# LOGGER_EMULATOR=ADS1115,ADS1015,none,none
+# LOGGER_EMULATOR_OVERHEAD sets the fixed overhead of each transaction in microseconds
+# LOGGER_EMULATOR_ERRORS sets the chance of each transaction failing with an I2C error, either for every board or
+# for the board at each address, e.g. 0,0.05,0,1 makes the second board glitchy and the fourth board dead
+# LOGGER_EMULATOR_MAXCLOCK sets the fastest bus frequency the wiring handles, above which transactions start
+# failing (1 in 10) and values read back are sometimes corrupted, as happens with long cables
+
+import os
+import random
+import sys
+import threading
+import time
+import types
+
+# Conversion rate for each value of the data rate bits of the config register
+DATA_RATES = {16: [8, 16, 32, 64, 128, 250, 475, 860],
+              12: [128, 250, 490, 920, 1600, 2400, 3300, 3300]}
+# Full scale voltage for each value of the gain bits of the config register
+FULL_SCALE = [6.144, 4.096, 2.048, 1.024, 0.512, 0.256, 0.256, 0.256]
+# Default value of the config register at power up
+CONFIG_DEFAULT = 0x8583
+# Fixed time taken by each transaction on top of the bits on the bus (kernel and driver overhead)
+OVERHEAD = 20e-6
+
+
+# Default input signal for emulated boards
+# Returns the voltage on each input (AIN0 to AIN3) for the nth conversion of a board
+# Each input has its own level with a slow triangle wave on top
+def DefaultSignal(n):
+    wave = abs((n % 200) - 100) / 1000
+    return (0.5 + wave, 1.0 + wave, 1.5 - wave, 2.0 - wave)
+
+
+# Emulates the registers and conversions of a single ADS1115 (bits=16) or ADS1015 (bits=12)
+class EmulatedBoard():
+
+    def __init__(self, bits=16, signal=DefaultSignal, errorRate=0.0, seed=0):
+        self.bits = bits
+        self.signal = signal
+        # Chance of each transaction failing, with a fixed seed so the same errors happen each run
+        self.errorRate = errorRate
+        self.random = random.Random(seed)
+        # Register pointer and contents of the config, conversion and threshold registers
+        self.pointer = 0
+        self.registers = [0, CONFIG_DEFAULT, 0x8000, 0x7FFF]
+        # Number of conversions done, used as the time base of the signal
+        self.conversions = 0
+        # Start of the conversion in progress and how long it takes (None if not converting)
+        self.started = None
+        self.period = 0.0
+
+    # Called for every register access, so the board catches up with any conversions completed since the last
+    def Update(self, now):
+        if self.started is None or now < self.started + self.period:
+            return
+        if self.registers[1] & 0x0100:
+            # Single-shot mode completes one conversion then stops
+            self.started = None
+        else:
+            # Continuous mode completes a conversion every period, and only the latest is kept
+            completed = int((now - self.started) // self.period)
+            self.started += completed * self.period
+            self.conversions += completed - 1
+        self.registers[0] = self.Convert()
+        self.conversions += 1
+
+    # Work out the conversion result for the current config
+    def Convert(self):
+        config = self.registers[1]
+        inputs = self.signal(self.conversions)
+        mux = (config >> 12) & 0x07
+        # MUX settings 0-3 are differential, 4-7 are single-ended against GND
+        pairs = [(0, 1), (0, 3), (1, 3), (2, 3)]
+        if mux < 4:
+            volts = inputs[pairs[mux][0]] - inputs[pairs[mux][1]]
+        else:
+            volts = inputs[mux - 4]
+        fullScale = FULL_SCALE[(config >> 9) & 0x07]
+        code = max(-32768, min(32767, int(round(volts / fullScale * 32768))))
+        # 12 bit boards leave the bottom 4 bits empty
+        if self.bits == 12:
+            code &= ~0x000F
+        return code & 0xFFFF
+
+    # Start a conversion using the current config
+    def Start(self, now):
+        config = self.registers[1]
+        self.period = 1 / DATA_RATES[self.bits][(config >> 5) & 0x07]
+        self.started = now
+
+    def Write(self, data, now):
+        self.Update(now)
+        if len(data) == 0:
+            return
+        self.pointer = data[0] & 0x03
+        if len(data) >= 3:
+            value = data[1] << 8 | data[2]
+            if self.pointer == 1:
+                # OS bit is write only - writing 1 starts a single-shot conversion
+                self.registers[1] = value & 0x7FFF
+                if value & 0x8000 or not value & 0x0100:
+                    self.Start(now)
+            else:
+                self.registers[self.pointer] = value
+
+    def Read(self, count, now):
+        self.Update(now)
+        value = self.registers[self.pointer]
+        if self.pointer == 1 and self.started is None:
+            # OS bit reads 1 when no conversion is in progress
+            value |= 0x8000
+        return bytes([value >> 8 & 0xFF, value & 0xFF] * ((count + 1) // 2))[:count]
+
+
+# Emulates busio.I2C with emulated boards attached
+class I2C():
+
+    def __init__(self, scl=None, sda=None, *, frequency=100000, boards=None, overhead=OVERHEAD, maxClock=None):
+        self.frequency = frequency
+        self.overhead = overhead
+        # Whether the bus is being run faster than the wiring can handle
+        self.overclocked = maxClock is not None and frequency > maxClock
+        self.random = random.Random(frequency)
+        # Dictionary of address to EmulatedBoard
+        self.boards = EmulatorBoards() if boards is None else boards
+        self.lock = threading.Lock()
+        # Number of transactions on the bus
+        self.transactions = 0
+
+    # Take the time a transaction of nbytes (plus the address byte) would take on the bus
+    # time.sleep is too coarse for transactions of tens of microseconds, so wait in a loop
+    def Transfer(self, nbytes):
+        self.transactions += 1
+        end = time.perf_counter() + self.overhead + (nbytes + 1) * 9 / self.frequency
+        while time.perf_counter() < end:
+            pass
+        return end
+
+    def Board(self, address):
+        # Address not acknowledged, as raised by the Linux I2C driver
+        if address not in self.boards:
+            raise OSError(121, "Remote I/O error")
+        board = self.boards[address]
+        if board.errorRate > 0 and board.random.random() < board.errorRate:
+            raise OSError(121, "Remote I/O error")
+        if self.overclocked and self.random.random() < 0.1:
+            raise OSError(121, "Remote I/O error")
+        return board
+
+    def try_lock(self):
+        return self.lock.acquire(blocking=False)
+
+    def unlock(self):
+        self.lock.release()
+
+    def scan(self):
+        return sorted(self.boards)
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        now = self.Transfer(end - start)
+        self.Board(address).Write(bytes(buffer[start:end]), now)
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        now = self.Transfer(end - start)
+        data = self.Board(address).Read(end - start, now)
+        # An overclocked bus sometimes reads a bit wrong without an error
+        if self.overclocked and len(data) > 0 and self.random.random() < 0.05:
+            data = bytes([data[0] ^ 0x01]) + data[1:]
+        buffer[start:end] = data
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *, out_start=0, out_end=None, in_start=0,
+                              in_end=None):
+        self.writeto(address, buffer_out, start=out_start, end=out_end)
+        self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+
+    def deinit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.deinit()
+
+
+# Emulates adafruit_bus_device.i2c_device.I2CDevice, used if adafruit_bus_device isn't installed
+class I2CDevice():
+
+    def __init__(self, i2c, device_address, probe=True):
+        self.i2c = i2c
+        self.device_address = device_address
+        if probe:
+            try:
+                i2c.writeto(device_address, b"")
+            except OSError:
+                raise ValueError("No I2C device at address: 0x%x" % device_address)
+
+    def readinto(self, buf, *, start=0, end=None):
+        self.i2c.readfrom_into(self.device_address, buf, start=start, end=end)
+
+    def write(self, buf, *, start=0, end=None):
+        self.i2c.writeto(self.device_address, buf, start=start, end=end)
+
+    def write_then_readinto(self, out_buffer, in_buffer, *, out_start=0, out_end=None, in_start=0, in_end=None):
+        self.i2c.writeto_then_readfrom(self.device_address, out_buffer, in_buffer, out_start=out_start,
+                                       out_end=out_end, in_start=in_start, in_end=in_end)
+
+    def __enter__(self):
+        while not self.i2c.try_lock():
+            pass
+        return self
+
+    def __exit__(self, *args):
+        self.i2c.unlock()
+        return False
+
+
+# Create the emulated boards set by the LOGGER_EMULATOR environment variable
+# Returns a dictionary of address to EmulatedBoard
+def EmulatorBoards(setting=None, errors=None):
+    setting = os.environ.get("LOGGER_EMULATOR", "1") if setting is None else setting
+    errors = os.environ.get("LOGGER_EMULATOR_ERRORS", "0") if errors is None else errors
+    boardTypes = ["ADS1115"] * 4 if setting == "1" else [boardType.strip() for boardType in setting.split(",")]
+    errorRates = [float(rate) for rate in errors.split(",")]
+    if len(errorRates) == 1:
+        errorRates = errorRates * 4
+    boards = {}
+    for address, boardType, errorRate in zip([0x48, 0x49, 0x4a, 0x4b], boardTypes, errorRates):
+        if boardType == "ADS1115":
+            boards[address] = EmulatedBoard(16, errorRate=errorRate, seed=address)
+        elif boardType == "ADS1015":
+            boards[address] = EmulatedBoard(12, errorRate=errorRate, seed=address)
+    return boards
+
+
+# Replace the busio and board modules with the emulator, so busio.I2C(board.SCL, board.SDA) opens the emulated bus
+# adafruit_bus_device and micropython are only replaced if they aren't installed
+# Must be called before adafruit_ads1x15 is imported
+def Install():
+    overhead = float(os.environ.get("LOGGER_EMULATOR_OVERHEAD", OVERHEAD * 1e6)) / 1e6
+    maxClock = os.environ.get("LOGGER_EMULATOR_MAXCLOCK", "")
+    maxClock = int(maxClock) if maxClock != "" else None
+    boards = EmulatorBoards()
+    busio = types.ModuleType("busio")
+    busio.I2C = lambda scl=None, sda=None, frequency=100000: I2C(scl, sda, frequency=frequency, boards=boards,
+                                                                 overhead=overhead, maxClock=maxClock)
+    board = types.ModuleType("board")
+    board.SCL = "SCL"
+    board.SDA = "SDA"
+    sys.modules["busio"] = busio
+    sys.modules["board"] = board
+    try:
+        import adafruit_bus_device.i2c_device
+    except ImportError:
+        busDevice = types.ModuleType("adafruit_bus_device")
+        busDevice.i2c_device = types.ModuleType("adafruit_bus_device.i2c_device")
+        busDevice.i2c_device.I2CDevice = I2CDevice
+        sys.modules["adafruit_bus_device"] = busDevice
+        sys.modules["adafruit_bus_device.i2c_device"] = busDevice.i2c_device
+    try:
+        import micropython
+    except ImportError:
+        micropython = types.ModuleType("micropython")
+        micropython.const = lambda value: value
+        sys.modules["micropython"] = micropython
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
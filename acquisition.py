@@ -0,0 +1,557 @@
+# This file contains the acquisition engine used by logger.py to read data from the ADS1115 boards
+# Reading each pin one after another means waiting for a full conversion per pin
+# Instead, a conversion is started on every connected board at once, the engine waits one conversion period
+# and then collects the result from each board. This is repeated for each MUX position in turn.
+# With 4 boards connected this means up to 4 conversions happen at the same time.
+# The pins to read are compiled into a ReadPlan when the log is imported, so the config words are worked out
+# once rather than for every sample, and the logging loop talks to the I2C bus directly.
+# Pins can also be oversampled, taking several conversions each time interval and reducing them to one value.
+# Pins can be given their own time interval, and pins with the same time interval are read as a rate group.
+# I2C errors are handled board by board. A failed transaction is retried a couple of times, and if the board still
+# can't be read its pins are stored as missing for that row while every other board is read as normal.
+# A board that keeps failing is quarantined for a while so it can't eat into the time needed to read the others,
+# and if every board fails at once the bus itself is re-initialised.
+
+import errno
+import logging
+import time
+from array import array
+from datetime import datetime
+import numpy as np
+import file_rw
+
+# ADS1x15 register pointers and config masks (see the ADS1115 datasheet for more info)
+POINTER_CONVERSION = 0x00
+POINTER_CONFIG = 0x01
+CONFIG_OS_SINGLE = 0x8000
+CONFIG_MUX_OFFSET = 12
+CONFIG_MODE_CONTINUOUS = 0x0000
+CONFIG_MODE_SINGLE = 0x0100
+CONFIG_COMP_QUE_DISABLE = 0x0003
+CONFIG_GAIN = {
+    2 / 3: 0x0000,
+    1: 0x0200,
+    2: 0x0400,
+    4: 0x0600,
+    8: 0x0800,
+    16: 0x0A00,
+}
+# Value stored for a pin that couldn't be read (the most negative int16 value)
+# Conversions at negative full scale are stored one above it so they can't be mistaken for a missing value
+MISSING = file_rw.MISSING
+# Number of times a failed transaction is retried, and the wait before the first retry (doubled for each retry)
+RETRIES = 2
+RETRY_BACKOFF = 100e-6
+# Number of failed reads in a row before a board is quarantined, and how long it is quarantined for in seconds
+# A board that fails again soon after being let back in is quarantined for twice as long, up to QUARANTINE_MAX
+QUARANTINE_AFTER = 3
+QUARANTINE_TIME = 0.5
+QUARANTINE_MAX = 30.0
+# Shortest time in seconds between re-initialising the bus
+REINIT_INTERVAL = 1.0
+# Most times a board is polled for a finished conversion before it is treated as failed
+POLL_LIMIT = 20
+
+
+# Holds everything needed to read a single pin without going through AnalogIn
+class Channel():
+
+    def __init__(self, index, pin):
+        # Position of the pin in the row of logged values
+        self.index = index
+        # AnalogIn object for the pin
+        self.pin = pin
+        # Board the pin is on and its I2C address
+        self.adc = pin._ads
+        self.address = self.adc.i2c_device.device_address
+        # MUX setting for the pin (single-ended pins are offset by 4)
+        self.mux = pin._pin_setting if pin.is_differential else pin._pin_setting + 0x04
+        self.gain = pin.gain
+        # Mask applied to the conversion register - 12 bit boards leave the bottom 4 bits empty
+        self.mask = (0xFFFF << (16 - self.adc.bits)) & 0xFFFF
+        # Ready-made config register write (pointer byte followed by the 16 bit config word)
+        self.configWrite = None
+        # Health of the board the pin is on, set when the plan is given to an engine
+        self.health = None
+        # Whether a conversion was started for the pin in the current round
+        self.started = False
+        # For boards converting continuously, the time a conversion at the pin's setting will have finished by
+        # after the board was configured again (0 once it has)
+        self.settled = 0.0
+
+    # Work out the config word for this channel in the given mode
+    def Compile(self, mode):
+        config = CONFIG_OS_SINGLE if mode == CONFIG_MODE_SINGLE else 0
+        config |= (self.mux & 0x07) << CONFIG_MUX_OFFSET
+        config |= CONFIG_GAIN[self.gain]
+        config |= mode
+        config |= self.adc.rate_config[self.adc.data_rate]
+        config |= CONFIG_COMP_QUE_DISABLE
+        self.configWrite = bytes([POINTER_CONFIG, (config >> 8) & 0xFF, config & 0xFF])
+
+
+# Precomputed schedule of register operations used to read a row of values
+class ReadPlan():
+
+    def __init__(self, count):
+        # Number of values returned for each read
+        self.count = count
+        # I2C bus shared by every board
+        self.bus = None
+        # Channels on boards with only one pin to log
+        # These boards are left converting continuously so no config writes are needed in the loop
+        self.continuous = []
+        # Rounds of channels converted at the same time - at most one channel per board per round
+        self.rounds = []
+        # Time to wait for a conversion to complete in each round
+        self.periods = []
+        # Position and AnalogIn object of each pin, only used when the plan can't talk to the registers directly
+        self.pins = []
+
+
+# Compile the AnalogIn objects of the pins set to log into a ReadPlan
+# indices gives the position of each pin in the row of values (defaults to the order of adcToLog)
+# If allowContinuous is False, every board is read in single-shot mode
+# shared holds the ids of boards also read by other plans, which are always read in single-shot mode
+# as another plan changing the MUX would leave a continuous board converting the wrong pin
+def CompilePlan(adcToLog, indices=None, allowContinuous=True, shared=()):
+    if indices is None:
+        indices = range(0, len(adcToLog))
+    plan = ReadPlan(len(adcToLog))
+    # The fake dev modules have no registers to write to
+    # If any boards are fake, fall back to reading pins one after another
+    if not all(hasattr(pin._ads, "i2c_device") and hasattr(pin._ads, "rate_config") for pin in adcToLog):
+        plan.pins = list(zip(indices, adcToLog))
+        return plan
+    # Group channels by board, ordered by MUX position
+    boards = {}
+    for idx, pin in zip(indices, adcToLog):
+        boards.setdefault(id(pin._ads), []).append(Channel(idx, pin))
+    for channels in boards.values():
+        channels.sort(key=lambda channel: channel.mux)
+        plan.bus = channels[0].adc.i2c_device.i2c
+    # Boards with a single channel never change MUX so can be read straight from the conversion register
+    single = []
+    for board, channels in boards.items():
+        if len(channels) == 1 and allowContinuous and board not in shared:
+            channels[0].Compile(CONFIG_MODE_CONTINUOUS)
+            plan.continuous.append(channels[0])
+        else:
+            single.append(channels)
+    # Boards with several channels take the nth channel of each board for round n
+    for channels in single:
+        for channel in channels:
+            channel.Compile(CONFIG_MODE_SINGLE)
+    roundCount = max([len(channels) for channels in single], default=0)
+    for n in range(0, roundCount):
+        channels = [channels[n] for channels in single if len(channels) > n]
+        plan.rounds.append(channels)
+        # Wait for the slowest board in the round
+        plan.periods.append(max(1 / channel.adc.data_rate for channel in channels))
+    return plan
+
+
+# Keeps track of the I2C errors of a single board
+class BoardHealth():
+
+    def __init__(self, adc):
+        self.adc = adc
+        self.address = adc.i2c_device.device_address
+        # Total failed transactions, including ones that worked when retried
+        self.errors = 0
+        # Failed reads in a row, and number of times quarantined since the board was last healthy
+        self.failures = 0
+        self.quarantines = 0
+        # Time (perf_counter) the board is quarantined until
+        self.until = 0.0
+        # Set once a board has failed, so it is checked (and reconfigured if needed) before it is next read
+        self.blocked = False
+
+
+# Handles I2C errors for every engine reading from the same bus
+# reopen is called with no arguments to open a new bus in place of the old one (closing the old bus),
+# and should return "fake" if it fails (see hardware.Inventory.Reopen)
+class Recovery():
+
+    def __init__(self, reopen=None):
+        self.reopen = reopen
+        self.bus = None
+        # Health of each board, by address
+        self.boards = {}
+        # Engines reading from the bus, which are moved to the new bus when it is re-initialised
+        self.engines = []
+        # Totals for the stats counters: failed transactions, retries, values stored as missing and bus re-inits
+        self.errors = 0
+        self.retries = 0
+        self.missing = 0
+        self.busInits = 0
+        self.lastInit = 0.0
+        # Number of faults handled, so the logging loop only publishes the totals when something has happened
+        self.events = 0
+
+    # Register an engine and the boards its plan reads from
+    def Add(self, engine):
+        plan = engine.plan
+        if plan.bus is None:
+            return
+        self.bus = plan.bus
+        self.engines.append(engine)
+        for channels in [plan.continuous] + plan.rounds:
+            for channel in channels:
+                if channel.address not in self.boards:
+                    self.boards[channel.address] = BoardHealth(channel.adc)
+                channel.health = self.boards[channel.address]
+
+    # Retry a failed transaction, waiting a little longer before each retry
+    # Returns True if the transaction worked
+    def Retry(self, health, transaction, *args):
+        self.events += 1
+        self.errors += 1
+        health.errors += 1
+        delay = RETRY_BACKOFF
+        for _ in range(0, RETRIES):
+            time.sleep(delay)
+            delay *= 2
+            self.retries += 1
+            try:
+                transaction(*args)
+                return True
+            except OSError:
+                self.errors += 1
+                health.errors += 1
+        return False
+
+    # Record a board that couldn't be read, quarantining it if it keeps failing
+    def Failed(self, health):
+        self.events += 1
+        health.failures += 1
+        health.blocked = True
+        if health.failures < QUARANTINE_AFTER:
+            return
+        now = time.perf_counter()
+        # Only double the quarantine if the board is failing again soon after the last one
+        if now - health.until > QUARANTINE_MAX:
+            health.quarantines = 0
+        period = min(QUARANTINE_TIME * 2 ** health.quarantines, QUARANTINE_MAX)
+        health.until = now + period
+        health.quarantines += 1
+        health.failures = 0
+        logging.getLogger('error_logger').info("{} - Board {} quarantined for {} seconds after {} I2C errors"
+                                               .format(datetime.now(), hex(health.address), period, health.errors))
+
+    # Returns the number of boards currently quarantined
+    def Quarantined(self):
+        now = time.perf_counter()
+        return sum(1 for health in self.boards.values() if health.until > now)
+
+    # Re-initialise the bus and move every engine and board onto the new bus
+    # Only done if a way to reopen the bus was given, at most once every REINIT_INTERVAL seconds
+    def Reinit(self):
+        now = time.perf_counter()
+        if self.reopen is None or now - self.lastInit < REINIT_INTERVAL:
+            return
+        self.lastInit = now
+        self.events += 1
+        bus = self.reopen()
+        if isinstance(bus, str):
+            return
+        self.bus = bus
+        for engine in self.engines:
+            engine.plan.bus = bus
+        for health in self.boards.values():
+            health.adc.i2c_device.i2c = bus
+            # Boards may have lost their config, so continuous boards are configured again before their next read
+            health.blocked = True
+        self.busInits += 1
+        logging.getLogger('error_logger').info("{} - I2C bus re-initialised after every board failed"
+                                               .format(datetime.now()))
+
+
+# Reads a set of pins across all boards by running a compiled ReadPlan
+# Engines reading from the same bus share a Recovery, which tracks the health of each board
+class AdcEngine():
+
+    def __init__(self, plan, recovery=None):
+        self.plan = plan
+        self.recovery = Recovery() if recovery is None else recovery
+        self.recovery.Add(self)
+        # Buffers reused for every transaction to avoid allocating in the logging loop
+        self.pointer = bytes([POINTER_CONVERSION])
+        self.buf = bytearray(2)
+
+    # Configure continuously converting boards
+    # Must be called once before the first Read
+    def Start(self):
+        plan = self.plan
+        if plan.bus is None or plan.continuous == []:
+            return
+        self.Lock()
+        try:
+            for channel in plan.continuous:
+                try:
+                    self.Configure(channel)
+                except OSError:
+                    # The board is configured again before its first read
+                    self.recovery.Failed(channel.health)
+        finally:
+            plan.bus.unlock()
+        # Allow the first conversion to complete
+        time.sleep(2 * max(1 / channel.adc.data_rate for channel in plan.continuous))
+
+    # Take the bus lock for the whole row rather than for every register access
+    def Lock(self):
+        while not self.plan.bus.try_lock():
+            pass
+
+    # Set a continuously converting board converting
+    def Configure(self, channel):
+        self.plan.bus.writeto(channel.address, channel.configWrite)
+        # Leave the pointer on the conversion register so reads need no pointer write
+        self.plan.bus.writeto(channel.address, self.pointer)
+
+    # Check a board that has failed before reading it
+    # Returns False if the board is quarantined or couldn't be configured again
+    def Admit(self, channel):
+        health = channel.health
+        if health.until > time.perf_counter():
+            return False
+        if channel in self.plan.continuous:
+            try:
+                self.Configure(channel)
+            except OSError:
+                self.recovery.Failed(health)
+                return False
+            # The conversion register still holds the result from before the board failed until a conversion
+            # at the new setting finishes, allowing for a slow oscillator as Start does
+            channel.settled = time.perf_counter() + 2 / channel.adc.data_rate
+        health.blocked = False
+        self.recovery.events += 1
+        return True
+
+    # Collect the result of a conversion, polling in case a board's oscillator is running slow
+    # The pointer is still on the config register after the write so polling needs no pointer write
+    def Collect(self, channel):
+        bus = self.plan.bus
+        buf = self.buf
+        bus.readfrom_into(channel.address, buf)
+        polls = 0
+        while not buf[0] & 0x80:
+            polls += 1
+            if polls > POLL_LIMIT:
+                raise OSError(errno.ETIMEDOUT, "Conversion timed out")
+            bus.readfrom_into(channel.address, buf)
+        bus.writeto_then_readfrom(channel.address, self.pointer, buf)
+
+    # Read a value from every pin and store it in out
+    # Values are scaled to 16 bits, matching AnalogIn.value
+    # Pins on boards that can't be read are stored as MISSING
+    def Read(self, out):
+        plan = self.plan
+        if plan.bus is None:
+            for idx, pin in plan.pins:
+                out[idx] = pin.value
+            return
+        bus = plan.bus
+        buf = self.buf
+        recovery = self.recovery
+        # Number of values stored as missing, and whether any were because of errors rather than quarantine
+        missing = 0
+        failed = False
+        self.Lock()
+        try:
+            # Continuously converting boards just need their latest result
+            for channel in plan.continuous:
+                health = channel.health
+                # Boards that have failed are checked before they are read
+                if health.blocked and not self.Admit(channel):
+                    out[channel.index] = MISSING
+                    missing += 1
+                    continue
+                # Boards configured again are left out until their result is from the new setting
+                if channel.settled:
+                    if channel.settled > time.perf_counter():
+                        out[channel.index] = MISSING
+                        missing += 1
+                        continue
+                    channel.settled = 0.0
+                try:
+                    bus.readfrom_into(channel.address, buf)
+                except OSError:
+                    if not recovery.Retry(health, bus.readfrom_into, channel.address, buf):
+                        recovery.Failed(health)
+                        out[channel.index] = MISSING
+                        missing += 1
+                        failed = True
+                        continue
+                health.failures = 0
+                raw = (buf[0] << 8 | buf[1]) & channel.mask
+                out[channel.index] = raw - 0x10000 if raw > 0x8000 else (raw if raw != 0x8000 else MISSING + 1)
+            for channels, period in zip(plan.rounds, plan.periods):
+                # Start a conversion on every board in the round
+                for channel in channels:
+                    health = channel.health
+                    channel.started = False
+                    if health.blocked and not self.Admit(channel):
+                        continue
+                    try:
+                        bus.writeto(channel.address, channel.configWrite)
+                    except OSError:
+                        if not recovery.Retry(health, bus.writeto, channel.address, channel.configWrite):
+                            recovery.Failed(health)
+                            failed = True
+                            continue
+                    channel.started = True
+                # All boards are now converting, so wait one conversion period
+                time.sleep(period)
+                # Collect the results
+                for channel in channels:
+                    if not channel.started:
+                        out[channel.index] = MISSING
+                        missing += 1
+                        continue
+                    try:
+                        self.Collect(channel)
+                    except OSError:
+                        if not recovery.Retry(channel.health, self.Collect, channel):
+                            recovery.Failed(channel.health)
+                            out[channel.index] = MISSING
+                            missing += 1
+                            failed = True
+                            continue
+                    channel.health.failures = 0
+                    raw = (buf[0] << 8 | buf[1]) & channel.mask
+                    out[channel.index] = raw - 0x10000 if raw > 0x8000 else (raw if raw != 0x8000 else MISSING + 1)
+        finally:
+            bus.unlock()
+        if missing != 0:
+            recovery.missing += missing
+            # If nothing could be read, the bus itself may be stuck
+            if failed and missing == plan.count:
+                recovery.Reinit()
+
+
+# Reads oversampled pins, taking several conversions of each pin every time interval
+# The conversions for a row are held in a 2D array (conversion, pin) and reduced to one value per pin
+# The reduction is done with numpy across the whole row at once rather than pin by pin
+# Missing conversions are left out of the reduction, and a pin is only missing if all its conversions are
+class Oversampler():
+
+    def __init__(self, adcToLog, pins, recovery=None):
+        count = len(adcToLog)
+        self.depths = np.array([pin.oversample for pin in pins])
+        depth = int(self.depths.max())
+        # Build a read plan for each conversion of the row, containing only the pins that need that many conversions
+        # A board's MUX changes between plans, so boards can't be left converting continuously
+        plans = {}
+        self.engines = []
+        for n in range(0, depth):
+            indices = [idx for idx in range(0, count) if self.depths[idx] > n]
+            key = tuple(indices)
+            if key not in plans:
+                plans[key] = AdcEngine(CompilePlan([adcToLog[idx] for idx in indices], indices, False), recovery)
+            self.engines.append(plans[key])
+        # Buffer of every conversion for a row and mask of which entries are used
+        self.buf = np.zeros((depth, count), dtype=np.int16)
+        self.mask = np.arange(depth)[:, None] < self.depths[None, :]
+        # Which reduction each pin uses and the IIR filter coefficients
+        self.reductions = {reduction: np.array([pin.reduction == reduction for pin in pins])
+                           for reduction in ("mean", "min", "max", "iir")}
+        self.alpha = np.array([pin.alpha for pin in pins])
+        # State of the IIR filter, set from the first conversions of the log
+        self.state = None
+
+    def Start(self):
+        for engine in set(self.engines):
+            engine.Start()
+
+    # Read every conversion for a row, then reduce to one value per pin and store it in out
+    def Read(self, out):
+        for n, engine in enumerate(self.engines):
+            engine.Read(self.buf[n])
+        buf = self.buf.astype(np.float64)
+        valid = self.mask & (self.buf != MISSING)
+        counts = valid.sum(axis=0)
+        mean = np.where(valid, buf, 0).sum(axis=0) / np.maximum(counts, 1)
+        low = np.where(valid, buf, np.inf).min(axis=0)
+        high = np.where(valid, buf, -np.inf).max(axis=0)
+        # IIR low-pass filter runs through the conversions in order, carrying its state between rows
+        # The state of each pin starts from its first conversion of the log
+        if self.state is None:
+            self.state = np.full(buf.shape[1], np.nan)
+        for n in range(0, buf.shape[0]):
+            state = np.where(np.isnan(self.state), buf[n], self.state + self.alpha * (buf[n] - self.state))
+            self.state = np.where(valid[n], state, self.state)
+        result = np.select([self.reductions["mean"], self.reductions["min"], self.reductions["max"],
+                            self.reductions["iir"]], [mean, low, high, self.state])
+        result = np.where(counts > 0, result, MISSING)
+        np.frombuffer(out, dtype=np.int16)[:] = np.clip(np.rint(result), MISSING, 32767)
+
+
+# Creates the engine used to read a row of values
+# Oversampling is only used if a pin needs more than one conversion each time interval
+# shared holds the ids of boards also read by other engines (see CompilePlan)
+def CreateEngine(adcToLog, pins, recovery=None, shared=()):
+    if all(pin.oversample == 1 for pin in pins):
+        return AdcEngine(CompilePlan(adcToLog, shared=shared), recovery)
+    return Oversampler(adcToLog, pins, recovery)
+
+
+# A set of pins logged at the same time interval
+# Each group has its own engine, and is scheduled and written to file separately from other groups
+class RateGroup():
+
+    def __init__(self, interval, positions, adcToLog, pins, headers, recovery=None, shared=()):
+        self.interval = interval
+        # Position in the group and position in the full row of enabled pins of each pin
+        # Used to copy the group's values into the full row for live data
+        self.positions = list(enumerate(positions))
+        self.adcToLog = adcToLog
+        self.pins = pins
+        self.headers = headers
+        # Handles I2C errors for the group, shared with every other group on the bus
+        self.recovery = Recovery() if recovery is None else recovery
+        self.engine = CreateEngine(adcToLog, pins, self.recovery, shared)
+        # Row of values for the group, reused for every read
+        self.values = array('h', bytes(2 * len(adcToLog)))
+        # The main group is written to the log's main raw data file, the others to their own streams
+        self.main = False
+        # Ring buffer, writer thread and scheduler of the group, created when the log starts
+        self.ring = None
+        self.writerThread = None
+        self.ticks = None
+
+
+# Split the enabled pins into rate groups by time interval, fastest group first
+# Returns an empty list if no pins are enabled
+# adcToLog, pins and headers are the AnalogIn object, Pin object and name of each enabled pin
+# Pins with a time interval of 0 use the time interval of the log
+# Every group shares the Recovery given, so errors on a board are tracked across every group that reads it
+# Only a board with a single pin in the whole log can be left converting continuously
+def CreateGroups(adcToLog, pins, headers, logInterval, recovery=None):
+    if len(pins) == 0:
+        return []
+    recovery = Recovery() if recovery is None else recovery
+    intervals = [pin.interval if pin.interval > 0 else logInterval for pin in pins]
+    counts = {}
+    for pin in adcToLog:
+        counts[id(pin._ads)] = counts.get(id(pin._ads), 0) + 1
+    shared = set(board for board in counts if counts[board] > 1)
+    groups = []
+    for interval in sorted(set(intervals)):
+        positions = [idx for idx in range(0, len(pins)) if intervals[idx] == interval]
+        groups.append(RateGroup(interval, positions, [adcToLog[idx] for idx in positions],
+                                [pins[idx] for idx in positions], [headers[idx] for idx in positions], recovery,
+                                shared))
+    # The group at the log's time interval is the main group, or the fastest group if there isn't one
+    main = [group for group in groups if group.interval == logInterval]
+    (main + groups)[0].main = True
+    return groups
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -0,0 +1,36 @@
+# Sweeps the I2C bus frequencies against the boards connected, measuring read throughput and errors at each
+# Picks the fastest frequency the boards can be read at reliably (see busTune.py), and stores it with --save
+# Run from the repository root with: python -m benchmarks.busSweep
+# Without a Pi, run it against emulated boards with e.g. LOGGER_EMULATOR=1 LOGGER_EMULATOR_MAXCLOCK=1000000
+
+import argparse
+import json
+import busTune
+import file_rw
+import hardware
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Find the fastest reliable I2C bus frequency")
+    parser.add_argument("--frequencies", type=int, nargs="+", default=busTune.FREQUENCIES)
+    parser.add_argument("--save", action="store_true", help="Store the frequency found in loggerSettings.ini")
+    parser.add_argument("--output", help="File to write the JSON results to")
+    args = parser.parse_args()
+    settings = file_rw.ReadSettings()
+    best, results = busTune.TuneBus(settings, args.frequencies)
+    if best is None:
+        print("No frequency was reliable")
+    else:
+        print("Fastest reliable frequency: {} kHz".format(best // 1000))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"best": best, "results": results}, file, indent=2)
+    if args.save and best is not None:
+        # Record the boards the frequency was found for, so autotune knows when to tune again
+        adcs = hardware.OpenBoards(hardware.OpenBus(best), settings)
+        busTune.SaveFrequency(best, [hardware.BoardType(adc) for adc in adcs])
+        print("Saved to {}".format(file_rw.settingsPath))
+
+
+if __name__ == "__main__":
+    Main()
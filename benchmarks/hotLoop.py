@@ -0,0 +1,102 @@
+# Micro-benchmark for the CPU cost of each frame of the logging loop in logger.py
+# Compares the original loop body against the current one, using stub pins so no I2C time is included
+# The original loop formatted and wrote each row itself, whereas the current loop leaves that to the writer thread
+# so the writer's share of the current cost is measured by draining the ring through a CsvRowWriter afterwards
+# Run from the repository root with: python -m benchmarks.hotLoop
+
+import argparse
+import csv
+import io
+import time
+from array import array
+from datetime import datetime
+import acquisition
+import liveBuffer
+import logWriter
+
+
+# Stands in for an AnalogIn object, returning a fixed value with no I2C traffic
+class StubPin():
+
+    def __init__(self, value):
+        self._ads = None
+        self.reads = 0
+        self._value = value
+
+    @property
+    def value(self):
+        self.reads += 1
+        return self._value
+
+
+# The logging loop body as it was before the acquisition engine and writer thread
+# Values were read twice per pin and every row allocated new lists and formatted a datetime string
+# Returns the CPU time spent writing rows outside the loop, which is none as the loop wrote every row itself
+def LegacyFrames(pins, frames):
+    csvRows = len(pins)
+    values = [0] * csvRows
+    adcValues = [0] * csvRows
+    writer = csv.writer(io.StringIO(), dialect="excel", delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+    startTime = time.perf_counter()
+    for _ in range(frames):
+        currentDateTime = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        timeElapsed = round(time.perf_counter() - startTime, 2)
+        for idx, pin in enumerate(pins):
+            adcValues[idx] = pin.value
+            values[idx] = pin.value
+        writer.writerow([currentDateTime] + [timeElapsed] + adcValues)
+        adcValues = [0] * csvRows
+    return 0.0
+
+
+# The current logging loop body, reading each pin once into preallocated arrays
+# The rows put in the ring are then written to csv in memory as the writer thread would
+# Returns the CPU time spent by the writer
+def CurrentFrames(pins, frames):
+    engine = acquisition.AdcEngine(acquisition.CompilePlan(pins))
+    adcValues = array('h', bytes(2 * len(pins)))
+    ring = logWriter.FrameRing(frames, len(pins))
+    live = liveBuffer.LiveRing(len(pins))
+    startTime = time.perf_counter()
+    try:
+        for tick in range(frames):
+            timeElapsed = time.perf_counter() - startTime
+            engine.Read(adcValues)
+            ring.Put(tick, timeElapsed, adcValues)
+            live.Put(timeElapsed, adcValues)
+    finally:
+        live.Close()
+    start = time.process_time()
+    rowWriter = logWriter.CsvRowWriter(io.StringIO(), ["P{}".format(n) for n in range(len(pins))], datetime.now())
+    # The writer thread writes every row in the ring as one batch
+    rowWriter.WriteRows(ring, ring.tail, ring.head)
+    return time.process_time() - start
+
+
+# Run a loop body and return the CPU time per frame in microseconds (including the writer),
+# the writer's share of it in microseconds and the pin reads per frame
+def Measure(body, channels, frames):
+    pins = [StubPin(1000 * n) for n in range(channels)]
+    start = time.process_time()
+    writer = body(pins, frames)
+    cpu = time.process_time() - start
+    return cpu / frames * 1e6, writer / frames * 1e6, sum(pin.reads for pin in pins) / frames
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="Per-frame CPU cost of the logging loop")
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+    # After is the whole cost of a row, Writer is the part of it done by the writer thread rather than the loop
+    print("{:>8}|{:>14}|{:>14}|{:>14}|{:>12}|{:>12}".format("Channels", "Before (us)", "After (us)", "Writer (us)",
+                                                            "Reads Before", "Reads After"))
+    for channels in args.channels:
+        before, writerBefore, readsBefore = Measure(LegacyFrames, channels, args.frames)
+        after, writerAfter, readsAfter = Measure(CurrentFrames, channels, args.frames)
+        print("{:>8}|{:>14.2f}|{:>14.2f}|{:>14.2f}|{:>12g}|{:>12g}".format(channels, before, after, writerAfter,
+                                                                            readsBefore, readsAfter))
+
+
+if __name__ == "__main__":
+    Main()
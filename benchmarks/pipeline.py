@@ -0,0 +1,207 @@
+# Benchmark of the whole acquisition pipeline, running Logger.log end to end without a Pi
+# Each case logs for a few seconds in a separate process, exactly as the GUI runs it, in a scratch directory
+# The cases are a matrix of board source, number of channels, time interval and raw data file format:
+# - emulated boards use the register-level I2C emulator (see I2CFake.py), so I2C and conversion time is included
+# - fake boards use ADS1115Fake and AnalogInFake, so only the CPU cost of the pipeline is measured
+# For each case it reports the rows logged each second, CPU time per row, p50/p99/max jitter of the time between
+# rows and the bytes written each second, as JSON so results can be compared between releases
+# Run from the repository root with: python -m benchmarks.pipeline
+# Compare against an earlier run with: python -m benchmarks.pipeline --baseline old.json
+
+import os
+# The emulated boards are used instead of the I2C bus, so the emulator must be installed before the logger is imported
+os.environ.setdefault("LOGGER_EMULATOR", "1")
+import argparse
+import csv
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Array, Event, Process, Value
+import numpy as np
+import acquisition
+import ADS1115Fake
+import AnalogInFake
+import databaseOp as db
+import file_rw
+import hardware
+import liveBuffer
+import logObjects as lgOb
+from logger import Logger
+
+# Metrics where a higher value is worse, and the one where a lower value is worse
+HIGHER_WORSE = ("cpuPerRow", "jitterP50", "jitterP99", "jitterMax")
+LOWER_WORSE = ("rowsPerSecond",)
+
+
+# Set up a scratch working directory with a database, log config and logger settings for a case
+def SetupCase(channels, interval, fileFormat):
+    os.chdir(tempfile.mkdtemp(prefix="loggerBench"))
+    db.setupDatabase()
+    log = lgOb.LogMeta(id=1, name="Benchmark", test_number=1, time=interval, loggedBy="Benchmark",
+                       description="Benchmark")
+    for idx in range(0, 16):
+        pin = lgOb.Pin()
+        pin.id = idx
+        pin.name = "{}A{}".format(idx // 4, idx % 4)
+        pin.enabled = idx < channels
+        pin.fName = pin.name
+        pin.inputType = "Edit"
+        pin.gain = 1
+        pin.units = "V"
+        pin.m = 1.0
+        pin.c = 0.0
+        log.config.append(pin)
+    db.WriteLog(log)
+    file_rw.WriteLogConfig(log, log.name)
+    settings = file_rw.ReadSettings()
+    settings["Logging"]["fileformat"] = fileFormat
+    file_rw.WriteSettings(settings)
+
+
+# Create a Logger ready to log, reading from emulated or fake boards
+def CreateLogger(source):
+    logger = Logger()
+    silent = lambda *args, **kwargs: None
+    if source == "emulated":
+        logger.init(silent)
+    else:
+        # Fake boards can't be opened through Logger.init, so set up the pins and rate groups directly
+        logger.logEnbl = True
+        # Raw data file format of the case, read from the logger settings as Logger.init does
+        logger.fileFormat = file_rw.ReadSettings()["Logging"]["fileformat"]
+        logger.generalImport(silent)
+        logger.logComp.config = file_rw.ReadLogConfig(db.GetConfigPath(logger.logComp.id))
+        logger.logComp.SetEnabled()
+        pins = [pin for pin in logger.logComp.config if pin.enabled]
+        logger.adcHeader = [pin.name for pin in pins]
+        # Pin names give the board and input, e.g. 2A3 is input 3 of the third board
+        logger.adcToLog = [AnalogInFake.AnalogIn(ADS1115Fake.ADS1115(None, address=hardware.ADDRESSES[int(pin.name[0])]),
+                                                 int(pin.name[2]), pin.gain) for pin in pins]
+        logger.groups = acquisition.CreateGroups(logger.adcToLog, pins, logger.adcHeader, float(logger.logComp.time))
+    if not logger.logEnbl:
+        raise RuntimeError("Logger failed to initialise")
+    logger.checkTestNumber()
+    return logger
+
+
+# Runs in the log process, recording the CPU time the whole process used whilst logging
+def LogProcess(logger, stop, live, overflow, timing, cpu):
+    start = time.process_time()
+    logger.log(stop, live, overflow, timing)
+    cpu.value = time.process_time() - start
+
+
+# Returns the time elapsed of every row in a raw data file
+def RowTimes(path):
+    if path.endswith(".bin"):
+        return np.array([record[1] for record in file_rw.ReadBinary(path)])
+    with open(path, newline='') as file:
+        reader = csv.reader(file, delimiter=',', quotechar='|')
+        next(reader)
+        return np.array([float(row[1]) for row in reader])
+
+
+# Log one case for a number of seconds and measure it
+def RunCase(source, channels, interval, fileFormat, seconds):
+    home = os.getcwd()
+    SetupCase(channels, interval, fileFormat)
+    try:
+        logger = CreateLogger(source)
+        stop = Event()
+        live = liveBuffer.LiveRing(logger.logComp.enabled)
+        overflow = Value('i', 0)
+        timing = Array('d', 3, lock=False)
+        cpu = Value('d', 0.0)
+        process = Process(target=LogProcess, args=(logger, stop, live, overflow, timing, cpu))
+        process.start()
+        time.sleep(seconds)
+        stop.set()
+        process.join()
+        live.Close()
+        # Measure the main stream, which holds every pin as there is only one rate group
+        dataPath = db.GetDataPath(logger.logComp.id)
+        times = RowTimes(dataPath)
+        jitter = np.abs(np.diff(times) - interval) if len(times) > 1 else np.zeros(1)
+        duration = times[-1] if len(times) > 0 and times[-1] > 0 else seconds
+        return {"source": source, "channels": channels, "interval": interval, "format": fileFormat,
+                "rows": int(len(times)),
+                "rowsPerSecond": len(times) / duration,
+                "targetRowsPerSecond": 1 / interval,
+                "cpuPerRow": cpu.value / max(len(times), 1),
+                "jitterP50": float(np.percentile(jitter, 50)),
+                "jitterP99": float(np.percentile(jitter, 99)),
+                "jitterMax": float(jitter.max()),
+                "bytesPerSecond": sum(os.path.getsize(streamPath) for streamPath, streamInterval
+                                      in file_rw.StreamPaths(dataPath)) / duration,
+                "late": int(timing[0]),
+                "skipped": int(timing[1]),
+                "dropped": overflow.value}
+    finally:
+        scratch = os.getcwd()
+        os.chdir(home)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+# Compare results against a baseline run, returning a list of regressions
+# A regression is a metric more than tolerance worse than the baseline for the same case
+def Compare(results, baseline, tolerance):
+    key = lambda result: (result["source"], result["channels"], result["interval"], result["format"])
+    previous = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for metric in HIGHER_WORSE:
+            # Ignore changes too small to measure reliably (under 10 us)
+            if result[metric] > old[metric] * (1 + tolerance) and result[metric] - old[metric] > 10e-6:
+                regressions.append((key(result), metric, old[metric], result[metric]))
+        for metric in LOWER_WORSE:
+            if result[metric] < old[metric] * (1 - tolerance):
+                regressions.append((key(result), metric, old[metric], result[metric]))
+    return regressions
+
+
+def Main():
+    parser = argparse.ArgumentParser(description="End to end benchmark of the logging pipeline")
+    parser.add_argument("--sources", nargs="+", default=["emulated", "fake"], choices=["emulated", "fake"])
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--intervals", type=float, nargs="+", default=[0.01, 0.05])
+    parser.add_argument("--formats", nargs="+", default=["csv", "binary"], choices=["csv", "binary"])
+    parser.add_argument("--seconds", type=float, default=2.0, help="Time to log each case for")
+    parser.add_argument("--output", help="File to write the JSON results to (default stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Fraction a metric can worsen by")
+    args = parser.parse_args()
+    results = []
+    for source in args.sources:
+        for channels in args.channels:
+            for interval in args.intervals:
+                for fileFormat in args.formats:
+                    result = RunCase(source, channels, interval, fileFormat, args.seconds)
+                    results.append(result)
+                    print("{source:>8} {channels:>2} ch {interval:>6} s {format:>6}: {rowsPerSecond:9.1f} rows/s, "
+                          "{cpu:8.1f} us CPU/row, jitter p99 {p99:8.3f} ms".format(
+                              cpu=result["cpuPerRow"] * 1e6, p99=result["jitterP99"] * 1000, **result),
+                          file=sys.stderr)
+    report = {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+              "date": time.strftime("%Y-%m-%d %H:%M:%S"), "seconds": args.seconds, "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = Compare(results, json.load(file), args.tolerance)
+        for case, metric, old, new in regressions:
+            print("REGRESSION {} {}: {:g} -> {:g}".format(case, metric, old, new), file=sys.stderr)
+        if regressions != []:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,140 @@
+# This file contains the I2C bus clock tuning, which finds the fastest bus frequency the boards can be read at reliably
+# Cable length and the number of boards change how fast a bus can run, so the best frequency varies between loggers
+# Each frequency is tried in turn against the boards connected:
+# - The config register of every board is written and read back many times, counting I2C errors and any value
+#   read back that doesn't match what was written (corruption that doesn't cause an error)
+# - Every pin of every board is read for a short time to measure the values read each second
+# The fastest frequency with no errors, no mismatches and every board found is stored in the [Bus] section
+# of loggerSettings.ini and used to open the bus from then on
+# Frequencies above one that failed aren't used even if they pass, as the wiring is clearly marginal there
+# Set autotune in the [Bus] section to tune automatically at init whenever the boards connected change
+# Run benchmarks/busSweep.py to tune by hand and see the results of each frequency
+# Note - on the Pi the Linux I2C driver sets the clock from dtparam=i2c_arm_baudrate in /boot/config.txt and
+# ignores the frequency asked for. Sweeping would measure the same clock every time, so only the clock the kernel
+# set is measured, and that is the frequency stored. The clock is changed in /boot/config.txt.
+
+import time
+from array import array
+from datetime import datetime
+# hardware is imported first as it installs the I2C emulator if set to (see I2CFake.py)
+import hardware
+# Tries to import modules for Pi
+try:
+    from adafruit_ads1x15.analog_in import AnalogIn
+# If on a laptop/dev computer, above will fail
+# Import fake dev modules instead
+except:
+    from AnalogInFake import AnalogIn as AnalogIn
+import acquisition
+import file_rw
+
+# Bus frequencies tried: standard mode, fast mode, fast mode plus and 1.7 MHz for short, lightly loaded buses
+FREQUENCIES = [100000, 400000, 1000000, 1700000]
+# Config register word written and read back to check the bus, as DETECT_CONFIG without starting a conversion
+CHECK_CONFIG = hardware.DETECT_CONFIG & 0x7FFF
+
+
+# Measure the boards at a single bus frequency
+# expected is the number of boards that should be found
+# Returns a dictionary of the frequency, boards found, register checks done, I2C errors, mismatched read backs,
+# values read each second and whether the frequency is stable
+def MeasureFrequency(frequency, settings, expected, checks=200, seconds=0.5):
+    result = {"frequency": frequency, "boards": 0, "checks": 0, "errors": 0, "mismatches": 0,
+              "valuespersecond": 0.0, "stable": False}
+    bus = hardware.OpenBus(frequency)
+    if isinstance(bus, str):
+        return result
+    try:
+        adcs = [adc for adc in hardware.OpenBoards(bus, settings) if adc != ""]
+        result["boards"] = len(adcs)
+        if adcs == [] or not hasattr(adcs[0], "i2c_device"):
+            return result
+        # Write the config register of every board and read it back
+        readBack = bytearray(2)
+        configWrite = bytes([acquisition.POINTER_CONFIG, CHECK_CONFIG >> 8, CHECK_CONFIG & 0xFF])
+        while not bus.try_lock():
+            pass
+        try:
+            for _ in range(0, checks):
+                for adc in adcs:
+                    result["checks"] += 1
+                    try:
+                        bus.writeto(adc.i2c_device.device_address, configWrite)
+                        bus.readfrom_into(adc.i2c_device.device_address, readBack)
+                    except OSError:
+                        result["errors"] += 1
+                        continue
+                    # The OS bit reads back differently to how it is written, so it is left out
+                    if (readBack[0] << 8 | readBack[1]) & 0x7FFF != CHECK_CONFIG:
+                        result["mismatches"] += 1
+        finally:
+            bus.unlock()
+        # Read every pin of every board in single-shot mode, as the logging loop would
+        pins = [AnalogIn(ads=adc, positive_pin=pin, gain=1) for adc in adcs for pin in range(0, 4)]
+        engine = acquisition.AdcEngine(acquisition.CompilePlan(pins, allowContinuous=False))
+        values = array('h', bytes(2 * len(pins)))
+        reads = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            engine.Read(values)
+            reads += 1
+        result["valuespersecond"] = reads * len(pins) / (time.perf_counter() - start)
+        result["errors"] += engine.recovery.errors
+        result["stable"] = result["boards"] == expected and result["errors"] == 0 and result["mismatches"] == 0
+        return result
+    finally:
+        try:
+            bus.deinit()
+        except (OSError, AttributeError):
+            pass
+
+
+# Try each bus frequency and pick the fastest stable one
+# Returns the frequency picked (None if no frequency was stable) and the measurements of every frequency
+def TuneBus(settings, frequencies=FREQUENCIES, printFunc=print):
+    # Only the clock the kernel set can be used, so it is the only one checked
+    kernelFrequency = hardware.KernelFrequency()
+    if kernelFrequency is not None:
+        printFunc("I2C bus clock is set to {} kHz by the kernel. To try other frequencies, set "
+                  "dtparam=i2c_arm_baudrate in /boot/config.txt and reboot".format(kernelFrequency // 1000))
+        frequencies = [kernelFrequency]
+    # Boards are counted at the slowest frequency, which is the most likely to find every board
+    expected = MeasureFrequency(min(frequencies), settings, 0, checks=0, seconds=0)["boards"]
+    results = []
+    for frequency in sorted(frequencies):
+        result = MeasureFrequency(frequency, settings, expected)
+        printFunc("{} kHz: {} boards, {} errors, {} mismatches, {} values/s{}"
+                  .format(frequency // 1000, result["boards"], result["errors"], result["mismatches"],
+                          round(result["valuespersecond"]), "" if result["stable"] else " - unstable"))
+        results.append(result)
+    # Use the fastest frequency before the first one that isn't stable
+    best = None
+    for result in results:
+        if not result["stable"]:
+            break
+        best = result["frequency"]
+    return best, results
+
+
+# Store the bus frequency found, along with the boards it was found for
+def SaveFrequency(frequency, boardTypes):
+    settings = file_rw.ReadSettings()
+    settings["Bus"]["frequency"] = str(frequency)
+    settings["Bus"]["boards"] = ",".join(boardTypes)
+    settings["Bus"]["tuned"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    file_rw.WriteSettings(settings)
+
+
+# Returns True if autotune is on and the bus hasn't been tuned for the boards connected
+def NeedsTuning(settings, boardTypes):
+    section = settings["Bus"]
+    return section.getboolean("autotune") and (section["tuned"] == "" or section["boards"] != ",".join(boardTypes))
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -1,17 +1,194 @@
 # This script handles all interactions with the database
 # It contains functions which other scripts can use to interact with the database
-
+# Each thread (and process) keeps its own connection open and reuses it, rather than connecting for every query
+# sqlite3 caches the prepared statements of each connection, so reusing it also saves preparing them again
+# The database is kept in WAL mode, so the log process and TCP threads can read whilst another writes
+# Reads run in the thread that asks for them, but every write is queued to a single writer thread in each process
+# The writer commits a burst of queued writes in one transaction (group commit), so TCP clients and the logger
+# never fight over the write lock, and the caller only carries on once its write has been committed
+# Writers in different processes (the GUI and log worker) take turns through SQLite's own lock
+
+import os
+import queue
+import re
 import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import wraps
 import file_rw
 import logObjects as lgOb
 
 # Global database variable holds the path to database
 database = r"logs.db"
+# Seconds to wait for another connection to finish writing before giving up
+BUSY_TIMEOUT = 10
+# Pragmas set on every new connection
+# WAL mode only needs to be set once for the database, but setting it again costs nothing
+# synchronous NORMAL only syncs the SD card at checkpoints, which is safe in WAL mode
+PRAGMAS = ["PRAGMA journal_mode = WAL;",
+           "PRAGMA synchronous = NORMAL;",
+           "PRAGMA cache_size = -2000;",
+           "PRAGMA temp_store = MEMORY;"]
+
+# Most writes committed together by the writer thread
+GROUP_MAX = 64
+# Search terms shorter than this can't use the full text search table (trigrams are three characters)
+FTS_MIN_LENGTH = 3
+# True once the full text search table has been set up (see setupDatabase)
+fts = False
+# Raw data file names written by file_rw.DataPath, giving the timestamp, the stream suffix (if any) and the extension
+RAW_NAME = re.compile(r"raw(\d{8}-\d{6})(-.+ms)?\.(csv|bin)$")
+
+# SQL statements to create the downloads table and full text search table with the triggers that keep it up to date
+sql_create_downloads_table = """CREATE TABLE IF NOT EXISTS downloads (
+                                    user text NOT NULL,
+                                    log_id integer NOT NULL REFERENCES main (id),
+                                    PRIMARY KEY (user, log_id)) WITHOUT ROWID;"""
+sql_create_files_table = """CREATE TABLE IF NOT EXISTS files (
+                                path text PRIMARY KEY NOT NULL,
+                                mtime real NOT NULL,
+                                bytes integer NOT NULL) WITHOUT ROWID;"""
+sql_create_fts_table = """CREATE VIRTUAL TABLE IF NOT EXISTS main_fts
+                              USING fts5(name, description, content='main', content_rowid='id', tokenize='trigram');"""
+sql_create_fts_triggers = ["""CREATE TRIGGER IF NOT EXISTS main_fts_insert AFTER INSERT ON main BEGIN
+                                  INSERT INTO main_fts (rowid, name, description)
+                                      VALUES(new.id, new.name, new.description);
+                              END;""",
+                           """CREATE TRIGGER IF NOT EXISTS main_fts_delete AFTER DELETE ON main BEGIN
+                                  INSERT INTO main_fts (main_fts, rowid, name, description)
+                                      VALUES('delete', old.id, old.name, old.description);
+                              END;""",
+                           """CREATE TRIGGER IF NOT EXISTS main_fts_update AFTER UPDATE OF name, description ON main BEGIN
+                                  INSERT INTO main_fts (main_fts, rowid, name, description)
+                                      VALUES('delete', old.id, old.name, old.description);
+                                  INSERT INTO main_fts (rowid, name, description)
+                                      VALUES(new.id, new.name, new.description);
+                              END;"""]
+
+# Connection of each thread, along with the process and database path it was opened for
+local = threading.local()
+# Writer thread of this process, started the first time something is written
+writer = None
+writerLock = threading.Lock()
+
+
+# Returns the connection of this thread, opening it the first time it is used
+# A new connection is opened after a fork, or if the database path (or working directory) has changed
+def Connect():
+    path = os.path.abspath(database)
+    if getattr(local, "conn", None) is None or local.pid != os.getpid() or local.path != path:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        local.conn = conn
+        local.pid = os.getpid()
+        local.path = path
+        local.depth = 0
+    return local.conn
+
+
+# Commit the changes made on a connection, unless they are part of a transaction (see Transaction)
+def Commit(conn):
+    if local.depth == 0:
+        conn.commit()
+
+
+# Group every database update made in the with block into a single transaction
+# Takes the write lock at the start, so reads in the block see the same data as the writes
+# Everything is rolled back if an exception occurs, and transactions can be nested
+@contextmanager
+def Transaction():
+    conn = Connect()
+    if local.depth == 0:
+        conn.execute("BEGIN IMMEDIATE;")
+    local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        local.depth -= 1
+        if local.depth == 0:
+            conn.rollback()
+        raise
+    local.depth -= 1
+    if local.depth == 0:
+        conn.commit()
 
-# Creates the main table in the database if it doesn't already exist
-# Runs DatabaseCheck() to check various values are valid and correct
+
+# Single writer thread which carries out every write made in this process
+# Writes are queued as (future, function, arguments) and the result or exception is passed back through the future
+class DatabaseWriter():
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.Run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Queue a write and wait for it to be committed, returning the result of the function
+    def Submit(self, func, *args):
+        future = Future()
+        self.queue.put((future, func, args))
+        return future.result()
+
+    # Take every write waiting in the queue (up to GROUP_MAX) and commit them in a single transaction
+    # Each write runs in its own savepoint, so a write that fails is undone without affecting the others
+    def Run(self):
+        while True:
+            requests = [self.queue.get()]
+            while len(requests) < GROUP_MAX:
+                try:
+                    requests.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            results = []
+            try:
+                with Transaction() as conn:
+                    for future, func, args in requests:
+                        conn.execute("SAVEPOINT request;")
+                        try:
+                            results.append((future, func(*args), None))
+                        except Exception as error:
+                            conn.execute("ROLLBACK TO request;")
+                            results.append((future, None, error))
+                        conn.execute("RELEASE request;")
+            # If the transaction itself failed (e.g. the database stayed locked), every write in it failed
+            except Exception as error:
+                results = [(future, None, error) for future, func, args in requests]
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+
+# Returns the writer thread of this process, starting it the first time (and again after a fork)
+def GetWriter():
+    global writer
+    with writerLock:
+        if writer is None or writer.pid != os.getpid():
+            writer = DatabaseWriter()
+        return writer
+
+
+# Decorator for functions that write to the database
+# Called from any thread other than the writer, the function is queued to the writer thread and waited for
+# Called from the writer thread itself (e.g. one write calling another) it just runs
+def QueuedWrite(func):
+    @wraps(func)
+    def Queued(*args):
+        if writer is not None and writer.pid == os.getpid() and threading.current_thread() is writer.thread:
+            return func(*args)
+        return GetWriter().Submit(func, *args)
+    return Queued
+
+
+# Creates the main table in the database if it doesn't already exist, along with its indexes,
+# the full text search table, the downloads table and the files table
+# DatabaseCheck() is run in the background by the reconciler (see reconciler.py) rather than here
+@QueuedWrite
 def setupDatabase():
-    global database
     # SQL statement to create main table
     # This table will hold all the log meta data
     sql_create_main_table = """CREATE TABLE IF NOT EXISTS main (
@@ -30,37 +207,69 @@ def setupDatabase():
                                         size integer,
                                         description text DEFAULT '');"""
     # Connect to database and execute SQL statement
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     cur.execute(sql_create_main_table)
-    conn.commit()
-    conn.close()
-    DatabaseCheck()
+    # Modification time and length of each raw data file when its size was last counted (see ReconcileFiles)
+    cur.execute(sql_create_files_table)
+    # Index the columns searched for exact values, and the name and date
+    for column in ["project", "work_pack", "job_sheet", "name", "date"]:
+        cur.execute("CREATE INDEX IF NOT EXISTS main_{0} ON main ({0});".format(column))
+    # Each user that has downloaded a log is held in its own row, so logs not yet downloaded by a user
+    # can be found through the primary key rather than searching the text of downloaded_by
+    # downloaded_by is still kept up to date as it is part of the exported database
+    if not TableExists(cur, "downloads"):
+        cur.execute(sql_create_downloads_table)
+        # Fill the table from the users already in downloaded_by
+        for id, downloaded in cur.execute("SELECT id, downloaded_by FROM main;").fetchall():
+            for user in (downloaded or "").split(";"):
+                if user != "":
+                    cur.execute("INSERT OR IGNORE INTO downloads (user, log_id) VALUES(?,?);", [user, id])
+    # Name and description are searched through a full text search table, kept up to date by triggers on main
+    # The trigram tokenizer matches any part of a word, so searches find the same logs as LIKE '%...%' did
+    # If the SQLite version doesn't support it, searches use LIKE instead
+    global fts
+    try:
+        if not TableExists(cur, "main_fts"):
+            cur.execute(sql_create_fts_table)
+            # Index the logs already in main
+            cur.execute("INSERT INTO main_fts (main_fts) VALUES('rebuild');")
+        for trigger in sql_create_fts_triggers:
+            cur.execute(trigger)
+        fts = True
+    except sqlite3.OperationalError:
+        fts = False
+    Commit(conn)
     return
 
 
+# Returns True if a table exists in the database
+def TableExists(cur, name):
+    return cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?;", [name]).fetchone() is not None
+
+
 # Write new log metadata to the main database table
+# Returns the id of the new entry
+@QueuedWrite
 def WriteLog(newLog):
-    global database
     # Get list of values to write
     valuesList = [newLog.name, newLog.time, newLog.loggedBy,
                   newLog.description, newLog.project,
                   newLog.work_pack, newLog.job_sheet, newLog.test_number]
     sql_insert_metadata = """INSERT INTO main (name, time, logged_by, description, project, work_pack, job_sheet, test_number)
                                         VALUES(?,?,?,?,?,?,?,?);"""
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Execute sql statement and commit
     cur.execute(sql_insert_metadata, valuesList)
-    conn.commit()
-    conn.close()
-    return
+    Commit(conn)
+    return cur.lastrowid
 
 
 # Updates log entry, used when config uploaded and no data has yet been logged for most recent entry
 # Stops multiple config uploads clogging database with dud entries
+@QueuedWrite
 def UpdateLog(newLog):
-    global database
     # This can probably be optimised, do if have time
     valuesList = [newLog.name, newLog.time, newLog.loggedBy,
                   newLog.description, newLog.project,
@@ -68,18 +277,57 @@ def UpdateLog(newLog):
     sql_insert_metadata = """UPDATE main 
                              SET name = ?, time = ?, logged_by = ?, description = ?, project = ?, work_pack = ?, job_sheet = ?, test_number = ?
                              WHERE id = ?;"""
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Execute sql statement and commit
     cur.execute(sql_insert_metadata, valuesList)
-    conn.commit()
-    conn.close()
+    Commit(conn)
+
+
+# Adds the entry for a newly uploaded config, filling in the id and test number of newLog
+# The most recent entry is reused if it hasn't been logged yet, so config uploads don't clog the database
+# This runs on the writer thread, so no other write can get in between finding the id and writing the entry
+@QueuedWrite
+def NewLog(newLog):
+    # Get the current test number for the name
+    # If there are no logs with the name, returns 0
+    newLog.test_number = GetTestNumber(newLog.name)
+    try:
+        newLog.id = GetRecentId()
+        # If most recent entry doesn't have data set, write new config there
+        if CheckDataTable(newLog.id) is False:
+            # If log name has changed, increment test number to correct number
+            if newLog.name != GetName(newLog.id):
+                newLog.test_number += 1
+            UpdateLog(newLog)
+        # If most recent entry does have data set, increment the test number and write new entry
+        else:
+            newLog.test_number += 1
+            newLog.id = WriteLog(newLog)
+    # Exception occurs when there are no logs in the database
+    # Write log with test number 1
+    except ValueError:
+        newLog.test_number = 1
+        newLog.id = WriteLog(newLog)
+    return newLog
+
+
+# Adds a new entry for a log whose entry already has data, filling in the new id and test number of log
+# Used when logging again without uploading a new config, so the finished log isn't overwritten
+# Returns True if a new entry was added
+# This runs on the writer thread, so no other write can get in between checking the entry and adding the new one
+@QueuedWrite
+def NextLog(log):
+    if CheckDataTable(str(log.id)) is False:
+        return False
+    log.test_number = GetTestNumber(log.name) + 1
+    log.id = WriteLog(log)
+    return True
 
 
 # Gets the Id for the most recent log from the database
 def GetRecentId():
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Most recent id will be the largest as it increments for each new log
     cur.execute("SELECT MAX(id) FROM main;")
@@ -88,7 +336,6 @@ def GetRecentId():
     # Error is caught by code which called GetRecentId()
     if logId == None:
         raise ValueError
-    conn.close()
     return logId
 
 
@@ -96,8 +343,7 @@ def GetRecentId():
 # Used in GeneralImport on new log start
 def GetRecentMetaData():
     id = GetRecentId()
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Execute statement to get relevant meta data from database
     row = cur.execute("SELECT id, project, work_pack, job_sheet, name, test_number, time, logged_by, description FROM main WHERE id = ?;",[id]).fetchone()
@@ -115,38 +361,31 @@ def GetRecentMetaData():
     logMeta.time = row[6]
     logMeta.loggedBy = row[7]
     logMeta.description = row[8]
-    conn.close()
     return logMeta
 
 
 # Sets a log to downloaded once a user has downloaded
+@QueuedWrite
 def SetDownloaded(id,user):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
-    # Get the current value for downloaded_by
-    downloaded = cur.execute("SELECT downloaded_by FROM main WHERE id = ?;",[id]).fetchone()[0]
-    if downloaded is None:
-        downloaded = ""
-    # If the user is not already set to downloaded, add user
+    # Add the user to the downloads table, unless they have already downloaded the log
     # Otherwise repetitions can be caused
-    if user not in downloaded:
+    cur.execute("INSERT OR IGNORE INTO downloads (user, log_id) VALUES(?,?);", [user, int(id)])
+    if cur.rowcount == 1:
         # Update row to include the username in the downloaded_by field
         cur.execute("UPDATE main SET downloaded_by = downloaded_by || \';\' || ? WHERE id = ?;", [user, str(id)])
-        conn.commit()
-    conn.close()
+    Commit(conn)
     return
 
 
 # Check if a raw data entry already exists for a log
 # Used to make sure there are no dud entries and complete entries are not overwritten
 def CheckDataTable(id):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Returns the data entry for the specific log id
     data_exists = cur.execute("SELECT data FROM main WHERE id = ?;",[id]).fetchone()
-    conn.close()
     # If nothing is returned, the log doesn't have a data entry
     if data_exists[0] == None:
         return False
@@ -158,32 +397,17 @@ def CheckDataTable(id):
 # Reads metadata for config
 # Used when sending config data to client
 def ReadConfigMeta(id):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Retrieves time interval, description, name, project, work_pack and job_sheet
     values = cur.execute("SELECT time, description, name, project, work_pack, job_sheet FROM main WHERE id = ?;",[id]).fetchone()
-    conn.close()
     return values
 
 
-# Updates the date entry for the log after the log is complete
-def AddDate(timestamp,id):
-    global database
-    conn = sqlite3.connect(database)
-    cur = conn.cursor()
-    # Updates date of log to the datetime when the log was started
-    cur.execute("UPDATE main SET date = ? WHERE id = ?;", [timestamp,str(id)])
-    conn.commit()
-    conn.close()
-    return
-
-
 # Searches for a log using arguments specified by user
 # Used when Downloading a log or config from Pi
 def SearchLog(args):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # sql statement is dynamically built using arguments
     sql = "SELECT id, name, test_number, date, project, work_pack, job_sheet, description, size FROM main WHERE "
@@ -191,21 +415,27 @@ def SearchLog(args):
     values = []
     # Uses args dictionary to dynamically generate SQL query
     for key in args.keys():
-        if key == "date" or key == "name" or key == "description":
+        # name and description are given as LIKE patterns ('%' + text + '%')
+        # Use the full text search table for them, unless the text is too short or holds LIKE wildcards
+        term = args[key].strip('%') if key == "name" or key == "description" else ""
+        if fts and len(term) >= FTS_MIN_LENGTH and "%" not in term and "_" not in term:
+            sql += "id IN (SELECT rowid FROM main_fts WHERE main_fts MATCH ?) AND "
+            values.append('{} : "{}"'.format(key, term.replace('"', '""')))
+        elif key == "date" or key == "name" or key == "description":
             sql += key + " LIKE ? AND "
             values.append(args[key])
+        # Logs not yet downloaded by the user given
         elif key == "downloaded_by":
-            sql += key + " NOT LIKE ? AND "
+            sql += "NOT EXISTS (SELECT 1 FROM downloads WHERE downloads.user = ? AND downloads.log_id = main.id) AND "
             values.append(args[key])
         else:
             sql += key + " = ? AND "
             values.append(args[key])
     # Add data is NOT NULL to make sure only logs with datafiles can be downloaded
-    sql += "config IS NOT NULL AND data IS NOT NULL;"
+    sql += "config IS NOT NULL AND data IS NOT NULL ORDER BY id;"
     # Fetch all logs that match query
     logs = cur.execute(sql,values).fetchall()
     # If no logs found, throw error which is caught
-    conn.close()
     if logs == []:
         raise ValueError
     return logs
@@ -214,8 +444,7 @@ def SearchLog(args):
 # Reads full log from the database
 # Used for downloading logs from Pi
 def ReadLog(id):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     logMeta = lgOb.LogMeta()
     # Get the metadata for the log from main table
@@ -238,72 +467,60 @@ def ReadLog(id):
         logMeta.description = ""
     # Get config data for log
     logMeta.config = file_rw.ReadLogConfig(logMeta.config_path)
-    conn.close()
     return logMeta
 
 
 # Updates the config path of a log
+@QueuedWrite
 def UpdateConfigPath(id,path):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Updates the path in the database to match the actual file
     cur.execute("UPDATE main SET config = ? WHERE id = ?;", [path, str(id)])
-    conn.commit()
-    conn.close()
+    Commit(conn)
     return
 
 
 # Returns the path of the config file for a specific log
 def GetConfigPath(id):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     path = cur.execute("SELECT config FROM main WHERE id = ?;", [str(id)]).fetchone()[0]
-    conn.commit()
-    conn.close()
+    Commit(conn)
     return path
 
 
 # Returns the path of the data file for a specific log
 def GetDataPath(id):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     path = cur.execute("SELECT data FROM main WHERE id = ?;", [str(id)]).fetchone()[0]
-    conn.commit()
-    conn.close()
+    Commit(conn)
     return path
 
 
-# Updates the data path of a log
-def UpdateDataPath(id,path):
-    global database
-    conn = sqlite3.connect(database)
-    cur = conn.cursor()
-    # Updates the path in the database to match the actual file
-    cur.execute("UPDATE main SET data = ? WHERE id = ?;", [path, str(id)])
-    conn.commit()
-    conn.close()
+# Updates the date and config path of a log when it starts logging
+@QueuedWrite
+def LogStarted(id, timestamp, configPath):
+    conn = Connect()
+    conn.execute("UPDATE main SET date = ?, config = ? WHERE id = ?;", [timestamp, configPath, str(id)])
+    Commit(conn)
     return
 
 
-# Updates the size entry to match the actual file size of data
-def UpdateSize(id,size):
-    global database
-    conn = sqlite3.connect(database)
-    cur = conn.cursor()
-    cur.execute("UPDATE main SET size = ? WHERE id = ?;", [size, str(id)])
-    conn.commit()
-    conn.close()
+# Updates the data path and size of a log when it has finished logging
+@QueuedWrite
+def LogFinished(id, dataPath, size):
+    conn = Connect()
+    conn.execute("UPDATE main SET data = ?, size = ? WHERE id = ?;", [dataPath, size, str(id)])
+    Commit(conn)
     return
 
 
 # Returns the highest test number for a given log name
 # Used in automatically incrementing test number
 def GetTestNumber(name):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Retrieves all current test numbers for that name
     numbers = cur.execute("SELECT test_number FROM main WHERE name = ?;",[str(name)]).fetchall()
@@ -312,7 +529,6 @@ def GetTestNumber(name):
     for num in numbers:
         if int(num[0]) > max_num:
             max_num = int(num[0])
-    conn.close()
     # If no logs have the name, this will return 0
     return max_num
 
@@ -320,74 +536,156 @@ def GetTestNumber(name):
 # Gets the name of a log from an id
 # Used during config upload
 def GetName(id):
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     name = cur.execute("SELECT name FROM main WHERE id = ?;",[id]).fetchone()
-    conn.close()
     return name[0]
 
 
 # Retrieves the table information for main table and all the data stored in main
 # Used to export a copy of the database for the user
 def GetDatabase():
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
     # Get info about main table e.g. column headings, column data types, etc.
     info = cur.execute("PRAGMA TABLE_INFO(main)").fetchall()
     # Get all data inside main
     data = cur.execute("SELECT * FROM main").fetchall()
-    conn.close()
     return info, data
 
 
 # Checks that various values in database are valid and correct
 # Checks that file paths tie to files
+# Only the sizes of logs whose raw data has changed since they were last counted are counted again
 def DatabaseCheck():
-    global database
-    conn = sqlite3.connect(database)
+    conn = Connect()
     cur = conn.cursor()
+    # Every data and config file in the database, and the raw data files that could belong to
+    # entries that were logged but are missing logData
+    paths = set(row[0] for row in cur.execute("SELECT data FROM main WHERE data IS NOT NULL UNION "
+                                              "SELECT config FROM main WHERE config IS NOT NULL UNION "
+                                              "SELECT path FROM files;"))
+    for row in cur.execute("SELECT date FROM main WHERE data IS NULL AND date IS NOT NULL;").fetchall():
+        paths.add(file_rw.DataPath(row[0], "binary"))
+        paths.add(file_rw.DataPath(row[0]))
+    ReconcileFiles(sorted(paths))
+    FillEmptyText()
+    return
+
 
-    # Scan through database and find any entries missing logData
-    # Try to find data file and update
-    rows = cur.execute("SELECT id, date FROM main WHERE data is NULL;").fetchall()
-    if rows != None:
-        for row in rows:
-            path = file_rw.CheckData("files/outbox/raw{}.csv".format(row[1]))
-            if path != "":
-                UpdateDataPath(row[0], path)
-
-    # Find entries with logData and make sure file still exists
-    rows = cur.execute("SELECT id, data FROM main WHERE data IS NOT NULL;").fetchall()
-    if rows != None:
-        for row in rows:
-            path = file_rw.CheckData(row[1])
-            if path == "":
-                UpdateDataPath(row[0], None)
-
-    # Find entries with data and no size and update size
-    rows = cur.execute("SELECT id FROM main WHERE data is NOT NULL AND size is NULL;").fetchall()
-    if rows != None:
-        for row in rows:
-            UpdateSize(row[0], file_rw.GetSize(GetDataPath(row[0])))
-
-    # Find entries with config and make sure file still exists
-    rows = cur.execute("SELECT id, config FROM main WHERE config IS NOT NULL;").fetchall()
-    if rows != None:
-        for row in rows:
-            path = file_rw.CheckData(row[1])
-            if path == "":
-                UpdateConfigPath(row[0], None)
-
-    # If downloaded_by or description are NULL, set to empty string
+# If downloaded_by or description are NULL, set to empty string
+@QueuedWrite
+def FillEmptyText():
+    conn = Connect()
+    cur = conn.cursor()
     empty = ""
     cur.execute("UPDATE main SET downloaded_by = ? WHERE downloaded_by is NULL;", [empty])
     cur.execute("UPDATE main SET description = ? WHERE description is NULL;", [empty])
-    conn.commit()
-    conn.close()
+    Commit(conn)
     return
 
+
+# Checks the data and config files of a single log
+# Used when a file of the log can't be found, instead of checking the whole database
+def ReconcileLog(id):
+    conn = Connect()
+    row = conn.execute("SELECT data, config, date FROM main WHERE id = ?;", [str(id)]).fetchone()
+    if row is None:
+        return
+    paths = [path for path in row[:2] if path is not None]
+    if row[0] is None and row[2] is not None:
+        paths += [file_rw.DataPath(row[2], "binary"), file_rw.DataPath(row[2])]
+    ReconcileFiles(sorted(paths))
+    return
+
+
+# Brings the database up to date with files that have changed, been added or been removed
+# paths can hold raw data files (of any stream) and config files
+# - Data and config paths of files that no longer exist are cleared
+# - Raw data files of entries that were logged but are missing logData are added to the entry
+# - The size of a log is only counted again if it has no size, or its raw data changed since it was counted
+# - Raw data files still being written by a running log are left alone until the log finishes
+# Files are checked and counted in the calling thread, and only the updates are queued to the writer thread
+# so counting a large file never holds the write lock
+def ReconcileFiles(paths):
+    conn = Connect()
+    cur = conn.cursor()
+    # Config files that no longer exist, and the updates for each raw data file
+    # Updates hold the raw data path, its modification time and length (None if it doesn't exist),
+    # the id of its entry, whether the entry is missing logData and its size (None if it doesn't need setting)
+    configs = []
+    updates = []
+    # Main raw data file of each path, and whether the size must be counted again
+    # A change to any stream changes the size of the log, so changes to streams always count again
+    dataPaths = {}
+    for path in paths:
+        match = RAW_NAME.search(path)
+        if match is not None:
+            dataPath = path[:match.start()] + "raw{}.{}".format(match.group(1), match.group(3))
+            dataPaths[dataPath] = dataPaths.get(dataPath, False) or match.group(2) is not None
+        elif not os.path.exists(path):
+            configs.append(path)
+    for dataPath in sorted(dataPaths):
+        if file_rw.DataInUse(dataPath):
+            continue
+        stat = FileStat(dataPath)
+        row = cur.execute("SELECT id, size FROM main WHERE data = ?;", [dataPath]).fetchone()
+        if stat is None:
+            updates.append((dataPath, None, None if row is None else row[0], False, None))
+            continue
+        missing = False
+        if row is None:
+            date = RAW_NAME.search(dataPath).group(1)
+            row = cur.execute("SELECT id, size FROM main WHERE data IS NULL AND date = ?;", [date]).fetchone()
+            if row is None:
+                continue
+            missing = True
+            row = (row[0], None)
+        counted = cur.execute("SELECT mtime, bytes FROM files WHERE path = ?;", [dataPath]).fetchone()
+        size = None
+        if row[1] is None or dataPaths[dataPath] or (counted is not None and counted != stat):
+            size = file_rw.GetSize(dataPath)
+        updates.append((dataPath, stat, row[0], missing, size))
+    if configs != [] or updates != []:
+        UpdateFiles(configs, updates)
+    return
+
+
+# Writes the updates worked out by ReconcileFiles
+# Entries are only changed if they still match what was checked, in case a log finished whilst the files were checked
+# Binary files are updated before csv files, so binary raw data is preferred for entries missing logData
+@QueuedWrite
+def UpdateFiles(configs, updates):
+    conn = Connect()
+    cur = conn.cursor()
+    for path in configs:
+        cur.execute("UPDATE main SET config = NULL WHERE config = ?;", [path])
+    for dataPath, stat, id, missing, size in updates:
+        if stat is None:
+            if id is not None:
+                cur.execute("UPDATE main SET data = NULL WHERE id = ? AND data = ?;", [str(id), dataPath])
+            cur.execute("DELETE FROM files WHERE path = ?;", [dataPath])
+            continue
+        if missing:
+            cur.execute("UPDATE main SET data = ? WHERE id = ? AND data IS NULL;", [dataPath, str(id)])
+            # Another file (or the log finishing) has already filled in logData
+            if cur.rowcount == 0:
+                continue
+        if size is not None:
+            cur.execute("UPDATE main SET size = ? WHERE id = ? AND data = ?;", [size, str(id), dataPath])
+        cur.execute("INSERT OR REPLACE INTO files (path, mtime, bytes) VALUES(?,?,?);", [dataPath, stat[0], stat[1]])
+    Commit(conn)
+    return
+
+
+# Returns the modification time and length of a file, or None if it doesn't exist
+def FileStat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
 # This is the code that is run when the program is loaded.
 # If the module were to be imported, the code inside the if statement would not run.
 if __name__ == "__main__":
@@ -5,10 +5,74 @@
 import logObjects as lgOb
 import databaseOp as db
 import configparser
+import csv
+import glob
+import struct
+from datetime import datetime, timedelta
 from decimal import Decimal
 import os
 import os.path
 from os import path
+try:
+    import fcntl
+# fcntl module is not available on Windows
+except ImportError:
+    fcntl = None
+
+# Settings file for settings specific to this logger rather than to a single log
+settingsPath = "loggerSettings.ini"
+# Default values for any settings missing from the settings file
+# fileformat is either csv or binary
+# Realtime holds the opt-in real-time scheduling profile for the log process (see realtime.py)
+# Boards holds the type of board at each address - auto, ADS1115, ADS1015 or none (see hardware.py)
+# Planner sets when a config is warned about or refused, and Calibration holds the register costs it measures
+# Replay sets a recorded raw data file to log instead of the boards, replayed in real time or as fast as possible
+# Bus holds the I2C bus frequency, and whether it is tuned automatically for the boards connected (see busTune.py)
+defaultSettings = {"Logging": {"fileformat": "csv"},
+                   "Boards": {"0x48": "auto", "0x49": "auto", "0x4a": "auto", "0x4b": "auto"},
+                   "Bus": {"frequency": "1000000", "autotune": "False", "boards": "", "tuned": ""},
+                   "Realtime": {"enabled": "False", "priority": "50", "core": "3", "lockmemory": "True",
+                                "disablegc": "True"},
+                   "Planner": {"warnload": "0.8", "refuse": "True"},
+                   "Calibration": {},
+                   "Replay": {"path": "", "fast": "False"}}
+
+# Ways the values from oversampling a pin can be reduced to one value
+REDUCTIONS = ("mean", "min", "max", "iir")
+
+# Value stored in raw data for a pin that couldn't be read because of an I2C error
+# Binary files store it as it is, csv files leave the value empty
+MISSING = -32768
+
+# The number of lines in a csv raw data file is kept in a small file alongside it (the raw data path plus this suffix)
+# It holds the line count with the length and modification time of the raw data file when it was counted,
+# so a count that no longer matches the file is never used
+COUNT_SUFFIX = ".lines"
+# Bytes read at a time when counting the lines of a file
+COUNT_CHUNK = 1 << 20
+
+# Binary raw data files start with a fixed header followed by fixed width records
+# Header: magic, version, number of channels, time interval, start time (seconds since epoch),
+# length of the channel names and length of the config file text
+# The channel names and config file text follow the header
+# Version 1 records have no tick index, version 2 records start with the tick index
+BINARY_MAGIC = b"SELOGBIN"
+BINARY_VERSION = 2
+BINARY_HEADER = struct.Struct("<8sHHddII")
+
+
+# Read the logger settings, filling in defaults for anything not set
+def ReadSettings():
+    settings = configparser.ConfigParser()
+    settings.read_dict(defaultSettings)
+    settings.read(settingsPath)
+    return settings
+
+
+# Write the logger settings to file
+def WriteSettings(settings):
+    with open(settingsPath, "w") as settingsFile:
+        settings.write(settingsFile)
 
 
 # Read config data in from a config file
@@ -34,6 +98,18 @@ def ReadLogConfig(path):
             if "m" in config[section] and "c" in config[section]:
                 pin.m = config[section].getfloat('m')
                 pin.c = config[section].getfloat('c')
+            # Only add oversampling settings if they are in the config
+            if "oversample" in config[section]:
+                pin.oversample = config[section].getint('oversample')
+                pin.reduction = config[section].get('reduction', "mean")
+                pin.alpha = config[section].getfloat('alpha', 0.5)
+                if pin.oversample < 1 or pin.reduction not in REDUCTIONS or not 0 < pin.alpha <= 1:
+                    raise ValueError("Invalid oversampling settings for {}".format(pin.name))
+            # Only add the pin time interval if it is in the config
+            if "interval" in config[section]:
+                pin.interval = config[section].getfloat('interval')
+                if pin.interval < 0:
+                    raise ValueError("Invalid time interval for {}".format(pin.name))
             configData.append(pin)
     if configData == []:
         raise FileNotFoundError
@@ -66,7 +142,11 @@ def WriteLogConfig(log,name):
             file_data += "scalehigh = " + str(pin.scaleMax) + "\n"
             file_data += "unit = " + pin.units + "\n"
             file_data += "m = " + str(pin.m) + "\n"
-            file_data += "c = " + str(pin.c) + "\n\n"
+            file_data += "c = " + str(pin.c) + "\n"
+            file_data += "oversample = " + str(pin.oversample) + "\n"
+            file_data += "reduction = " + pin.reduction + "\n"
+            file_data += "alpha = " + str(pin.alpha) + "\n"
+            file_data += "interval = " + str(pin.interval) + "\n\n"
         # Write data to file
         configfile.write(file_data)
     # Update config path in database to reflect file just written
@@ -82,6 +162,143 @@ def RenameConfig(path,timestamp):
     os.rename(src=path,dst=newpath)
 
 
+# Returns the path of the raw data file for a log started at timestamp
+# Rate groups other than the main one are written to their own stream, named with their time interval in ms
+def DataPath(timestamp, fileFormat="csv", interval=None):
+    extension = "bin" if fileFormat == "binary" else "csv"
+    if interval is None:
+        return "files/outbox/raw{}.{}".format(timestamp, extension)
+    return "files/outbox/raw{}-{:g}ms.{}".format(timestamp, interval * 1000, extension)
+
+
+# Returns the path and time interval of every stream of a log from the path of its main raw data file
+# The time interval of the main stream is None, as it is the time interval of the log
+def StreamPaths(dataPath):
+    base, extension = os.path.splitext(dataPath)
+    streams = [(dataPath, None)]
+    for streamPath in glob.glob(glob.escape(base) + "-*ms" + extension):
+        # Time interval in ms is between the main file name and the ms suffix
+        try:
+            streams.append((streamPath, float(streamPath[len(base) + 1:-len("ms" + extension)]) / 1000))
+        except ValueError:
+            pass
+    # Fastest streams first after the main stream
+    streams[1:] = sorted(streams[1:], key=lambda stream: stream[1])
+    return streams
+
+
+# Returns the struct used for each record of a binary raw data file
+# Each record holds the tick index, the time elapsed since the start of the log and the value of each channel
+def BinaryRecord(channels, version=BINARY_VERSION):
+    if version == 1:
+        return struct.Struct("<d{}h".format(channels))
+    return struct.Struct("<Id{}h".format(channels))
+
+
+# Returns the header row of a csv raw data file
+def CsvHeader(names):
+    return ['Date/Time', 'Time Interval (seconds)'] + names + ['Tick']
+
+
+# Returns a row of a csv raw data file
+# The date/time is worked out from the start of the log and the time elapsed is kept to full precision
+# Missing values are left empty
+def CsvRow(startDateTime, tick, timeElapsed, values):
+    currentDateTime = (startDateTime + timedelta(seconds=timeElapsed)).strftime("%Y-%m-%d %H:%M:%S.%f")
+    if MISSING in values:
+        values = ["" if value == MISSING else value for value in values]
+    return [currentDateTime, "{:.6f}".format(timeElapsed)] + values + [tick]
+
+
+# Formats rows of a csv raw data file straight into lines, laid out as CsvRow and written by the csv module
+# Used for writing many rows, as the date and time are only formatted once a second
+# and each line is built with a single format call
+class CsvLines():
+
+    def __init__(self, startDateTime, channels):
+        # Start of the log to the second, and the microseconds past it
+        self.base = startDateTime.replace(microsecond=0)
+        self.startMicro = startDateTime.microsecond
+        # Second of the log the date/time prefix was last formatted for
+        self.second = None
+        self.prefix = ""
+        self.line = ("{}{:06d},{:.6f}," + "{}," * channels + "{}\r\n").format
+
+    # Returns the line of a row, values is a list or tuple
+    def Line(self, tick, timeElapsed, values):
+        second, micro = divmod(self.startMicro + round(timeElapsed * 1000000), 1000000)
+        if second != self.second:
+            self.prefix = (self.base + timedelta(seconds=second)).strftime("%Y-%m-%d %H:%M:%S.")
+            self.second = second
+        if MISSING in values:
+            values = ["" if value == MISSING else value for value in values]
+        return self.line(self.prefix, micro, timeElapsed, *values, tick)
+
+
+# Write the header of a binary raw data file
+def WriteBinaryHeader(file, names, interval, startTime, configText):
+    channels = len(names)
+    names = ",".join(names).encode("utf-8")
+    configText = configText.encode("utf-8")
+    file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, channels, interval,
+                                  startTime, len(names), len(configText)))
+    file.write(names)
+    file.write(configText)
+
+
+# Read the header of a binary raw data file
+# Leaves the file positioned at the first record
+def ReadBinaryHeader(file):
+    magic, version, channels, interval, startTime, namesLen, configLen = BINARY_HEADER.unpack(
+        file.read(BINARY_HEADER.size))
+    if magic != BINARY_MAGIC or version not in (1, BINARY_VERSION):
+        raise ValueError("Not a binary raw data file")
+    names = file.read(namesLen).decode("utf-8").split(",")
+    configText = file.read(configLen).decode("utf-8")
+    return {"version": version, "channels": channels, "interval": interval, "start": startTime, "names": names,
+            "config": configText, "size": BINARY_HEADER.size + namesLen + configLen}
+
+
+# Reads the records of a binary raw data file a chunk at a time
+# Yields a tuple of (tick, time elapsed, value, value, ...) for each record
+def ReadBinary(path, chunkRecords=4096):
+    with open(path, "rb") as file:
+        header = ReadBinaryHeader(file)
+        record = BinaryRecord(header["channels"], header["version"])
+        tick = 0
+        while True:
+            chunk = file.read(record.size * chunkRecords)
+            # Ignore a partly written record at the end of the file
+            chunk = chunk[:len(chunk) - len(chunk) % record.size]
+            if chunk == b"":
+                break
+            if header["version"] == 1:
+                # Version 1 records have no tick index, so number them in order
+                for values in record.iter_unpack(chunk):
+                    yield (tick,) + values
+                    tick += 1
+            else:
+                yield from record.iter_unpack(chunk)
+
+
+# Converts a binary raw data file into the csv layout used for raw data
+# Conversion is streamed so the whole file is never held in memory
+# Returns the path of the csv file, which is only rewritten if older than the binary file
+def ExportCsv(binPath):
+    csvPath = os.path.splitext(binPath)[0] + ".csv"
+    if path.exists(csvPath) and os.path.getmtime(csvPath) >= os.path.getmtime(binPath):
+        return csvPath
+    with open(binPath, "rb") as file:
+        header = ReadBinaryHeader(file)
+    lines = CsvLines(datetime.fromtimestamp(header["start"]), header["channels"])
+    with open(csvPath, "w", newline='') as csvfile:
+        writer = csv.writer(csvfile, dialect="excel", delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(CsvHeader(header["names"]))
+        for record in ReadBinary(binPath):
+            csvfile.write(lines.Line(record[0], record[1], record[2:]))
+    return csvPath
+
+
 # Used to check if a raw data file exists for a log
 def CheckData(rawpath):
     # If the file exists, return the path of the file
@@ -91,16 +308,94 @@ def CheckData(rawpath):
         return ""
 
 
-# Returns the length in lines of a raw data file
+# Mark a raw data file as being written by a running log, so database checks leave it alone (see DataInUse)
+# The lock is released when the file is closed, even if the log process dies
+# Failing to take it only means the file may be checked whilst it is written, so errors are ignored
+def LockData(file):
+    if fcntl is None:
+        return
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        pass
+
+
+# Returns True if a raw data file is still being written by a running log
+# Without fcntl (on Windows) this can't be told, so files are always treated as finished
+def DataInUse(path):
+    if fcntl is None:
+        return False
+    try:
+        with open(path, "rb") as file:
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+# Returns the length in lines of the raw data of a log, adding up the streams of every rate group
 # Used to set size for a log in the database
 def GetSize(path):
+    return sum(GetStreamSize(streamPath) for streamPath, interval in StreamPaths(path))
+
+
+# Returns the length in lines of a single raw data file
+def GetStreamSize(path):
+    # Binary files have fixed width records, so the size is worked out from the file length
+    # One is added for the header to match the line count of a csv file
+    if path.endswith(".bin"):
+        with open(path, "rb") as file:
+            header = ReadBinaryHeader(file)
+        records = (os.path.getsize(path) - header["size"]) // BinaryRecord(header["channels"], header["version"]).size
+        return records + 1
+    # csv files use the line count written alongside them, which is written by the logger as it finishes a log
+    # Files without one (e.g. from older versions) are counted once and the count kept for next time
+    lineNum = ReadLineCount(path)
+    if lineNum is None:
+        lineNum = CountLines(path)
+        WriteLineCount(path, lineNum)
+    return lineNum
+
+
+# Count the lines of a file by counting newlines a chunk at a time
+# A last line without a newline is counted too
+def CountLines(path):
     lineNum = 0
-    with open(path, "r") as file:
-        line = file.readline()
-        # Read lines until reached the end of the file
-        while line != "":
-            lineNum += 1
-            line = file.readline()
+    last = b"\n"
+    with open(path, "rb") as file:
+        chunk = file.read(COUNT_CHUNK)
+        while chunk != b"":
+            lineNum += chunk.count(b"\n")
+            last = chunk[-1:]
+            chunk = file.read(COUNT_CHUNK)
+    if last != b"\n":
+        lineNum += 1
+    return lineNum
+
+
+# Store the line count of a raw data file alongside it
+# Failing to store it only means the file is counted again next time, so errors are ignored
+def WriteLineCount(path, lineNum):
+    try:
+        stat = os.stat(path)
+        with open(path + COUNT_SUFFIX, "w") as file:
+            file.write("{} {} {}\n".format(lineNum, stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+# Returns the line count stored alongside a raw data file, or None if there isn't one or the file has changed
+def ReadLineCount(path):
+    try:
+        stat = os.stat(path)
+        with open(path + COUNT_SUFFIX) as file:
+            lineNum, size, mtime = (int(value) for value in file.read().split())
+    except (OSError, ValueError):
+        return None
+    if size != stat.st_size or mtime != stat.st_mtime_ns:
+        return None
     return lineNum
 
 # This is the code that is run when the program is loaded.
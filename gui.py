@@ -3,10 +3,16 @@
 
 import logging
 import databaseOp as db
+import file_rw
+import liveBuffer
+import logStats
+import logWorker
+import realtime
 import pandas as pd
 from pathlib import Path
 import time
 from datetime import datetime
+from decimal import Decimal
 import threading
 from tkinter import *
 from tkinter import ttk
@@ -14,7 +20,7 @@ from tkinter import font, messagebox
 import socket
 from logger import Logger
 import matplotlib.pyplot as plt
-from multiprocessing import Process, Array, Event, Pipe
+from multiprocessing import Event, Pipe
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import sys
 
@@ -22,7 +28,7 @@ import sys
 # Set up GUI controls and functions
 class WindowTop(Frame):
     # Main Window - Init function contains all elements of layout
-    def __init__(self, master=None, connGui=Pipe(), exitTcp=Event()):
+    def __init__(self, master=None, connGui=Pipe(), exitTcp=Event(), stats=None, worker=None):
         # This is class inheritance
         Frame.__init__(self, master)
         # Setting self.master = master window
@@ -84,13 +90,10 @@ class WindowTop(Frame):
         # Determines the max number of lines on the tkinter GUI at any given point.
         self.textThreshold = 250
 
-        # Create variables used for log process
-        # Note: these are initialised when logging starts
-        # Otherwise only one log can be performed
-        self.logProcess = None
-        self.stop = None
-        self.values = None
-        self.readOnce = None
+        # Create variables used for the log
+        # Note: the live ring is created when logging starts
+        self.live = None
+        self.reservedCores = None
 
         # Will later hold liveDataThread
         self.liveDataThread = None
@@ -117,6 +120,20 @@ class WindowTop(Frame):
         # Pass exitTcp event to GUI so server can be closed from GUI
         self.exitTcp = exitTcp
 
+        # Shared stats counters filled in by the log process and read by the TCP server
+        self.stats = logStats.CreateStats() if stats is None else stats
+
+        # Log worker process which sets up and runs every log (see logWorker.py)
+        # It is normally started by main.py before the GUI is imported, so it is only started here if it wasn't
+        if worker is None:
+            worker = logWorker.LogWorker(self.stats)
+            worker.Start()
+        self.worker = worker
+        # overflow counts rows dropped because the writer thread couldn't keep up with the log
+        # timing holds the number of late ticks, skipped ticks and the worst lateness in seconds
+        self.overflow = worker.overflow
+        self.timing = worker.timing
+
     # Contains functions for the start/stop logging buttons
     def logToggle(self):
         # Starting Logging
@@ -134,29 +151,19 @@ class WindowTop(Frame):
             self.liveDataText['state'] = 'disabled'
             # Scroll to Bottom of Blank Box
             self.liveDataText.see(END)
-            # Initialise logger class
+            # Initialise the log in the log worker, which also checks the test number and prints the settings
             # Any errors with importing log metadata and config data will occur here
-            # adcToLog stores AnalogIn objects which are used to get data from the ads1115 pins
-            # adcHeader stores the name of pins being logged
-            self.logger.init(self.textboxOutput)
+            # The log metadata and config are sent back for the live data output
+            self.logger.logEnbl, self.logger.logComp, self.logger.realtime = self.worker.Init(self.textboxOutput)
             # Only continue if settings import was successful
             if self.logger.logEnbl is True:
-                # Check log test number is free to use
-                # If not, the test number for this log is incremented
-                self.logger.checkTestNumber()
-                # Print Settings to Live Data Textbox
-                self.logger.settingsOutput(self.textboxOutput)
-                # Setup variables for starting log in separate process
-                # stop event controls stopping of the log process
-                self.stop = Event()
-                # values array stores a copy of the most recent values logged
-                # Used by the live data output to retrieve the data
-                self.values = Array('f', self.logger.logComp.enabled, lock=True)
-                # read once event tells gui once values have been read at least once
-                self.readOnce = Event()
-                # Setup and start log process
-                self.logProcess = Process(target=self.logger.log, args=(self.stop, self.values, self.readOnce))
-                self.logProcess.start()
+                # live ring stores every row logged in shared memory
+                # Used by the live data output to retrieve the data without taking a lock
+                self.live = liveBuffer.LiveRing(self.logger.logComp.enabled)
+                # Start the log in the worker
+                self.worker.Log(self.live)
+                # Move the GUI and TCP threads off the core reserved for logging (if real-time profile enabled)
+                self.reservedCores = realtime.ReserveCore(self.logger.realtime)
             # If settings import fails, stop the log startup
             # The reason for failure will be displayed to user in the Live Data Textbox
             else:
@@ -181,10 +188,10 @@ class WindowTop(Frame):
             self.textboxOutput("\nStopping Logger")
             # Change logEnbl variable to false which stops the loop in the live data thread
             self.logger.logEnbl = False
-            # Set stop Event to stop logProcess
-            self.stop.set()
-            # Check to see if logProcess and liveDataThread have ended
-            self.logProcess.join()
+            # Stop the log and wait for the worker to finish writing it
+            self.worker.Stop()
+            # Check to see if liveDataThread has ended
+            realtime.RestoreCores(self.reservedCores)
             self.logThreadStopCheck()
         return "Successful"
 
@@ -197,6 +204,8 @@ class WindowTop(Frame):
             self.logButton.config(text="Start Logging")
             # Tell user logging has stopped
             self.textboxOutput("Logging Stopped - Success!")
+            # Release the live data ring now the live data thread has finished with it
+            self.live.Close()
             # Check that logged data is of good quality
             self.DataCheck()
             # Re-enable Button
@@ -208,6 +217,20 @@ class WindowTop(Frame):
             # This stops the program freezing if logThread is trying to print but the GUI is occupied so it can't
             self.after(100, self.logThreadStopCheck)
 
+    # Is triggered when the log worker finishes a log without being told to stop
+    # i.e. a replay reaching the end of the recorded data, or the worker failing mid log
+    # Tidies up the same way as when 'Stop Logging' is clicked
+    def logFinished(self):
+        # Disable button
+        self.logButton['state'] = 'disabled'
+        # Print button status
+        self.textboxOutput("\nLog Finished")
+        # Change logEnbl variable to false which stops the loop in the live data thread
+        self.logger.logEnbl = False
+        # Check to see if liveDataThread has ended
+        realtime.RestoreCores(self.reservedCores)
+        self.logThreadStopCheck()
+
     # Used to output text to the Live Data Textbox
     # Is used as a parameter for logger functions so they can output to the textbox
     def textboxOutput(self, inputStr, flush=False):
@@ -325,34 +348,33 @@ class WindowTop(Frame):
         # Print a nice horizontal line so it all looks pretty
         self.textboxOutput("-" * (9 * self.logger.logComp.enabled + 1))
 
-        # Create buffer to store previous data
+        # Sequence number of the last row read from the live data ring
         # Used to detect whether new data has been logged or not
-        buffer = [0] * self.logger.logComp.enabled
+        lastSeq = 0
 
         # Don't print live data when logging has not started
-        while not self.logger.logEnbl and self.logProcess.is_alive():
-            pass
-
-        # Wait until all values have been read once
-        while not self.readOnce.is_set() and self.logger.logEnbl:
+        while not self.logger.logEnbl and self.worker.logging:
             pass
 
-        # When data has arrived, set startTime and drawTime for live graph
-        startTime = time.perf_counter()
+        # Set drawTime for live graph
         drawTime = 0
 
         # Live data loop, outputs live data to graph or textbox for as long as the log runs
         while self.logger.logEnbl:
-            # Get most recent logged data
-            currentVals = self.values[:]
-            # If data is new, output data
-            if currentVals != buffer:
-                buffer = currentVals
+            # Get every row logged since the last read
+            rows = self.live.ReadSince(lastSeq)
+            for seq, timeElapsed, currentVals in rows:
+                lastSeq = seq
                 ValuesPrint = ""
                 # Create a nice string to print with the values in
                 # Only prints data that is being logged
-                timeData.append(round(time.perf_counter() - startTime, 2))
+                timeData.append(round(timeElapsed, 2))
                 for no, val in enumerate(currentVals):
+                    # Pins that couldn't be read are shown as a gap
+                    if val == file_rw.MISSING:
+                        logData[no].append(float("nan"))
+                        ValuesPrint += ("|{:>8}".format("-"))
+                        continue
                     # Get the name of the pin so it can be used with pinDict
                     pinName = adcHeader[no]
                     # Calculate converted value using pinDict m and c values
@@ -363,6 +385,8 @@ class WindowTop(Frame):
                     ValuesPrint += ("|{:>8}".format(round(convertedVal, 2)))
                 # Print data to textbox
                 self.textboxOutput("{}|".format(ValuesPrint))
+            # If data is new, output data
+            if rows != []:
                 # If graph is showing, update graph
                 # Otherwise don't as it reduces overhead
                 if self.textBox is False:
@@ -404,6 +428,9 @@ class WindowTop(Frame):
     # This function handles commands from the TCP server
     # It is run periodically every 0.1 seconds
     def commandHandler(self):
+        # Check whether the log has stopped on its own, so the buttons and logger status are up to date
+        if self.logger.logEnbl and self.worker.Finished():
+            self.logFinished()
         # If there are no commands to process, return
         if not self.connGui.poll():
             self.after(100, self.commandHandler)
@@ -456,26 +483,48 @@ class WindowTop(Frame):
     def DataCheck(self):
         self.textboxOutput("\nLog Quality Info:")
         # Get the path of the logged raw data
-        path = Path(db.GetDataPath(self.logger.logComp.id))
-        # Read data in DataFrame
-        data = pd.read_csv(path)
-        # Count the number of lines logged
-        numLines = data['Time Interval (seconds)'].count()
-        self.textboxOutput("Logged {} lines of data".format(numLines))
-
-        # Get Series of times between each time reading
-        intervals = data['Time Interval (seconds)'].diff().dropna()
-        # Calculate number of incorrect intervals
-        incorrect = intervals[round(intervals,1) != self.logger.logComp.time].count()
-        # Output number of incorrect time intervals
-        self.textboxOutput("{} lines had a time interval not equal to {}".format(incorrect, self.logger.logComp.time))
-        # Calculate average interval between data readings
-        average = round(intervals.mean(),5)
-        # Output average time interval
-        self.textboxOutput("Average time interval: {}".format(average))
-        # Calculate maximum absolute deviation from set interval
-        maxDev = round(intervals.sub(self.logger.logComp.time).abs().max(),5)
-        self.textboxOutput("Maximum absolute deviation from set interval {} was {}".format(self.logger.logComp.time,maxDev))
+        dataPath = db.GetDataPath(self.logger.logComp.id)
+        # Check each stream of the log, one for each rate group
+        for streamPath, interval in file_rw.StreamPaths(dataPath):
+            path = Path(streamPath)
+            # The main stream is logged at the time interval of the log
+            if interval is None:
+                interval = self.logger.logComp.time
+            # Read data in DataFrame
+            if path.suffix == ".bin":
+                # Only the time interval is needed from binary files
+                data = pd.DataFrame([record[1] for record in file_rw.ReadBinary(str(path))],
+                                    columns=['Time Interval (seconds)'])
+            else:
+                data = pd.read_csv(path)
+            # Count the number of lines logged
+            numLines = data['Time Interval (seconds)'].count()
+            self.textboxOutput("Logged {} lines of data to {}".format(numLines, path.name))
+
+            # Get Series of times between each time reading
+            intervals = data['Time Interval (seconds)'].diff().dropna()
+            # Calculate number of incorrect intervals, rounding to the precision of the set interval
+            decimals = max(1, -Decimal(str(interval)).normalize().as_tuple().exponent)
+            incorrect = intervals[round(intervals, decimals) != round(interval, decimals)].count()
+            # Output number of incorrect time intervals
+            self.textboxOutput("{} lines had a time interval not equal to {}".format(incorrect, interval))
+            # Calculate average interval between data readings
+            average = round(intervals.mean(),5)
+            # Output average time interval
+            self.textboxOutput("Average time interval: {}".format(average))
+            # Calculate maximum absolute deviation from set interval
+            maxDev = round(intervals.sub(interval).abs().max(),5)
+            self.textboxOutput("Maximum absolute deviation from set interval {} was {}".format(interval,maxDev))
+        # Output timing counters kept by the log process at full precision
+        self.textboxOutput("{} rows were taken late, the worst by {} seconds"
+                           .format(int(self.timing[0]), round(self.timing[2], 6)))
+        self.textboxOutput("{} rows were skipped as the previous row overran".format(int(self.timing[1])))
+        # Output number of rows dropped because they couldn't be written to disk in time
+        self.textboxOutput("{} rows were dropped as the disk couldn't keep up".format(self.overflow.value))
+        # Output I2C errors handled by the acquisition engines
+        stats = logStats.Snapshot(self.stats)
+        self.textboxOutput("{} I2C errors, {} values missing, {} bus re-initialisations"
+                           .format(int(stats["oserrors"]), int(stats["missing"]), int(stats["businits"])))
 
 
 # Setup error logging
@@ -508,7 +557,7 @@ def stderrRedirect(buf):
 
 
 # Initialises GUI
-def run(connGui, exitTcp):
+def run(connGui, exitTcp, stats=None, worker=None):
     # PROGRAM START #
     # Start Error Logging
     errorLoggingSetup()
@@ -542,7 +591,7 @@ def run(connGui, exitTcp):
     smallFont = font.Font(family="Courier", size=11)
 
     # Create instance of GUI
-    app = WindowTop(root, connGui=connGui, exitTcp=exitTcp)
+    app = WindowTop(root, connGui=connGui, exitTcp=exitTcp, stats=stats, worker=worker)
 
     # Ensure when the program quits, it quits gracefully - e.g. stopping the log first
     root.protocol("WM_DELETE_WINDOW", app.onClose)
@@ -0,0 +1,307 @@
+# This file handles setting up the I2C bus and the ADC boards connected to it
+# Up to 4 boards can be connected at addresses 0x48 to 0x4b
+# Each address can hold an ADS1115 (16-bit, up to 860 SPS) or an ADS1015 (12-bit, up to 3300 SPS)
+# The board type for each address is set in the [Boards] section of loggerSettings.ini
+# Setting an address to auto detects the board type, none skips the address entirely
+# The bus, boards and AnalogIn objects are opened once and kept in the inventory for as long as the program runs
+# A background scan keeps the inventory up to date as boards are plugged in or unplugged, so starting a log
+# doesn't have to open the bus or probe for boards
+
+import errno
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+# Use emulated boards instead of the I2C bus if set to (see I2CFake.py)
+if os.environ.get("LOGGER_EMULATOR", "") != "":
+    import I2CFake
+    I2CFake.Install()
+# Tries to import modules for Pi
+try:
+    import adafruit_ads1x15.ads1115 as ADS1115
+    import adafruit_ads1x15.ads1015 as ADS1015
+    from adafruit_ads1x15.ads1x15 import Mode
+    from adafruit_ads1x15.analog_in import AnalogIn
+    import busio
+    import board
+# If on a laptop/dev computer, above will fail
+# Import fake dev modules instead
+except:
+    import ADS1115Fake as ADS1115
+    from ADS1115Fake import Mode
+    from AnalogInFake import AnalogIn
+    # There is no fake ADS1015, so every fake board is an ADS1115
+    ADS1015 = None
+
+# Addresses boards can be connected at
+ADDRESSES = [0x48, 0x49, 0x4a, 0x4b]
+# Each board type and the data rate it is run at (the maximum for the board)
+DATA_RATES = {"ADS1115": 860, "ADS1015": 3300}
+# Config word used to time a conversion when detecting the board type
+# Single-shot, AIN0 to GND, gain 1, fastest data rate bits (860 SPS on an ADS1115, 3300 SPS on an ADS1015)
+DETECT_CONFIG = 0xC3E3
+# Seconds between background scans for boards being plugged in or unplugged
+SCAN_INTERVAL = 2.0
+# Number of times a failed transaction is retried whilst detecting the board type
+DETECT_RETRIES = 3
+# Most times a board is polled for a finished conversion whilst detecting its type before the conversion is left out
+# Polling starts as soon as the conversion is started, so this allows many more polls than acquisition.POLL_LIMIT
+DETECT_POLL_LIMIT = 200
+# Bus clock set by the Linux I2C driver from dtparam=i2c_arm_baudrate in /boot/config.txt (big-endian, in Hz)
+KERNEL_CLOCK = "/sys/class/i2c-adapter/i2c-1/of_node/clock-frequency"
+
+
+# Create the I2C bus
+def OpenBus(frequency=1000000):
+    try:
+        return busio.I2C(board.SCL, board.SDA, frequency=frequency)
+    except:
+        return "fake"
+
+
+# Returns the bus clock set by the kernel, or None if the bus runs at the frequency it is opened with
+# On the Pi the Linux I2C driver sets the clock at boot and ignores the frequency passed to busio.I2C
+def KernelFrequency():
+    if os.environ.get("LOGGER_EMULATOR", "") != "":
+        return None
+    try:
+        with open(KERNEL_CLOCK, "rb") as file:
+            clock = file.read(4)
+    except OSError:
+        return None
+    if len(clock) != 4:
+        return None
+    return int.from_bytes(clock, "big")
+
+
+# Create an instance of the board at each address according to the logger settings
+# Returns a list with a board object for each address, or "" if no board is connected there
+def OpenBoards(i2c, settings):
+    adcs = []
+    for address in ADDRESSES:
+        boardType = settings["Boards"].get(hex(address), "auto")
+        adcs.append(OpenBoard(i2c, address, boardType))
+    return adcs
+
+
+# Create an instance of a single board
+# ValueError thrown if board not connected, OSError if it fails whilst its type is being detected
+# Not fatal as you could only be logging on one board
+# A board is tried a few times before giving up, so a single I2C glitch doesn't lose the board for the whole log
+def OpenBoard(i2c, address, boardType="auto", attempts=3):
+    if boardType == "none":
+        return ""
+    for _ in range(0, attempts):
+        try:
+            if boardType == "auto":
+                boardType = DetectBoardType(i2c, address)
+            if boardType == "ADS1015" and ADS1015 is not None:
+                return ADS1015.ADS1015(i2c, address=address, mode=Mode.SINGLE, data_rate=DATA_RATES["ADS1015"])
+            return ADS1115.ADS1115(i2c, address=address, mode=Mode.SINGLE, data_rate=DATA_RATES["ADS1115"])
+        except (ValueError, OSError):
+            pass
+    return ""
+
+
+# Works out whether the board at an address is an ADS1115 or ADS1015
+# The two have the same register map, but an ADS1015 converts nearly 4 times faster at the fastest data rate
+# and always leaves the bottom 4 bits of the conversion register empty
+# Detection takes a lot of transactions, so each one is retried if it fails, and a conversion that still fails
+# is left out. If no conversion can be timed at all, the board is treated as an ADS1115.
+def DetectBoardType(i2c, address, conversions=8):
+    adc = ADS1115.ADS1115(i2c, address=address, mode=Mode.SINGLE, data_rate=DATA_RATES["ADS1115"])
+    # Fake dev boards have no registers, so treat them as ADS1115s
+    if not hasattr(adc, "_write_register"):
+        return "ADS1115"
+    fastest = None
+    lowBits = 0
+    for _ in range(conversions):
+        try:
+            DetectRetry(adc._write_register, 0x01, DETECT_CONFIG)
+            start = time.perf_counter()
+            polls = 0
+            while not DetectRetry(adc._conversion_complete):
+                polls += 1
+                # A board that never finishes the conversion would hold the inventory lock forever
+                if polls > DETECT_POLL_LIMIT:
+                    raise OSError(errno.ETIMEDOUT, "Conversion timed out")
+            elapsed = time.perf_counter() - start
+            lowBits |= DetectRetry(adc.get_last_result) & 0x000F
+        except OSError:
+            continue
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    # An ADS1115 takes ~1.16 ms at 860 SPS, an ADS1015 ~0.3 ms at 3300 SPS (plus bus time for both)
+    if fastest is not None and lowBits == 0 and fastest < 0.8 / 1000:
+        return "ADS1015"
+    return "ADS1115"
+
+
+# Run a transaction used to detect the board type, retrying it if it fails with an I2C error
+def DetectRetry(transaction, *args):
+    for _ in range(0, DETECT_RETRIES):
+        try:
+            return transaction(*args)
+        except OSError:
+            pass
+    return transaction(*args)
+
+
+# Returns True if a board answers at an address, probing the same way adafruit_bus_device does
+def Probe(i2c, address):
+    while not i2c.try_lock():
+        pass
+    try:
+        try:
+            i2c.writeto(address, b"")
+        except OSError:
+            i2c.readfrom_into(address, bytearray(1))
+        return True
+    except OSError:
+        return False
+    finally:
+        i2c.unlock()
+
+
+# Cache of the bus, boards and AnalogIn objects, kept for as long as the program runs
+# The bus and every board are only opened again if the bus frequency or [Boards] settings change
+# A background thread probes each address so boards plugged in or unplugged are added or removed
+class Inventory():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bus = None
+        # Board object at each address ("" if not connected) and the settings they were opened with
+        self.adcs = ["", "", "", ""]
+        self.opened = None
+        # Frequency the bus actually runs at, which is the clock set by the kernel on the Pi
+        self.frequency = None
+        # AnalogIn objects by address, pin and gain
+        self.pins = {}
+        # Register costs measured by the planner for the boards connected, cleared whenever the boards change
+        self.calibration = None
+        # Background scan thread, which is paused whilst logging so it never touches the bus during a log
+        self.scanner = None
+        self.paused = threading.Event()
+        self.stopEvent = threading.Event()
+
+    # Returns the board object at each address, opening the bus and boards if the settings have changed
+    def Boards(self, settings):
+        opened = (settings["Bus"].getint("frequency"), tuple(settings["Boards"].get(hex(address), "auto")
+                                                             for address in ADDRESSES))
+        with self.lock:
+            if opened != self.opened:
+                # Close the old bus first, so each retune doesn't leave its file descriptor open
+                try:
+                    self.bus.deinit()
+                except (OSError, AttributeError):
+                    pass
+                self.bus = OpenBus(opened[0])
+                kernelFrequency = KernelFrequency()
+                self.frequency = opened[0] if kernelFrequency is None else kernelFrequency
+                self.adcs = OpenBoards(self.bus, settings)
+                self.opened = opened
+                self.pins = {}
+                self.calibration = None
+            return list(self.adcs)
+
+    # Returns the AnalogIn object for a pin of a board, creating it the first time it is asked for
+    # Only pins of boards held in the inventory are kept
+    def Pin(self, adc, pin, gain):
+        key = (id(adc), pin, gain)
+        with self.lock:
+            if adc not in self.adcs:
+                return AnalogIn(ads=adc, positive_pin=pin, gain=gain)
+            if key not in self.pins:
+                self.pins[key] = AnalogIn(ads=adc, positive_pin=pin, gain=gain)
+            return self.pins[key]
+
+    # Open the bus again at the same frequency, closing the old bus and moving every board onto the new one
+    # Used to recover a stuck bus during a log (see acquisition.Recovery), so the scan carries on with the new bus
+    # Returns the new bus, or "fake" if it couldn't be opened (the old bus is kept)
+    def Reopen(self):
+        with self.lock:
+            if self.opened is None:
+                return "fake"
+            bus = OpenBus(self.opened[0])
+            if isinstance(bus, str):
+                return bus
+            try:
+                self.bus.deinit()
+            except (OSError, AttributeError):
+                pass
+            self.bus = bus
+            for adc in self.adcs:
+                if adc != "":
+                    adc.i2c_device.i2c = bus
+            return bus
+
+    # Probe every address and open or drop boards that have been plugged in or unplugged
+    # Returns True if the boards connected changed
+    def Scan(self):
+        with self.lock:
+            if self.opened is None or isinstance(self.bus, str):
+                return False
+            changed = False
+            for idx, address in enumerate(ADDRESSES):
+                boardType = self.opened[1][idx]
+                if boardType == "none":
+                    continue
+                present = Probe(self.bus, address)
+                if present and self.adcs[idx] == "":
+                    self.adcs[idx] = OpenBoard(self.bus, address, boardType)
+                    if self.adcs[idx] == "":
+                        continue
+                elif not present and self.adcs[idx] != "":
+                    self.adcs[idx] = ""
+                else:
+                    continue
+                changed = True
+                logging.getLogger('error_logger').info("{} - Board {} {}".format(
+                    datetime.now(), hex(address), "connected" if self.adcs[idx] != "" else "disconnected"))
+            if changed:
+                self.pins = {key: pin for key, pin in self.pins.items() if pin._ads in self.adcs}
+                self.calibration = None
+            return changed
+
+    # Start the background scan
+    # The boards are opened first, so they are ready by the time the first log is started
+    def Start(self, settings, interval=SCAN_INTERVAL):
+        if self.scanner is not None:
+            return
+        self.scanner = threading.Thread(target=self.ScanLoop, args=(settings, interval))
+        self.scanner.daemon = True
+        self.scanner.start()
+
+    def ScanLoop(self, settings, interval):
+        self.Boards(settings)
+        while not self.stopEvent.wait(interval):
+            if not self.paused.is_set():
+                self.Scan()
+
+    # Stop scanning whilst a log is running, and start again once it has finished
+    def Pause(self):
+        self.paused.set()
+
+    def Resume(self):
+        self.paused.clear()
+
+
+# Inventory shared by everything in this process
+INVENTORY = Inventory()
+
+
+# Returns the board type of a board object, or "" if no board is connected
+def BoardType(adc):
+    if adc == "":
+        return ""
+    return "ADS1015" if getattr(adc, "bits", 16) == 12 else "ADS1115"
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
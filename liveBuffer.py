@@ -0,0 +1,86 @@
+# This file contains the shared memory ring buffer used to pass live data from the log process to the GUI
+# The log process writes every row into the next slot of the ring along with a sequence number
+# Readers keep track of the last sequence number they have seen and read every newer row
+# Nothing is locked - the writer never waits for readers, and a reader that falls more than
+# a ring's worth of rows behind simply skips ahead to the oldest row still in the ring
+
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+# Ring header: number of rows written, number of channels, number of slots
+HEADER = struct.Struct("=QII")
+
+
+# Shared memory ring of sequence numbered rows
+# Each slot holds the sequence number, time elapsed and int16 value of each channel
+class LiveRing():
+
+    def __init__(self, channels=0, capacity=1024, name=None):
+        if name is None:
+            # Create a new ring
+            self.slot = struct.Struct("=Qd{}h".format(channels))
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER.size + self.slot.size * capacity)
+            HEADER.pack_into(self.shm.buf, 0, 0, channels, capacity)
+            self.owner = True
+        else:
+            # Attach to an existing ring by name
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the creator removes the ring, so stop the resource tracker of this process removing it too
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+            channels, capacity = HEADER.unpack_from(self.shm.buf, 0)[1:]
+            self.slot = struct.Struct("=Qd{}h".format(channels))
+            self.owner = False
+        self.name = self.shm.name
+        self.channels = channels
+        self.capacity = capacity
+        # Sequence number of the last row written (writer only)
+        self.seq = 0
+        # Structs and views used by Put, created once so writing a row doesn't allocate
+        self.stamp = struct.Struct("=Qd")
+        self.count = struct.Struct("=Q")
+        self.words = self.shm.buf.cast('h')
+
+    # Write a row to the next slot and publish it
+    # values must be an array('h') so they can be copied straight into the slot
+    # The slot is written before the header count so readers never see a half written row as new
+    def Put(self, timeElapsed, values):
+        self.seq += 1
+        offset = HEADER.size + self.slot.size * (self.seq % self.capacity)
+        self.stamp.pack_into(self.shm.buf, offset, self.seq, timeElapsed)
+        start = (offset + self.stamp.size) // 2
+        self.words[start:start + self.channels] = values
+        self.count.pack_into(self.shm.buf, 0, self.seq)
+
+    # Returns the sequence number of the newest row
+    def Head(self):
+        return struct.unpack_from("=Q", self.shm.buf, 0)[0]
+
+    # Returns every row newer than lastSeq as a list of (sequence number, time elapsed, values)
+    def ReadSince(self, lastSeq):
+        head = self.Head()
+        # Skip rows that have already been overwritten
+        first = max(lastSeq + 1, head - self.capacity + 2)
+        rows = []
+        for seq in range(first, head + 1):
+            row = self.slot.unpack_from(self.shm.buf, HEADER.size + self.slot.size * (seq % self.capacity))
+            rows.append((row[0], row[1], row[2:]))
+        # The writer may have lapped the oldest slots while they were being read
+        # Drop any row whose slot could have been rewritten or whose sequence number doesn't match
+        oldest = self.Head() - self.capacity + 2
+        return [row for seq, row in enumerate(rows, first) if row[0] == seq and seq >= oldest]
+
+    # Release the shared memory, removing it if this ring created it
+    def Close(self):
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
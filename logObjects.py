@@ -13,15 +13,26 @@ class Pin():
         self.units = ""
         self.m = 0
         self.c = 0
+        # Number of conversions taken each time interval and how they are reduced to one value
+        # reduction is one of mean, min, max or iir (low-pass filter with coefficient alpha)
+        self.oversample = 1
+        self.reduction = "mean"
+        self.alpha = 0.5
+        # Time interval the pin is logged at, 0 means the time interval of the log
+        # Pins with the same time interval are logged together as a rate group
+        self.interval = 0
 
 
 # Holds metadata and config about a log
 class LogMeta():
 
     def __init__(self, id=0, project=0, work_pack=0, job_sheet=0, name = "", test_number=0, date="", time=0,
-                 loggedBy="", downloadedBy="", config=None, enabled=0, config_path="", data_path="", size=0, description=0):
+                 loggedBy="", downloadedBy="", config=None, enabled=0, config_path="", data_path="", size=0, description=0,
+                 stream_paths=None):
         if config is None:
             config = []
+        if stream_paths is None:
+            stream_paths = []
         self.id = id
         self.project = project
         self.work_pack = work_pack
@@ -38,6 +49,8 @@ class LogMeta():
         self.data_path = data_path
         self.size = size
         self.description = description
+        # Paths of the streams of the log other than the main one at data_path (one for each other rate group)
+        self.stream_paths = stream_paths
 
     # Returns the metadata printed at the start of a log
     def GetMeta(self):
@@ -0,0 +1,69 @@
+# This file contains the counters that show where the time goes in the log process
+# The counters live in a block of shared memory created when the program starts, so the TCP server can read them
+# while a log is running (and after it has finished) without asking the GUI or the log process for them
+# The log process keeps its own running totals and publishes them to the block once each time round the logging loop
+# Publishing is a handful of stores into shared memory, so the counters can be left on at the fastest time intervals
+
+from multiprocessing import Array
+
+# Name of each counter, in the order they are held in the block
+# running - 1 whilst a log is running, 0 otherwise
+# elapsed - time elapsed since the log started in seconds
+# frames - rows read from the boards, across every rate group
+# written - rows written to the raw data files
+# readtime - time spent reading the boards (I2C reads and conversions) in seconds
+# formattime - time spent formatting rows in the writer threads in seconds
+# writetime - time spent writing rows to the SD card in the writer threads in seconds
+# sleeptime - time the logging loop spent sleeping until the next row was due in seconds
+# late - rows taken late, skipped - rows skipped completely, worstlate - the latest a row was taken in seconds
+# dropped - rows dropped because a writer thread couldn't keep up (overruns)
+# oserrors - failed I2C transactions, including ones that worked when retried
+# retries - I2C transactions retried, missing - values stored as missing as a pin couldn't be read
+# quarantined - boards currently quarantined for failing too often, businits - times the bus was re-initialised
+# errors0x48 to errors0x4b - failed I2C transactions of the board at each address
+FIELDS = ["running", "elapsed", "frames", "written", "readtime", "formattime", "writetime", "sleeptime", "late",
+          "skipped", "worstlate", "dropped", "oserrors", "retries", "missing", "quarantined", "businits",
+          "errors0x48", "errors0x49", "errors0x4a", "errors0x4b"]
+RUNNING, ELAPSED, FRAMES, WRITTEN, READ_TIME, FORMAT_TIME, WRITE_TIME, SLEEP_TIME, LATE, SKIPPED, WORST_LATE, \
+    DROPPED, OS_ERRORS, RETRIES, MISSING, QUARANTINED, BUS_INITS = range(17)
+# Position of the error counter of the first board, the others follow in address order
+BOARD_ERRORS = 17
+
+
+# Create the shared block of counters
+# Only the log process writes to it, so it doesn't need a lock
+def CreateStats():
+    return Array('d', len(FIELDS), lock=False)
+
+
+# Zero every counter, ready for a new log
+def Reset(stats):
+    for idx in range(0, len(FIELDS)):
+        stats[idx] = 0.0
+
+
+# Publish the I2C error totals kept by an acquisition.Recovery
+# osErrors is the number of errors caught by the logging loop itself rather than by the engines
+def PublishErrors(stats, recovery, osErrors):
+    stats[OS_ERRORS] = osErrors + recovery.errors
+    stats[RETRIES] = recovery.retries
+    stats[MISSING] = recovery.missing
+    stats[QUARANTINED] = recovery.Quarantined()
+    stats[BUS_INITS] = recovery.busInits
+    for idx, address in enumerate([0x48, 0x49, 0x4a, 0x4b]):
+        if address in recovery.boards:
+            stats[BOARD_ERRORS + idx] = recovery.boards[address].errors
+
+
+# Returns a dictionary of the name and value of each counter
+def Snapshot(stats):
+    return {name: stats[idx] for idx, name in enumerate(FIELDS)}
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
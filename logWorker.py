@@ -0,0 +1,144 @@
+# This file contains the log worker, a process started once when the program starts that runs every log
+# Starting a new process for each log copied the whole GUI process (Tk, matplotlib and pandas included) every time
+# The worker is started from main.py before the GUI is imported, so it only holds the modules needed for logging
+# It also owns the boards: the board inventory (see hardware.py) lives in the worker and is kept open between logs
+# The GUI controls the worker through a Pipe:
+# - ("Init",) sets up a log as Logger.init does, sending each line printed back as ("Print", text, flush)
+#   and finishing with ("Ready", logEnbl, logComp, realtime profile)
+# - ("Log", live ring name) runs the log until the stop Event is set, then replies ("Stopped",)
+# - ("Exit",) stops the worker
+# The stop Event, overflow and timing counters are created once and shared for every log
+
+import logging
+import traceback
+from datetime import datetime
+from multiprocessing import Array, Event, Pipe, Process, Value
+import file_rw
+import hardware
+import liveBuffer
+from logger import Logger
+
+
+# Seconds to wait for a reply from the worker before checking it is still running
+REPLY_WAIT = 0.1
+
+
+# GUI side of the log worker, used to start the process and send it commands
+class LogWorker():
+
+    def __init__(self, stats):
+        self.conn, workerConn = Pipe()
+        # stop Event controls stopping of the log
+        self.stop = Event()
+        # overflow counts rows dropped because the writer thread couldn't keep up with the log
+        self.overflow = Value('i', 0)
+        # timing holds the number of late ticks, skipped ticks and the worst lateness in seconds
+        # Only the worker writes to it, so it doesn't need a lock
+        self.timing = Array('d', 3, lock=False)
+        self.process = Process(target=Run, args=(workerConn, self.stop, self.overflow, self.timing, stats))
+        self.process.daemon = True
+        # True from when a log is started until the worker has finished it
+        self.logging = False
+
+    def Start(self):
+        self.process.start()
+
+    # Set up a log in the worker, printing its output with printFunc
+    # Returns logEnbl, the log metadata and config, and the real-time profile of the log
+    def Init(self, printFunc):
+        self.conn.send(("Init",))
+        while True:
+            reply = self.conn.recv()
+            if reply[0] == "Print":
+                printFunc(reply[1], flush=reply[2])
+            elif reply[0] == "Ready":
+                return reply[1:]
+
+    # Start logging the log set up by Init, publishing live data to the live ring
+    def Log(self, live):
+        self.stop.clear()
+        self.logging = True
+        self.conn.send(("Log", live.name))
+
+    # Returns True once the worker has finished the log, or if the worker has died
+    # Doesn't wait for the worker, so it can be polled to notice a log that stops on its own
+    def Finished(self):
+        try:
+            while self.logging and self.conn.poll():
+                if self.conn.recv()[0] == "Stopped":
+                    self.logging = False
+        except (EOFError, OSError):
+            self.logging = False
+        # A worker that died mid log will never reply
+        if self.logging and not self.process.is_alive():
+            self.logging = False
+        return not self.logging
+
+    # Stop the log and wait for the worker to finish writing it
+    def Stop(self):
+        self.stop.set()
+        while not self.Finished():
+            self.conn.poll(REPLY_WAIT)
+
+    def Close(self):
+        if self.process.is_alive():
+            self.conn.send(("Exit",))
+            self.process.join()
+
+
+# Runs in the worker process, carrying out commands from the GUI until told to exit
+def Run(conn, stop, overflow, timing, stats):
+    # Errors are written to the same log file as the GUI
+    errorLogger = logging.getLogger('error_logger')
+    errorLogger.setLevel(logging.INFO)
+    errorLogger.addHandler(logging.FileHandler('piError.log'))
+    printFunc = lambda text, flush=False: conn.send(("Print", text, flush))
+    # Open the boards now and keep checking for boards being plugged in or unplugged
+    # so starting a log doesn't have to search for them
+    hardware.INVENTORY.Start(file_rw.ReadSettings())
+    logger = Logger()
+    while True:
+        command = conn.recv()
+        if command[0] == "Init":
+            # Stop checking for boards so the log has the bus to itself
+            hardware.INVENTORY.Pause()
+            logger = Logger()
+            try:
+                logger.init(printFunc)
+                if logger.logEnbl is True:
+                    # Check log test number is free to use
+                    # If not, the test number for this log is incremented
+                    logger.checkTestNumber()
+                    logger.settingsOutput(printFunc)
+            except Exception:
+                errorLogger.error("{} - Log worker failed to set up log:\n{}".format(datetime.now(),
+                                                                                     traceback.format_exc()))
+                printFunc("\nERROR - Failed to set up log, check piError.log for details")
+                logger.logEnbl = False
+            if logger.logEnbl is not True:
+                hardware.INVENTORY.Resume()
+            conn.send(("Ready", logger.logEnbl, logger.logComp, logger.realtime))
+        elif command[0] == "Log":
+            live = liveBuffer.LiveRing(name=command[1])
+            overflow.value = 0
+            for idx in range(0, len(timing)):
+                timing[idx] = 0.0
+            try:
+                logger.log(stop, live, overflow, timing, stats)
+            except Exception:
+                errorLogger.error("{} - Log worker failed whilst logging:\n{}".format(datetime.now(),
+                                                                                      traceback.format_exc()))
+            live.Close()
+            hardware.INVENTORY.Resume()
+            conn.send(("Stopped",))
+        elif command[0] == "Exit":
+            break
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -0,0 +1,186 @@
+# This file handles writing logged data to disk for logger.py
+# The logging loop puts each row into a preallocated ring buffer held in memory
+# A separate writer thread drains the ring buffer in batches and writes the rows to file
+# This means a slow SD card write can never delay the next sample being taken
+# Rows are written as csv or in the compact binary format described in file_rw.py
+
+import csv
+import threading
+import time
+from array import array
+import file_rw
+
+# Seconds to sleep between checks when waiting for space in a ring
+SPACE_WAIT = 0.001
+
+
+# Preallocated ring buffer of rows shared between the logging loop and the writer thread
+# Only the logging loop moves head and only the writer thread moves tail, so no lock is needed
+class FrameRing():
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.width = width
+        # Every row is allocated up front as flat arrays and reused
+        # ticks holds the tick index of each row, times holds the time elapsed of each row
+        # and values holds the int16 values of each row back to back
+        self.ticks = array('L', bytes(array('L').itemsize * capacity))
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('h', bytes(2 * capacity * width))
+        # Total number of rows put in and taken out of the ring
+        self.head = 0
+        self.tail = 0
+        # Number of rows dropped because the writer had fallen too far behind
+        self.overflow = 0
+
+    # Copy a row into the ring, returns False if the ring is full and the row was dropped
+    # values must be an array('h') so the copy is a straight memory copy
+    def Put(self, tick, timeElapsed, values):
+        if self.head - self.tail >= self.capacity:
+            self.overflow += 1
+            return False
+        slot = self.head % self.capacity
+        self.ticks[slot] = tick
+        self.times[slot] = timeElapsed
+        start = slot * self.width
+        self.values[start:start + self.width] = values
+        self.head += 1
+        return True
+
+    # Yields the tick index, time elapsed and values (as a list) of rows first to last - 1 put in the ring
+    # The values of each run of rows that doesn't wrap around the ring are converted to a list in one go
+    def Rows(self, first, last):
+        width = self.width
+        while first < last:
+            slot = first % self.capacity
+            count = min(last - first, self.capacity - slot)
+            values = self.values[slot * width:(slot + count) * width].tolist()
+            for idx in range(0, count):
+                yield self.ticks[slot + idx], self.times[slot + idx], values[idx * width:(idx + 1) * width]
+            first += count
+
+
+# Writes rows to a csv raw data file
+# The date/time of each row is worked out from the start of the log, so no formatting happens in the logging loop
+class CsvRowWriter():
+
+    def __init__(self, file, headers, startDateTime):
+        self.file = file
+        writer = csv.writer(file, dialect="excel", delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(file_rw.CsvHeader(headers))
+        self.lines = file_rw.CsvLines(startDateTime, len(headers))
+
+    # Write rows first to last - 1 of a FrameRing as one batch
+    def WriteRows(self, ring, first, last):
+        line = self.lines.Line
+        self.file.write("".join([line(tick, timeElapsed, values) for tick, timeElapsed, values
+                                 in ring.Rows(first, last)]))
+
+    # Push any buffered rows out to the file
+    def Flush(self):
+        self.file.flush()
+
+    # Called once every row has been written
+    # Stores the line count (every row plus the header) alongside the file, so it never has to be counted
+    def Finish(self, rows):
+        self.file.flush()
+        file_rw.WriteLineCount(self.file.name, rows + 1)
+
+
+# Writes rows to a binary raw data file as fixed width records
+class BinaryRowWriter():
+
+    def __init__(self, file, headers, startDateTime, interval, configText):
+        self.file = file
+        file_rw.WriteBinaryHeader(file, headers, interval, startDateTime.timestamp(), configText)
+        self.record = file_rw.BinaryRecord(len(headers))
+
+    # Write rows first to last - 1 of a FrameRing as one batch
+    def WriteRows(self, ring, first, last):
+        pack = self.record.pack
+        self.file.write(b"".join([pack(tick, timeElapsed, *values) for tick, timeElapsed, values
+                                  in ring.Rows(first, last)]))
+
+    # Push any buffered rows out to the file
+    def Flush(self):
+        self.file.flush()
+
+    # Called once every row has been written
+    # The line count of a binary file is worked out from its length, so it doesn't need storing
+    def Finish(self, rows):
+        self.file.flush()
+
+
+# Open a raw data file and create the row writer for the file format
+# The file is locked whilst it is open, so database checks know the log is still running
+def OpenRowWriter(path, fileFormat, headers, startDateTime, interval, configText):
+    if fileFormat == "binary":
+        file = open(path, "wb")
+        file_rw.LockData(file)
+        return file, BinaryRowWriter(file, headers, startDateTime, interval, configText)
+    file = open(path, "w", newline='')
+    file_rw.LockData(file)
+    return file, CsvRowWriter(file, headers, startDateTime)
+
+
+# Thread that writes rows from a FrameRing using a row writer
+class WriterThread(threading.Thread):
+
+    def __init__(self, ring, rowWriter, batchTime=0.1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.ring = ring
+        self.rowWriter = rowWriter
+        # Time to wait between batches when the ring is empty
+        self.batchTime = batchTime
+        self.stopEvent = threading.Event()
+        # Running totals read by the logging loop for the stats counters (see logStats.py)
+        # Rows written, time spent formatting rows into the file buffer and time spent writing the buffer out
+        self.written = 0
+        self.formatTime = 0.0
+        self.writeTime = 0.0
+
+    def run(self):
+        ring = self.ring
+        # Keep writing until told to stop and every row has been written
+        while not self.stopEvent.is_set() or ring.tail != ring.head:
+            head = ring.head
+            if head == ring.tail:
+                self.stopEvent.wait(self.batchTime)
+                continue
+            # Write every row currently in the ring as one batch, then flush the batch to the file
+            start = time.perf_counter()
+            self.rowWriter.WriteRows(ring, ring.tail, head)
+            formatted = time.perf_counter()
+            self.rowWriter.Flush()
+            self.formatTime += formatted - start
+            self.writeTime += time.perf_counter() - formatted
+            self.written += head - ring.tail
+            ring.tail = head
+        self.rowWriter.Finish(self.written)
+
+    # Wait until the ring has space for another row, so the row doesn't have to be dropped
+    # Gives up if the thread has stopped, as the ring would never be drained
+    def WaitForSpace(self):
+        ring = self.ring
+        while ring.head - ring.tail >= ring.capacity and self.is_alive():
+            time.sleep(SPACE_WAIT)
+
+    # Stop the thread once the ring has been drained
+    def Stop(self):
+        self.stopEvent.set()
+        self.join()
+
+
+# Work out how many rows the ring should hold so that several seconds of writer stalls can be absorbed
+def RingCapacity(timeInterval, seconds=30, minimum=256, maximum=65536):
+    return int(min(max(seconds / max(timeInterval, 1e-6), minimum), maximum))
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -6,29 +6,33 @@
 # 3. Setup logging (time interval etc.) then iterate through devices, grab data and save to CSV until stopped.
 
 # Import Packages/Modules
-import time
+import logging
+from array import array
+from contextlib import ExitStack
 from datetime import datetime, timedelta
+# hardware is imported first as it installs the I2C emulator if set to (see I2CFake.py)
+import hardware
 # Tries to import modules for Pi
 try:
     import adafruit_ads1x15.ads1115 as ADS
-    from adafruit_ads1x15.analog_in import AnalogIn
-    from adafruit_ads1x15.ads1x15 import Mode
-    import busio
-    import board
 # If on a laptop/dev computer, above will fail
 # Import fake dev modules instead
 except:
-    from AnalogInFake import AnalogIn as AnalogIn
     import ADS1115Fake as ADS
-    from adafruit_ads1x15.ads1x15 import Mode
-import csv
 import shutil
 import file_rw
 import logObjects as lgOb
 import databaseOp as db
+import acquisition
+import busTune
+import planner
+import replay
+import logStats
+import logWriter
+import realtime
+import scheduler
 import os
 from multiprocessing import Value, Event
-import psutil
 
 
 class Logger():
@@ -42,45 +46,76 @@ class Logger():
         self.adcHeaders = []
         # Stores AnalogIn objects of pins set to log
         self.adcToLog = []
+        # Rate groups of pins set to log, each with the acquisition engine used to read its pins
+        self.groups = []
+        # Format raw data is written in, either csv or binary
+        self.fileFormat = "csv"
+        # Real-time scheduling profile for the log process
+        self.realtime = realtime.ReadProfile(file_rw.ReadSettings())
+        # Type of board connected at each address ("" if not connected)
+        self.boardTypes = []
+        # Capacity of the config measured by the planner
+        self.capacity = None
+        # Clock used by the logging loop, and the recording being replayed instead of reading the boards (if any)
+        self.clock = scheduler.Clock()
+        self.replay = None
+        # I2C bus frequency the boards are read at
+        self.frequency = 1000000
 
 
     # Initial Import and Setup
     def init(self, printFunc):
         self.logEnbl = True
-        # dataRate of the A/D (see the ADS1115 datasheet for more info)
-        dataRate = 860
-
-        # Create the I2C bus
-        try:
-            i2c = busio.I2C(board.SCL, board.SDA, frequency=1000000)
-        except:
-            i2c = "fake"
-        # A/D Setup - Create 4 Global instances of ADS1115 ADC (16-bit) according to Adafruit Libraries
-        # ValueError thrown if board not connected
-        # Not fatal as you could only be logging on one board
-        try:
-            adc0 = ADS.ADS1115(i2c, address=0x48, mode=Mode.SINGLE, data_rate=dataRate)
-        except ValueError:
-            adc0 = ""
-        try:
-            adc1 = ADS.ADS1115(i2c, address=0x49, mode=Mode.SINGLE, data_rate=dataRate)
-        except ValueError:
-            adc1 = ""
-        try:
-            adc2 = ADS.ADS1115(i2c, address=0x4a, mode=Mode.SINGLE, data_rate=dataRate)
-        except ValueError:
-            adc2 = ""
-        try:
-            adc3 = ADS.ADS1115(i2c, address=0x4b, mode=Mode.SINGLE, data_rate=dataRate)
-        except ValueError:
-            adc3 = ""
-
-        # Store list of boards
-        adcs = [adc0,adc1,adc2,adc3]
+        # Get the board types, raw data file format and real-time profile from the logger settings
+        settings = file_rw.ReadSettings()
+        replayPath = settings["Replay"]["path"]
+        if replayPath != "":
+            # Replaying a recording doesn't use the boards, so fake boards are used at every address
+            adcs = replay.ReplayBoards()
+        else:
+            # A/D Setup - An ADS1115 (16-bit) or ADS1015 (12-bit) instance at each address according to Adafruit Libraries
+            # Each board runs at its fastest data rate, and a list of boards is stored ("" if not connected)
+            # The bus and boards are kept open in the inventory, so they are only opened here the first time
+            adcs = hardware.INVENTORY.Boards(settings)
+            # The I2C bus runs at the frequency found by tuning (see busTune.py)
+            # On the Pi that is the clock set by the kernel, whatever frequency the bus was opened with
+            self.frequency = hardware.INVENTORY.frequency
+            # Tune the bus frequency if set to and the boards connected have changed, then reopen the bus
+            # The boards are stored with the frequency, as found at that frequency
+            boardTypes = [hardware.BoardType(adc) for adc in adcs]
+            if busTune.NeedsTuning(settings, boardTypes) and self.tuneBus(settings, printFunc):
+                settings["Bus"]["frequency"] = str(self.frequency)
+                adcs = hardware.INVENTORY.Boards(settings)
+                self.frequency = hardware.INVENTORY.frequency
+                busTune.SaveFrequency(self.frequency, [hardware.BoardType(adc) for adc in adcs])
+        self.boardTypes = [hardware.BoardType(adc) for adc in adcs]
+        self.fileFormat = settings["Logging"]["fileformat"]
+        self.realtime = realtime.ReadProfile(settings)
         # Run Code to import general metadata
         self.generalImport(printFunc)
         # Run code to import input settings
         self.inputImport(adcs, printFunc)
+        # Read the pins from a recording instead of the boards if set to
+        self.replay = None
+        self.clock = scheduler.Clock()
+        if replayPath != "" and self.logEnbl is True:
+            self.replayImport(replayPath, settings["Replay"].getboolean("fast"), printFunc)
+        # Run the calibration burst to check the config can be met
+        if self.logEnbl is True:
+            self.capacityCheck(settings, printFunc)
+
+
+    # Find the fastest bus frequency the boards can be read at reliably
+    # Returns True if a frequency was found
+    def tuneBus(self, settings, printFunc):
+        printFunc("Tuning I2C Bus Frequency... ")
+        frequency, results = busTune.TuneBus(settings, printFunc=printFunc)
+        if frequency is None:
+            printFunc("WARNING - No bus frequency was reliable, staying at {} kHz".format(self.frequency // 1000))
+            return False
+        self.frequency = frequency
+        printFunc("Success! Using {} kHz\n".format(frequency // 1000))
+        return True
 
 
     # Import General Settings
@@ -109,6 +144,7 @@ class Logger():
             self.adcToLog = []
             # ADC Pin Map List - created now the gain information has been grabbed.
             # This gives the list of AnalogIn objects used to retrieve data from a pin
+            # The AnalogIn objects are kept in the inventory and reused for every log
             pinDict = {0: ADS.P0, 1: ADS.P1, 2: ADS.P2, 3: ADS.P3}
             adcPinMap = {}
             # Dynamically create adcPinMap depending on the boards connected
@@ -116,7 +152,7 @@ class Logger():
                 tempDict = {}
                 if adc != "":
                     for i in range(0,4):
-                        tempDict["{}A{}".format(idx,i)] = AnalogIn(ads=adc, positive_pin=pinDict[i], gain=self.logComp.config[4 * idx + i].gain)
+                        tempDict["{}A{}".format(idx,i)] = hardware.INVENTORY.Pin(adc, pinDict[i], self.logComp.config[4 * idx + i].gain)
                     adcPinMap["{}AX".format(idx)] = tempDict
 
             # Run code to find pins set to logged.
@@ -134,6 +170,13 @@ class Logger():
             else:
                 printFunc("Success!")
             self.logComp.SetEnabled()
+            # Split the pins into rate groups and compile each group into a read plan for its acquisition engine
+            # The engine reads the pins on all boards concurrently, oversampling any pins that need it
+            enabledPins = [pin for pin in self.logComp.config if pin.enabled == True]
+            # I2C errors are handled board by board, re-opening the bus if every board fails at once
+            self.groups = acquisition.CreateGroups(self.adcToLog, enabledPins, self.adcHeader,
+                                                   float(self.logComp.time),
+                                                   acquisition.Recovery(hardware.INVENTORY.Reopen))
 
         # Exception raised when no config returned from database
         except ValueError:
@@ -150,20 +193,66 @@ class Logger():
             self.logEnbl = False
         except FileNotFoundError:
             printFunc("ERROR - Failed to read Input Settings - Have you sent over a log config")
-            db.DatabaseCheck()
+            db.ReconcileLog(self.logComp.id)
             self.logEnbl = False
 
 
+    # Set up replaying a recorded raw data file through the logging loop in place of the boards
+    def replayImport(self, path, fast, printFunc):
+        printFunc("Configuring Replay of {}... ".format(path), flush=True)
+        try:
+            self.replay = replay.Attach(self.groups, path, fast)
+            self.clock = self.replay.clock
+            printFunc("Success!")
+        except FileNotFoundError:
+            printFunc("ERROR - Recording to replay not found")
+            self.logEnbl = False
+        # Exception raised when a pin set to log isn't in the recording
+        except KeyError as error:
+            printFunc("ERROR - Pins not in recording: {}".format(error.args[0]))
+            self.logEnbl = False
+
+
+    # Check the config can be met using a short calibration burst on the boards
+    # The register costs measured are cached so the TCP server can check configs before they are uploaded
+    def capacityCheck(self, settings, printFunc):
+        printFunc("Checking Capacity... ", flush=True)
+        if self.replay is None and hardware.INVENTORY.calibration is not None:
+            # The boards haven't changed since they were calibrated, so predict the row times without using the bus
+            layouts = [(group.interval, [(int(pin.name[0]), pin.oversample) for pin in group.pins])
+                       for group in self.groups]
+            self.capacity = planner.Assess(planner.PredictGroups(layouts, self.boardTypes,
+                                                                 hardware.INVENTORY.calibration, self.fileFormat),
+                                           settings)
+        else:
+            # The boards aren't read when replaying, so there is nothing to calibrate
+            # Calibration is skipped if the board fails, as an I2C error would throw the register costs out anyway
+            try:
+                calibration = planner.Calibrate(self.adcToLog[0]) if self.replay is None else None
+            except OSError:
+                calibration = None
+            if calibration is not None:
+                planner.SaveCalibration(calibration, self.boardTypes)
+                hardware.INVENTORY.calibration = calibration
+            self.capacity = planner.Assess(planner.MeasureGroups(self.groups, self.fileFormat), settings)
+        # Refuse to log if reading the pins takes longer than the time interval allows
+        if self.capacity["verdict"] == "Refused":
+            printFunc("ERROR - The config can't be met. Reading the pins takes {}% of the time available."
+                      .format(round(self.capacity["load"] * 100, 1)))
+            for group, minimum in zip(self.groups, self.capacity["minimum"]):
+                printFunc("Pins logged every {} s take {} ms to read".format(group.interval, round(minimum * 1000, 3)))
+            printFunc("Increase the time interval, or log fewer pins or fewer conversions each interval.")
+            self.logEnbl = False
+        else:
+            printFunc("Success!")
+
+
             # Checks that log test number hasn't already been used
     # This is to stop database collisions if logger is rerun without uploading a new config
     def checkTestNumber(self):
         # Check that the most recent log has no data file
-        # If it does, increment the id and test number by one, and create a new database entry
-        if db.CheckDataTable(str(self.logComp.id)) == True:
-            self.logComp.id += 1
-            self.logComp.test_number = db.GetTestNumber(self.logComp.name) + 1
-            # Write new log entry to database
-            db.WriteLog(self.logComp)
+        # If it does, create a new database entry with the next test number in a single write
+        if db.NextLog(self.logComp):
             # Write copy of config settings under new log name
             file_rw.WriteLogConfig(self.logComp, self.logComp.name)
 
@@ -205,6 +294,36 @@ class Logger():
                                                                                         "-",
                                                                                         "-",
                                                                                         "-"))
+        # Print oversampling settings for any pins taking more than one conversion each interval
+        for pin in self.logComp.config:
+            if pin.enabled == True and pin.oversample > 1:
+                printFunc("{} takes {} conversions each interval, reduced by {}{}".format(
+                    pin.name, pin.oversample, pin.reduction,
+                    " (alpha {})".format(pin.alpha) if pin.reduction == "iir" else ""))
+        # Print the rate groups if any pins are logged at a different time interval to the log
+        if len(self.groups) > 1:
+            printFunc("\nRate Groups:")
+            for group in self.groups:
+                printFunc("{} s: {}{}".format(group.interval, ", ".join(group.headers),
+                                              " (main raw data file)" if group.main else ""))
+        # Print the row time and size of each rate group measured by the calibration burst
+        printFunc("\nCapacity:")
+        for group, minimum, rowBytes in zip(self.groups, self.capacity["minimum"], self.capacity["rowbytes"]):
+            printFunc("Pins logged every {} s take {} ms to read and write {} bytes each row"
+                      .format(group.interval, round(minimum * 1000, 3), rowBytes))
+        printFunc("Time spent reading: {}% (fastest time interval possible: {} s)"
+                  .format(round(self.capacity["load"] * 100, 1), round(float(self.logComp.time) * self.capacity["load"], 6)))
+        if self.capacity["verdict"] == "Warning":
+            printFunc("WARNING - The config is close to the limit of what can be logged. Expect late or skipped rows.")
+        # Print the type and data rate of each connected board, or the recording being replayed instead
+        if self.replay is not None:
+            printFunc("\nReplaying {} {}".format(self.replay.path,
+                                                 "as fast as possible" if self.replay.fast else "in real time"))
+        else:
+            printFunc("\nBoards: (I2C bus at {} kHz)".format(self.frequency // 1000))
+            for address, boardType in zip(hardware.ADDRESSES, self.boardTypes):
+                if boardType != "":
+                    printFunc("{}: {} at {} SPS".format(hex(address), boardType, hardware.DATA_RATES[boardType]))
         # FILE MANAGEMENT
         printFunc("\nDisk Usage:")
         # Get Users Remaining Disk Space - (Convert it from Bytes into MegaBytes)
@@ -213,10 +332,8 @@ class Logger():
         printFunc("Current Free Disk Space: {} MB".format(round(remainingSpace, 2)))
 
         # Calculate amount of time left for logging
-        # Find out Size (in MB) of Each Row
-        rowMBytes = 7 / 1e6
-        # Find amount of MB written each second
-        MBEachSecond = (rowMBytes * self.logComp.enabled) / self.logComp.time
+        # Find amount of MB written each second from the size of each row of each rate group
+        MBEachSecond = self.capacity["bytespersecond"] / 1e6
         # Calculate time remaining using free space
         timeRemSeconds = remainingSpace / MBEachSecond
         try:
@@ -227,72 +344,164 @@ class Logger():
         printFunc("With the current config, you will run out of space on approximately: {}"
               "\nIf you need more space, use the UI to download previous logs and delete them on the Pi."
             .format(timeRemDate.strftime("%Y-%m-%d %H:%M:%S")))
+        # Print which parts of the real-time profile will be active
+        printFunc("\nReal-time Settings:")
+        status = realtime.CheckProfile(self.realtime)
+        for key in status:
+            printFunc("{}: {}".format(key, status[key]))
         printFunc("\nStart Logging...\n")
 
 
     # Logging Script
     # Normally this function is run in a separate process to everything else
     # This is to make sure that logging is consistent, accurate and unaffected by GUI slowdowns.
-    def log(self, logEnbl, values, readOnce):
-        # Sets the priority of the process higher
-        p = psutil.Process(os.getpid())
-        try:
-            p.nice(psutil.IOPRIO_CLASS_RT)
-        # If run on a non-linux computer, this is needed instead
-        except:
-            p.nice(psutil.ABOVE_NORMAL_PRIORITY_CLASS)
-        # Get Time Interval
-        timeInterval = float(self.logComp.time)
-        # Find the length of what each row will be in the CSV (from which pins are being logged)
+    def log(self, logEnbl, live, overflow, timing, stats=None):
+        # Rate groups, fastest first
+        groups = self.groups
+        # Counters showing where the time goes, published to shared memory for the TCP server (see logStats.py)
+        # They are kept as local running totals and published once each time round the loop
+        if stats is None:
+            stats = logStats.CreateStats()
+        logStats.Reset(stats)
+        frames = 0
+        readTime = 0.0
+        sleepTime = 0.0
+        osErrors = 0
+        # I2C errors handled by the engines, shared by every group
+        recovery = groups[0].recovery
+        publishedErrors = 0
+        # Clock used to time rows, which is only virtual when replaying a recording as fast as possible
+        clock = self.clock
+        # When replaying a recording, also stop at the end of the recording
+        if self.replay is not None:
+            logEnbl = self.replay.StopEvent(logEnbl)
+        # Find the length of each row of live data (from which pins are being logged)
         csvRows = len(self.adcToLog)
-        # Set up list to be printed to CSV
-        adcValues = [0] * csvRows
+        # Set up array to hold each row of live data, with the latest value of every pin
+        # This and the row of each rate group are allocated once and reused so the logging loop doesn't allocate
+        liveValues = array('h', bytes(2 * csvRows))
         # Get timestamp for filename
         timeStamp = datetime.now().strftime("%Y%m%d-%H%M%S")
         self.logComp.date = timeStamp
-        # Update date on database
-        db.AddDate(self.logComp.date, self.logComp.id)
         # Update config file
         self.logComp.config_path = db.GetConfigPath(self.logComp.id)
         file_rw.RenameConfig(self.logComp.config_path, self.logComp.date)
-        db.UpdateConfigPath(self.logComp.id, "files/outbox/conf{}.ini".format(self.logComp.date))
-
-        # CSV - Create/Open CSV file and print headers
-        with open('files/outbox/raw{}.csv'.format(timeStamp), 'w', newline='') as csvfile:
-            # Create csv writer
-            writer = csv.writer(csvfile, dialect="excel", delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(['Date/Time', 'Time Interval (seconds)'] + self.adcHeader)
-            # Set start time use for calculating time interval and sleeping script for correct time
-            startTime = time.perf_counter()
+        self.logComp.config_path = "files/outbox/conf{}.ini".format(self.logComp.date)
+        # Update date and config path on database in a single write
+        db.LogStarted(self.logComp.id, self.logComp.date, self.logComp.config_path)
+
+        # Config file text is stored in the header of binary raw data files
+        with open(self.logComp.config_path) as configFile:
+            configText = configFile.read()
+
+        # Configure the boards ready for the first read
+        for group in groups:
+            group.engine.Start()
+        # Set start time use for calculating time interval and sleeping script for correct time
+        startTime = clock.Now()
+        startDateTime = datetime.now()
+        # Path of the main raw data file
+        dataPath = file_rw.DataPath(timeStamp, self.fileFormat)
+        with ExitStack() as dataFiles:
+            for group in groups:
+                # Create/Open raw data file for the group and print headers
+                # Groups other than the main group are written to their own stream named with their time interval
+                groupPath = dataPath if group.main else file_rw.DataPath(timeStamp, self.fileFormat, group.interval)
+                dataFile, rowWriter = logWriter.OpenRowWriter(groupPath, self.fileFormat, group.headers,
+                                                              startDateTime, group.interval, configText)
+                dataFiles.enter_context(dataFile)
+                # Rows are put into a ring buffer in memory and written to file by a separate writer thread
+                # This stops slow writes to the SD card delaying the next sample
+                # The writer thread also works out the date/time of each row so no formatting happens here
+                group.ring = logWriter.FrameRing(logWriter.RingCapacity(group.interval), len(group.pins))
+                group.writerThread = logWriter.WriterThread(group.ring, rowWriter)
+                group.writerThread.start()
+                # Rows of each group are taken on a fixed grid of ticks from the start time
+                group.ticks = scheduler.TickScheduler(group.interval, startTime)
+            # Apply the real-time profile to this thread only, after the writer thread has started
+            # This way the writer thread keeps normal scheduling and can't hold up the logging loop
+            failed = realtime.ApplyProfile(self.realtime)
+            if failed != []:
+                logging.getLogger('error_logger').info("{} - Real-time profile failed to apply: {}"
+                                                       .format(datetime.now(), ", ".join(failed)))
+            stats[logStats.RUNNING] = 1
             # While set to log, log data
             # Event is set by GUI when log is toggled
             while not logEnbl.is_set():
-                try:
-                    # Get current datetime and time elapsed from start
-                    currentDateTime = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-                    timeElapsed = round(time.perf_counter() - startTime, 2)
-                    # Export Data to Spreadsheet inc current datetime and time elapsed
-                    # Set values array for live data output
-                    for idx, pin in enumerate(self.adcToLog):
-                        adcValues[idx] = pin.value
-                        values[idx] = pin.value
-                    writer.writerow([currentDateTime] + [timeElapsed] + adcValues)
-                    if (readOnce.is_set() == False):
-                        readOnce.set()
-                    # Reset list values (so we can see if code fails)
-                    adcValues = [0] * csvRows
-                except OSError:
-                    pass
-                # Work out time delay needed until next set of values taken based on user given value
-                # (Using some clever maths)
-                timeDiff = (time.perf_counter() - startTime)
-                time.sleep(timeInterval - (timeDiff % timeInterval))
-
+                # Read every group whose tick is due, fastest group first
+                for group in groups:
+                    # Get time elapsed from start and skip the group if its tick isn't due yet
+                    timeElapsed = clock.Now() - startTime
+                    if timeElapsed < group.ticks.Due():
+                        continue
+                    try:
+                        # Record how late this tick is
+                        group.ticks.Mark(timeElapsed)
+                        # Read all pins of the group in one go, converting on every board at the same time
+                        readStart = clock.Now()
+                        group.engine.Read(group.values)
+                        readTime += clock.Now() - readStart
+                        frames += 1
+                        # Rows that don't fit in the ring are counted rather than delaying the log
+                        # With a virtual clock no time is lost by waiting, so the writer thread is given time to
+                        # catch up and every row of the recording is written
+                        if clock.virtual:
+                            group.writerThread.WaitForSpace()
+                        if not group.ring.Put(group.ticks.tick, timeElapsed, group.values):
+                            overflow.value += 1
+                        # Copy the group's values into the row of live data
+                        for local, idx in group.positions:
+                            liveValues[idx] = group.values[local]
+                        # Publish row to the shared memory ring for live data output each time the fastest group is read
+                        if group is groups[0]:
+                            live.Put(timeElapsed, liveValues)
+                    # The engines handle I2C errors board by board, so only errors they can't handle get here
+                    except OSError:
+                        osErrors += 1
+                    # Move the group on to its next tick, skipping any ticks that have been missed
+                    group.ticks.Advance(clock.Now() - startTime)
+                # Share timing counters of all groups with the GUI: late ticks, skipped ticks and worst lateness
+                # Also find when the next group is due
+                late = 0
+                skipped = 0
+                nextDue = groups[0].ticks.Due()
+                for group in groups:
+                    late += group.ticks.late
+                    skipped += group.ticks.skipped
+                    timing[2] = max(timing[2], group.ticks.worstLate)
+                    nextDue = min(nextDue, group.ticks.Due())
+                timing[0] = late
+                timing[1] = skipped
+                # Publish the stats counters
+                stats[logStats.ELAPSED] = timeElapsed
+                stats[logStats.FRAMES] = frames
+                stats[logStats.READ_TIME] = readTime
+                stats[logStats.SLEEP_TIME] = sleepTime
+                stats[logStats.LATE] = late
+                stats[logStats.SKIPPED] = skipped
+                stats[logStats.WORST_LATE] = timing[2]
+                stats[logStats.DROPPED] = overflow.value
+                PublishWriterStats(groups, stats)
+                # I2C error totals are only published after an error, so a healthy bus costs nothing
+                if recovery.events + osErrors != publishedErrors:
+                    publishedErrors = recovery.events + osErrors
+                    logStats.PublishErrors(stats, recovery, osErrors)
+                # Sleep until the next group is due
+                sleepStart = clock.Now()
+                scheduler.SleepUntil(startTime, nextDue, clock)
+                sleepTime += clock.Now() - sleepStart
+            # Wait for the writer threads to write any remaining rows
+            realtime.ReleaseProfile(self.realtime)
+            for group in groups:
+                group.writerThread.Stop()
+            PublishWriterStats(groups, stats)
+            logStats.PublishErrors(stats, recovery, osErrors)
+            stats[logStats.RUNNING] = 0
 
-        # Add path of raw data to database entry
-        db.UpdateDataPath(self.logComp.id,"files/outbox/raw{}.csv".format(self.logComp.date))
-        # Add size of log to database entry
-        db.UpdateSize(self.logComp.id,file_rw.GetSize(db.GetDataPath(self.logComp.id)))
+        # Add path and size of raw data to database entry in a single write
+        # The size is the line count of every stream (rows plus the header), taken from the writer threads
+        # so the files don't have to be counted
+        db.LogFinished(self.logComp.id, dataPath, sum(group.writerThread.written + 1 for group in groups))
 
 
 
@@ -313,6 +522,20 @@ class Logger():
             self.logEnbl = False
 
 
+# Add up the running totals of the writer thread of each rate group and publish them to the stats counters
+def PublishWriterStats(groups, stats):
+    written = 0
+    formatTime = 0.0
+    writeTime = 0.0
+    for group in groups:
+        written += group.writerThread.written
+        formatTime += group.writerThread.formatTime
+        writeTime += group.writerThread.writeTime
+    stats[logStats.WRITTEN] = written
+    stats[logStats.FORMAT_TIME] = formatTime
+    stats[logStats.WRITE_TIME] = writeTime
+
+
 # This is the code that is run when the program is loaded.
 # If the module were to be imported, the code inside the if statement would not run.
 if __name__ == "__main__":
@@ -1,9 +1,9 @@
 # Starting point for Alistair's logger
 # This sets up communication between the TCP server and the GUI
-# It also starts the TCP server and GUI in separate threads
+# It also starts the log worker process, and the TCP server and GUI in separate threads
 
-import tcpServer
-import gui
+import logStats
+import logWorker
 from threading import Thread
 from multiprocessing import Pipe, Event
 
@@ -11,15 +11,25 @@ from multiprocessing import Pipe, Event
 # Makes sure TCP/GUI initialisation only occurs when running main for the first time
 if __name__ == '__main__':
     print("Starting application.")
+    # Stats counters are shared between the log worker (which fills them in) and the TCP server
+    stats = logStats.CreateStats()
+    # Start the log worker, which runs every log (see logWorker.py)
+    # This is done before the TCP server and GUI are imported, so the worker doesn't hold Tk, matplotlib or pandas
+    worker = logWorker.LogWorker(stats)
+    worker.Start()
+    import tcpServer
+    import gui
     # TCP server and GUI use a Pipe to communicate
     # exitTcp Event is used to shutdown TCP server when the GUI is closed
     connGui, connTcp = Pipe()
     exitTcp = Event()
     # Create thread for TCP server to run on
     # This is so TCP connections can be processed separate from the GUI
-    serverThread = Thread(target=tcpServer.run, args=(connTcp, exitTcp))
+    serverThread = Thread(target=tcpServer.run, args=(connTcp, exitTcp, stats))
     serverThread.start()
     print("ServerThread starting")
 
     # Start the GUI in this thread
-    gui.run(connGui, exitTcp)
+    gui.run(connGui, exitTcp, stats, worker)
+    # Stop the log worker once the GUI has closed
+    worker.Close()
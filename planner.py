@@ -0,0 +1,189 @@
+# This file contains the capacity planner, which predicts whether a log config can be met before the log starts
+# When the logger is initialised, a short calibration burst is run on the boards:
+# - Each rate group is read a few times to measure how long a row actually takes and how many bytes it writes
+# - The cost of the individual register operations is measured so the row time of any config can be predicted
+# The register costs are cached in loggerSettings.ini so the TCP server can check a config without touching the bus
+# A config is refused if its rate groups need more time than is available, and warned about if it is close
+
+import time
+from array import array
+from datetime import datetime
+import acquisition
+import file_rw
+import hardware
+import logObjects as lgOb
+
+# Number of times each rate group is read in the calibration burst, and the most time to spend reading each group
+BURST_READS = 20
+BURST_TIME = 0.5
+
+
+# Measure the cost of the register operations used by the acquisition engine on a real board
+# pin is the AnalogIn object of any pin being logged
+# Returns a dictionary of costs in seconds, or None if the board is fake and has no registers
+def Calibrate(pin, reads=BURST_READS):
+    plan = acquisition.CompilePlan([pin], allowContinuous=False)
+    if plan.bus is None:
+        return None
+    engine = acquisition.AdcEngine(plan)
+    channel = plan.rounds[0][0]
+    bus = plan.bus
+    buf = bytearray(2)
+    # Cost of the bus transactions for one single-shot channel: config write, status read and conversion read
+    engine.Lock()
+    try:
+        start = time.perf_counter()
+        for _ in range(0, reads):
+            bus.writeto(channel.address, channel.configWrite)
+            bus.readfrom_into(channel.address, buf)
+            bus.writeto_then_readfrom(channel.address, engine.pointer, buf)
+        channelCost = (time.perf_counter() - start) / reads
+        # Cost of reading a continuously converting channel
+        start = time.perf_counter()
+        for _ in range(0, reads):
+            bus.readfrom_into(channel.address, buf)
+        continuousCost = (time.perf_counter() - start) / reads
+    finally:
+        bus.unlock()
+    # Anything a round takes on top of the conversion period and bus transactions (mostly sleep overshoot)
+    out = array('h', [0])
+    singleCost = TimeReads(engine, out, reads)
+    roundCost = max(0.0, singleCost - plan.periods[0] - channelCost)
+    # Extra cost of reducing oversampled conversions to one value
+    oversampled = lgOb.Pin()
+    oversampled.oversample = 2
+    oversampler = acquisition.Oversampler([pin], [oversampled])
+    reduceCost = max(0.0, TimeReads(oversampler, out, reads) - 2 * singleCost)
+    return {"channelcost": channelCost, "continuouscost": continuousCost, "roundcost": roundCost,
+            "reducecost": reduceCost}
+
+
+# Read an engine several times, returning the typical (median) time of a read
+def TimeReads(engine, out, reads=BURST_READS, limit=BURST_TIME):
+    times = []
+    end = time.perf_counter() + limit
+    while len(times) < reads and (len(times) < 3 or time.perf_counter() < end):
+        start = time.perf_counter()
+        engine.Read(out)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+# Read each rate group in a burst to measure how long a row of each group takes to read and write
+# Returns a list with the time interval, row time and bytes per row of each group
+def MeasureGroups(groups, fileFormat):
+    measured = []
+    for group in groups:
+        group.engine.Start()
+        rowTime = TimeReads(group.engine, group.values)
+        measured.append((group.interval, rowTime, RowBytes(fileFormat, group.values.tolist())))
+    return measured
+
+
+# Bytes written for a row of values in the raw data file format
+# csv rows are formatted exactly as the writer thread would, so the size reflects the values being logged
+def RowBytes(fileFormat, values):
+    if fileFormat == "binary":
+        return file_rw.BinaryRecord(len(values)).size
+    row = file_rw.CsvRow(datetime.now(), 0, 0.0, values)
+    # Commas between values and the \r\n line ending
+    return len(",".join(str(value) for value in row)) + 2
+
+
+# Predict the row time of each rate group of a config from the cached register costs
+# layouts holds the time interval of each group and a list of (board index, oversample) for each pin in the group
+# Mirrors the way acquisition.CreateGroups splits the pins into continuous channels and rounds
+def PredictGroups(layouts, boardTypes, calibration, fileFormat):
+    # Boards with more than one pin in the whole config are always read in single-shot mode
+    counts = {}
+    for interval, layout in layouts:
+        for board, oversample in layout:
+            counts[board] = counts.get(board, 0) + 1
+    shared = set(board for board in counts if counts[board] > 1)
+    predicted = []
+    for interval, layout in layouts:
+        depth = max(oversample for board, oversample in layout)
+        if depth == 1:
+            rowTime = PredictPlan([board for board, oversample in layout], boardTypes, calibration, True, shared)
+        else:
+            # Oversampled groups run one single-shot plan for each conversion, then reduce
+            rowTime = calibration["reducecost"]
+            for n in range(0, depth):
+                rowTime += PredictPlan([board for board, oversample in layout if oversample > n], boardTypes,
+                                       calibration, False)
+        # Size the row with the widest possible values so csv sizes are never underestimated
+        predicted.append((interval, rowTime, RowBytes(fileFormat, [-32768] * len(layout))))
+    return predicted
+
+
+# Predict the time taken to run a read plan for pins on the given boards
+# shared holds the boards also read by other plans, which are never left converting continuously
+def PredictPlan(boards, boardTypes, calibration, allowContinuous, shared=()):
+    counts = {}
+    for board in boards:
+        counts[board] = counts.get(board, 0) + 1
+    rowTime = 0.0
+    single = []
+    for board in counts:
+        if counts[board] == 1 and allowContinuous and board not in shared:
+            rowTime += calibration["continuouscost"]
+        else:
+            single.append(board)
+    # Each round converts on every board with a pin left to read, waiting for the slowest board
+    for n in range(0, max([counts[board] for board in single], default=0)):
+        roundBoards = [board for board in single if counts[board] > n]
+        period = max(1 / hardware.DATA_RATES[boardTypes[board]] for board in roundBoards)
+        rowTime += period + calibration["roundcost"] + len(roundBoards) * calibration["channelcost"]
+    return rowTime
+
+
+# Check whether the rate groups of a config can be met
+# groups is a list of the time interval, row time and bytes per row of each group
+# Returns a dictionary with the verdict (OK, Warning or Refused), the fraction of time spent reading (load),
+# the minimum time interval each group could run at on its own, the bytes per row of each group
+# and the bytes written each second
+# Scaling every time interval by the load gives the fastest the whole config could run
+def Assess(groups, settings):
+    warnLoad = settings["Planner"].getfloat("warnload")
+    load = sum(rowTime / interval for interval, rowTime, rowBytes in groups)
+    report = {"load": load,
+              "minimum": [rowTime for interval, rowTime, rowBytes in groups],
+              "rowbytes": [rowBytes for interval, rowTime, rowBytes in groups],
+              "bytespersecond": sum(rowBytes / interval for interval, rowTime, rowBytes in groups)}
+    if load > 1 or any(rowTime > interval for interval, rowTime, rowBytes in groups):
+        report["verdict"] = "Refused" if settings["Planner"].getboolean("refuse") else "Warning"
+    elif load > warnLoad:
+        report["verdict"] = "Warning"
+    else:
+        report["verdict"] = "OK"
+    return report
+
+
+# Store the register costs and board types so the TCP server can check configs later
+def SaveCalibration(calibration, boardTypes):
+    settings = file_rw.ReadSettings()
+    for key in calibration:
+        settings["Calibration"][key] = repr(calibration[key])
+    settings["Calibration"]["boards"] = ",".join(boardTypes)
+    settings["Calibration"]["measured"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    file_rw.WriteSettings(settings)
+
+
+# Read the cached register costs and board types
+# Returns None for both if the logger has never been calibrated on real boards
+def LoadCalibration(settings):
+    section = settings["Calibration"]
+    if section.get("measured", "") == "":
+        return None, None
+    calibration = {key: section.getfloat(key) for key in ("channelcost", "continuouscost", "roundcost", "reducecost")}
+    return calibration, section["boards"].split(",")
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -0,0 +1,164 @@
+# This file handles the real-time scheduling profile for the log process
+# The profile is opt-in and set in the [Realtime] section of loggerSettings.ini
+# When enabled, the logging loop runs with SCHED_FIFO priority pinned to its own core with its memory locked,
+# and the garbage collector is disabled whilst logging. The GUI and TCP threads are moved off that core.
+# Most of this is only available on Linux and needs root (or suitable rlimits), so each part is checked first
+
+import ctypes
+import ctypes.util
+import gc
+import os
+import psutil
+try:
+    import resource
+# resource module is not available on Windows
+except ImportError:
+    resource = None
+
+# Flags for mlockall (see man mlockall)
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+# Read the real-time profile from the logger settings
+def ReadProfile(settings):
+    section = settings["Realtime"]
+    return {"enabled": section.getboolean("enabled"),
+            "priority": section.getint("priority"),
+            "core": section.getint("core"),
+            "lockmemory": section.getboolean("lockmemory"),
+            "disablegc": section.getboolean("disablegc")}
+
+
+# Checks which parts of the profile can be applied on this computer
+# Returns a dictionary of setting name to a description of whether it will be active
+def CheckProfile(profile):
+    status = {}
+    if not profile["enabled"]:
+        return {"Real-time profile": "Disabled"}
+    root = hasattr(os, "geteuid") and os.geteuid() == 0
+    # SCHED_FIFO needs root or a high enough RLIMIT_RTPRIO
+    if not hasattr(os, "sched_setscheduler"):
+        status["SCHED_FIFO"] = "Unavailable (not supported on this OS)"
+    elif root or RtprioLimit() >= profile["priority"]:
+        status["SCHED_FIFO"] = "Active (priority {})".format(profile["priority"])
+    else:
+        status["SCHED_FIFO"] = "Unavailable (needs root or RLIMIT_RTPRIO)"
+    # The core must be one this process is allowed to run on
+    if not hasattr(os, "sched_setaffinity"):
+        status["Core pinning"] = "Unavailable (not supported on this OS)"
+    elif profile["core"] in os.sched_getaffinity(0) and len(os.sched_getaffinity(0)) > 1:
+        status["Core pinning"] = "Active (core {})".format(profile["core"])
+    else:
+        status["Core pinning"] = "Unavailable (core {} not free)".format(profile["core"])
+    # Locking memory needs root or an unlimited RLIMIT_MEMLOCK
+    if not profile["lockmemory"]:
+        status["Memory lock"] = "Disabled"
+    elif resource is None or ctypes.util.find_library("c") is None:
+        status["Memory lock"] = "Unavailable (not supported on this OS)"
+    elif root or resource.getrlimit(resource.RLIMIT_MEMLOCK)[0] == resource.RLIM_INFINITY:
+        status["Memory lock"] = "Active"
+    else:
+        status["Memory lock"] = "Unavailable (needs root or RLIMIT_MEMLOCK)"
+    status["Garbage collector"] = "Disabled whilst logging" if profile["disablegc"] else "Enabled"
+    return status
+
+
+# Returns the highest real-time priority this process is allowed to set
+def RtprioLimit():
+    limit = resource.getrlimit(resource.RLIMIT_RTPRIO)[0]
+    return 99 if limit == resource.RLIM_INFINITY else limit
+
+
+# Apply the profile to the calling thread (and lock the memory of the whole process)
+# Only the logging loop should call this - threads started beforehand keep normal scheduling
+# Returns a list of the parts of the profile that failed
+def ApplyProfile(profile):
+    failed = []
+    if not profile["enabled"]:
+        # Without the profile, just raise the priority of the process as much as allowed
+        try:
+            psutil.Process(os.getpid()).nice(-10 if os.name == "posix" else psutil.ABOVE_NORMAL_PRIORITY_CLASS)
+        except (psutil.AccessDenied, AttributeError, OSError):
+            pass
+        return failed
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(profile["priority"]))
+    except (AttributeError, OSError):
+        failed.append("SCHED_FIFO")
+    try:
+        os.sched_setaffinity(0, {profile["core"]})
+    except (AttributeError, OSError):
+        failed.append("Core pinning")
+    if profile["lockmemory"]:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+                failed.append("Memory lock")
+        except (AttributeError, OSError, TypeError):
+            failed.append("Memory lock")
+    if profile["disablegc"]:
+        # Collect now so nothing is left over, then stop the collector running during the log
+        gc.collect()
+        gc.disable()
+    return failed
+
+
+# Undo the profile once logging has finished
+def ReleaseProfile(profile):
+    if not profile["enabled"]:
+        return
+    if profile["disablegc"]:
+        gc.enable()
+    try:
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        os.sched_setaffinity(0, range(os.cpu_count()))
+    except (AttributeError, OSError):
+        pass
+    if profile["lockmemory"]:
+        try:
+            ctypes.CDLL(ctypes.util.find_library("c")).munlockall()
+        except (AttributeError, OSError, TypeError):
+            pass
+
+
+# Move every thread of this process off the core used by the log process
+# Used by the GUI so that Tk and TCP threads don't compete with the logging loop
+# Returns the previous affinity so it can be restored with RestoreCores
+def ReserveCore(profile):
+    if not profile["enabled"] or not hasattr(os, "sched_setaffinity"):
+        return None
+    previous = os.sched_getaffinity(0)
+    cores = previous - {profile["core"]}
+    if cores == set():
+        return None
+    SetThreadAffinity(cores)
+    return previous
+
+
+# Restore the affinity of every thread of this process
+def RestoreCores(previous):
+    if previous is not None:
+        SetThreadAffinity(previous)
+
+
+# On Linux affinity is set per thread, so set it for each thread of the process
+def SetThreadAffinity(cores):
+    try:
+        threads = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        threads = [0]
+    for tid in threads:
+        try:
+            os.sched_setaffinity(tid, cores)
+        except OSError:
+            pass
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -0,0 +1,147 @@
+# This file contains the reconciler, which keeps the database in step with the files in files/outbox
+# It runs in a background thread so TCP clients and the logger never have to wait for the whole database to be checked
+# When started it checks the whole database once (see databaseOp.DatabaseCheck), then:
+# - On Linux it watches files/outbox with inotify and only checks the files that have been written, moved or deleted
+# - Elsewhere (or if inotify fails) it checks the whole database every POLL_INTERVAL seconds
+# Either way, the size of a log is only counted again if its raw data has changed (see databaseOp.ReconcileFiles)
+# Raw data files are locked by the logger whilst they are written, so a log that is still running is left alone
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from datetime import datetime
+import databaseOp as db
+
+# Folder holding the raw data and config files
+OUTBOX = "files/outbox"
+# Seconds between checks of the whole database when inotify isn't available
+POLL_INTERVAL = 60
+# Seconds to wait after a change for any others that follow, so a burst of changes is checked together
+SETTLE_TIME = 0.5
+# inotify events watched: file closed after writing, moved in or out of the folder and deleted
+# The folder itself being deleted or moved stops the watch
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+# Sent when events were lost because too many happened at once
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+# Header of each inotify event: watch descriptor, mask, cookie and length of the name that follows
+EVENT = struct.Struct("iIII")
+
+
+# Returns a file descriptor watching a folder with inotify, or None if inotify isn't available
+def Watch(folder):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (AttributeError, OSError, TypeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(folder), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+# Read the waiting inotify events
+# Returns the paths of the files changed, and whether the folder itself has gone (or events were lost)
+def ReadEvents(fd, folder):
+    data = os.read(fd, 65536)
+    paths = set()
+    gone = False
+    offset = 0
+    while offset + EVENT.size <= len(data):
+        wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+        name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+        offset += EVENT.size + length
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_Q_OVERFLOW):
+            gone = True
+        elif name != b"":
+            paths.add(folder + "/" + os.fsdecode(name))
+    return paths, gone
+
+
+# Background thread keeping the database in step with the files in files/outbox
+class Reconciler():
+
+    def __init__(self, folder=OUTBOX):
+        self.folder = folder
+        self.thread = None
+        self.stopEvent = threading.Event()
+        # Number of database checks done, of the whole database and of changed files
+        self.fullChecks = 0
+        self.fileChecks = 0
+
+    def Start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.Run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def Stop(self):
+        self.stopEvent.set()
+
+    def Run(self):
+        while not self.stopEvent.is_set():
+            # The folder is watched before the whole database is checked, so changes made during the check are seen
+            fd = Watch(self.folder)
+            self.Check(None)
+            if fd is None:
+                # Fall back to checking the whole database now and again
+                self.stopEvent.wait(POLL_INTERVAL)
+                continue
+            # If the folder is removed or replaced (or events were lost), everything is checked again
+            # before watching it again
+            try:
+                self.Follow(fd)
+            finally:
+                os.close(fd)
+
+    # Check the files reported by inotify until the folder goes or the reconciler is stopped
+    def Follow(self, fd):
+        while not self.stopEvent.is_set():
+            if select.select([fd], [], [], 1)[0] == []:
+                continue
+            time.sleep(SETTLE_TIME)
+            paths, gone = ReadEvents(fd, self.folder)
+            if paths != set():
+                self.Check(sorted(paths))
+            if gone:
+                return
+
+    # Check the files given, or the whole database if paths is None
+    # Errors are logged rather than stopping the reconciler
+    def Check(self, paths):
+        try:
+            if paths is None:
+                db.DatabaseCheck()
+                self.fullChecks += 1
+            else:
+                db.ReconcileFiles(paths)
+                self.fileChecks += 1
+        except Exception as error:
+            logging.getLogger('error_logger').info("{} - Database check failed: {}".format(datetime.now(), error))
+
+
+# Reconciler shared by everything in this process
+RECONCILER = Reconciler()
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -0,0 +1,169 @@
+# This file contains the replay input source, which feeds a recorded log back through Logger.log as if it were live
+# Set the path of a raw data file (csv or binary) in the [Replay] section of loggerSettings.ini to replay it
+# instead of reading the boards. Live data, quality checks and downloads then all work on the recorded data.
+# Pins in the current config are matched to the recorded columns by name, from whichever stream of the
+# recording holds them, and each read returns the latest recorded value at the time elapsed since the log started
+# The recording can be replayed in real time, or as fast as possible using a virtual clock
+# The log stops by itself when the end of the recording is reached
+
+import csv
+import ADS1115Fake
+import file_rw
+import hardware
+import scheduler
+
+
+# Clock that only moves forward when the logging loop sleeps, so a recording is replayed as fast as possible
+class VirtualClock(scheduler.Clock):
+
+    virtual = True
+
+    def __init__(self):
+        self.now = 0.0
+
+    def Now(self):
+        return self.now
+
+    def Sleep(self, delay):
+        self.now += delay
+
+
+# Returns the names of the channels recorded in a raw data file
+def RecordedNames(path):
+    if path.endswith(".bin"):
+        with open(path, "rb") as file:
+            return file_rw.ReadBinaryHeader(file)["names"]
+    with open(path, newline='') as file:
+        return CsvNames(next(csv.reader(file, delimiter=',', quotechar='|')))
+
+
+# Returns the channel names from the header row of a csv raw data file
+def CsvNames(header):
+    names = header[2:]
+    # Older recordings have no tick column
+    if names != [] and names[-1] == 'Tick':
+        names = names[:-1]
+    return names
+
+
+# Yields the time elapsed and values of each row of a raw data file
+def RecordedRows(path):
+    if path.endswith(".bin"):
+        for record in file_rw.ReadBinary(path):
+            yield record[1], record[2:]
+        return
+    with open(path, newline='') as file:
+        reader = csv.reader(file, delimiter=',', quotechar='|')
+        channels = len(CsvNames(next(reader)))
+        for row in reader:
+            yield float(row[1]), [int(value) if value != "" else file_rw.MISSING for value in row[2:2 + channels]]
+
+
+# Reads columns from one stream of a recording, holding each row until the next row's time is reached
+class Cursor():
+
+    def __init__(self, path, columns, positions):
+        self.path = path
+        # Position of each column in the recorded row and the position it is read into
+        self.columns = list(zip(columns, positions))
+        self.rows = None
+        self.current = None
+        self.next = None
+
+    # Go back to the start of the recording
+    def Start(self):
+        self.rows = RecordedRows(self.path)
+        self.next = next(self.rows, None)
+        self.current = self.next
+
+    # Move to the latest row at or before timeElapsed and copy its values into out
+    def Seek(self, timeElapsed, out):
+        while self.next is not None and self.next[0] <= timeElapsed:
+            self.current = self.next
+            self.next = next(self.rows, None)
+        if self.current is not None:
+            for column, position in self.columns:
+                out[position] = self.current[1][column]
+
+    def Finished(self):
+        return self.next is None
+
+
+# Input source used in place of an acquisition engine, reading a rate group's pins from the recording
+class ReplayEngine():
+
+    def __init__(self, cursors, clock):
+        self.cursors = cursors
+        self.clock = clock
+        self.startTime = 0.0
+
+    def Start(self):
+        for cursor in self.cursors:
+            cursor.Start()
+        self.startTime = self.clock.Now()
+
+    def Read(self, out):
+        timeElapsed = self.clock.Now() - self.startTime
+        for cursor in self.cursors:
+            cursor.Seek(timeElapsed, out)
+
+    def Finished(self):
+        return all(cursor.Finished() for cursor in self.cursors)
+
+
+# Wraps the stop Event passed to Logger.log so the log also stops when the recording runs out
+class ReplayStop():
+
+    def __init__(self, event, engines):
+        self.event = event
+        self.engines = engines
+
+    def is_set(self):
+        return self.event.is_set() or all(engine.Finished() for engine in self.engines)
+
+
+# Holds everything needed to replay a recording through a Logger
+class Replay():
+
+    def __init__(self, path, fast):
+        self.path = path
+        self.fast = fast
+        self.clock = VirtualClock() if fast else scheduler.Clock()
+        self.engines = []
+
+    # Wrap the stop Event passed to Logger.log
+    def StopEvent(self, event):
+        return ReplayStop(event, self.engines)
+
+
+# Fake boards at every address, so every pin in the config can be replayed whichever boards are connected
+def ReplayBoards():
+    return [ADS1115Fake.ADS1115(None, address=address) for address in hardware.ADDRESSES]
+
+
+# Replace the acquisition engine of each rate group with one reading from the recording at path
+# Raises KeyError if a pin being logged isn't in the recording
+def Attach(groups, path, fast=False):
+    replay = Replay(path, fast)
+    streams = [(streamPath, RecordedNames(streamPath)) for streamPath, interval in file_rw.StreamPaths(path)]
+    for group in groups:
+        cursors = []
+        for streamPath, names in streams:
+            positions = [idx for idx, name in enumerate(group.headers) if name in names]
+            if positions != []:
+                cursors.append(Cursor(streamPath, [names.index(group.headers[idx]) for idx in positions], positions))
+        if sum(len(cursor.columns) for cursor in cursors) != len(group.headers):
+            missing = [name for name in group.headers if not any(name in names for streamPath, names in streams)]
+            raise KeyError(", ".join(missing))
+        group.engine = ReplayEngine(cursors, replay.clock)
+        replay.engines.append(group.engine)
+    return replay
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -0,0 +1,75 @@
+# This file contains the scheduler used by the logging loop in logger.py to decide when each row is taken
+# Rows are taken on a fixed grid of ticks: tick n is due at the start of the log plus n time intervals
+# Deadlines are absolute, so time lost on one row is never carried forward to the next
+# If a row overruns so badly that whole ticks are missed, those ticks are skipped and counted
+# Late and skipped ticks and the worst lateness are kept so timing quality can be checked after a log
+# Each rate group of a log has its own scheduler, so groups are scheduled independently of each other
+
+import time
+
+
+class TickScheduler():
+
+    def __init__(self, interval, startTime, tolerance=None):
+        self.interval = interval
+        self.startTime = startTime
+        # A row is counted as late if it is taken more than tolerance seconds after its deadline
+        self.tolerance = min(0.001, interval / 10) if tolerance is None else tolerance
+        # Index of the tick currently being logged
+        self.tick = 0
+        # Running counters of timing quality
+        self.late = 0
+        self.skipped = 0
+        self.worstLate = 0.0
+
+    # Record how late the current tick was, given its time elapsed since the start of the log
+    def Mark(self, timeElapsed):
+        lateness = timeElapsed - self.tick * self.interval
+        if lateness > self.tolerance:
+            self.late += 1
+        if lateness > self.worstLate:
+            self.worstLate = lateness
+
+    # Returns the time elapsed since the start of the log at which the current tick is due
+    def Due(self):
+        return self.tick * self.interval
+
+    # Move on to the next tick, given the time elapsed since the start of the log
+    # Any ticks whose deadline has already passed by a full interval are skipped
+    def Advance(self, now):
+        self.tick += 1
+        behind = now - self.tick * self.interval
+        if behind >= self.interval:
+            missed = int(behind // self.interval)
+            self.skipped += missed
+            self.tick += missed
+
+
+# Clock used by the logging loop
+# This is real time, unless a recording is being replayed as fast as possible (see replay.py)
+class Clock():
+
+    # Set for a virtual clock, where the logging loop waits for the writer threads rather than dropping rows
+    virtual = False
+
+    def Now(self):
+        return time.perf_counter()
+
+    def Sleep(self, delay):
+        time.sleep(delay)
+
+
+# Sleep until a time elapsed since startTime
+def SleepUntil(startTime, timeElapsed, clock=Clock()):
+    delay = timeElapsed - (clock.Now() - startTime)
+    if delay > 0:
+        clock.Sleep(delay)
+
+
+# This is the code that is run when the program is loaded.
+# If the module were to be imported, the code inside the if statement would not run.
+if __name__ == "__main__":
+    # Warning that logger will not work
+    print("\nWARNING - This script cannot be run directly."
+          "\nPlease run 'main.py' to start the logger, or use the desktop icon.\n")
+    # Script will exit
@@ -11,11 +11,27 @@ from datetime import datetime
 from threading import Thread
 from decimal import Decimal
 import file_rw
+import logStats
+import planner
+import reconciler
+
+
+# Version of the TCP protocol the logger speaks, clients pick the version they speak with the Protocol command
+# Clients that don't send Protocol are spoken to with version 1 so existing clients keep working
+# 1: Layouts before rate groups and oversampling, pin rows sent by Request_Recent_Config have 9 fields,
+#    pin rows sent by Search_Log have 11 fields (with m and c) and log packets have 11 fields,
+#    giving only the path of the main stream of the log
+# 2: Pin rows sent by Request_Recent_Config and Search_Log have 13 fields, ending with the time interval
+#    and oversample of the pin as for Upload_Config and Check_Config.
+#    Upload_Config replies Config_Uploaded, or Config_Invalid followed by the reason the config was rejected.
+#    Log packets have 12 fields, ending with the paths of the other streams of the log separated by ';'
+#    (one for each rate group, named with its time interval in ms, empty if all pins log at the log time interval)
+PROTOCOL = 2
 
 
 class TcpClient():
     # Initialise new Client
-    def __init__(self, client_socket, address, connTcp, exitTcp, lock):
+    def __init__(self, client_socket, address, connTcp, exitTcp, lock, stats=None):
         # Store socket and address
         self.client_socket = client_socket
         self.address = address
@@ -24,6 +40,8 @@ class TcpClient():
         self.exitTcp = exitTcp
         # Store Event for locking Pipe to stop multiple client threads using it at once
         self.lock = lock
+        # Store shared stats counters filled in by the log process
+        self.stats = stats
         # Setup dataQueue and quitEvent for client connection
         self.dataQueue = Queue()
         self.quitEvent = Event()
@@ -33,6 +51,8 @@ class TcpClient():
         self.listener.start()
         # Setup user variable
         self.user = ""
+        # Version of the protocol spoken with the client, see PROTOCOL
+        self.protocol = 1
 
 
     # Used to send TCP data to client
@@ -90,6 +110,8 @@ class TcpClient():
 
 
     # Receive Config Data from client
+    # Pin rows can optionally end with the time interval and oversample of the pin, as for Check_Config
+    # Raises ValueError if the time interval or oversample of a pin can't be logged
     def ReceiveConfig(self):
         # Create new list to store config pins in
         newConfig = []
@@ -114,6 +136,12 @@ class TcpClient():
             newPin.units = rows[i][8]
             newPin.m = rows[i][9]
             newPin.c = rows[i][10]
+            # Pins without a time interval or oversample keep the defaults (log time interval, one conversion)
+            # Checked here as a config that can't be read back would stop the log from starting
+            try:
+                newPin.interval, newPin.oversample = PinRates(rows[i])
+            except ValueError:
+                raise ValueError("Time interval or oversample of {} is not valid".format(newPin.name))
             newConfig.append(newPin)
         return newConfig
 
@@ -139,34 +167,24 @@ class TcpClient():
         newLog.time = metadata[4]
         newLog.loggedBy = metadata[5]
         newLog.description = metadata[6]
-        # Get the current test number for the name
-        # If there are no logs with the name, returns 0
-        newLog.test_number = db.GetTestNumber(newLog.name)
         logWrite(self.user + " Metadata received")
 
         # Receive all config settings using ReceiveConfig()
-        newLog.config = self.ReceiveConfig()
-
         try:
-            newLog.id = db.GetRecentId()
-            # If most recent entry doesn't have data set, write new config there
-            # Makes sure emtpy entries don't fill up database
-            if db.CheckDataTable(newLog.id) is False:
-                # If log name has changed, increment test number to correct number
-                if newLog.name != db.GetName(newLog.id):
-                    newLog.test_number += 1
-                db.UpdateLog(newLog)
-            # If most recent entry does have data set, increment the id and test number and write new entry
-            else:
-                newLog.id += 1
-                newLog.test_number += 1
-                db.WriteLog(newLog)
-        # Exception occurs when there are no logs in the database
-        # Catch and write log with id 1 and test number 1
-        except ValueError:
-            newLog.id = 1
-            newLog.test_number = 1
-            db.WriteLog(newLog)
+            newLog.config = self.ReceiveConfig()
+        # Reject the upload rather than saving a config that can't be logged
+        except ValueError as error:
+            self.TcpSend("Config_Invalid")
+            self.TcpSend(str(error))
+            logWrite(self.user + " Config rejected: " + str(error))
+            self.lock.acquire(block=True)
+            self.connTcp.send("Print")
+            self.connTcp.send("\nConfig for " + newLog.name + " rejected. " + str(error))
+            self.lock.release()
+            return
+
+        # Add the log entry, which also finds the id and test number of the log
+        db.NewLog(newLog)
         # Write the config settings to a file on the Pi
         file_rw.WriteLogConfig(newLog, newLog.name)
         # Lock so that connTcp cannot be accessed by another client thread
@@ -184,6 +202,8 @@ class TcpClient():
                 "Pin {} set to log {}. I: {} G: {} SMin: {} SMax: {}".format(pin.id, pin.fName, pin.inputType, pin.gain,
                                                                              pin.scaleMin, pin.scaleMax))
         self.lock.release()
+        if self.protocol > 1:
+            self.TcpSend("Config_Uploaded")
         return
 
 
@@ -206,25 +226,15 @@ class TcpClient():
         except FileNotFoundError:
             # If the config file cannot be found, tell user
             self.TcpSend("No Config Found")
-            db.DatabaseCheck()
+            db.ReconcileLog(db.GetRecentId())
             return
         # Sends the metadata to the users computer
         for value in values:
             self.TcpSend(str(value))
         # Writes the Pin data to a data packet string
         for pin in recentConfig:
-            packet = ""
-            packet += str(pin.id) + '\u001f'
-            packet += pin.name + '\u001f'
-            packet += str(pin.enabled) + '\u001f'
-            packet += pin.fName + '\u001f'
-            packet += pin.inputType + '\u001f'
-            packet += str(pin.gain) + '\u001f'
-            packet += str(pin.scaleMin) + '\u001f'
-            packet += str(pin.scaleMax) + '\u001f'
-            packet += pin.units
             # Send Pin data packet to client
-            self.TcpSend(packet)
+            self.TcpSend(PinPacket(pin, 9 if self.protocol == 1 else 13))
         logWrite(self.user + " Sent config " + path)
         return
 
@@ -252,11 +262,23 @@ class TcpClient():
             db.SetDownloaded(log, self.user)
             try:
                 logMeta = db.ReadLog(log)
+                if logMeta.data_path is not None:
+                    # Pins logged at other time intervals are in their own stream, one for each rate group
+                    streams = [streamPath for streamPath, interval in file_rw.StreamPaths(logMeta.data_path)]
+                    # Binary raw data is converted to the csv layout for download
+                    if logMeta.data_path.endswith(".bin"):
+                        streams = [file_rw.ExportCsv(streamPath) for streamPath in streams]
+                    logMeta.data_path = streams[0]
+                    logMeta.stream_paths = streams[1:]
                 logQueue.put(logMeta)
             except FileNotFoundError:
-                db.DatabaseCheck()
+                db.ReconcileLog(log)
                 logMeta = lgOb.LogMeta(name=db.GetName(log),config="Not_Found")
                 logQueue.put(logMeta)
+            # Config file is there but can't be read, so the log is skipped without reconciling it
+            except ValueError:
+                logMeta = lgOb.LogMeta(name=db.GetName(log),config="Invalid")
+                logQueue.put(logMeta)
         allRead.set()
         # Wait until logQueue is empty and all logs have been sent
         # Also will close streamLog thread
@@ -272,6 +294,10 @@ class TcpClient():
                 self.TcpSend("Config_Not_Found")
                 self.TcpSend("Config for {} not found, skipping download.".format(logMeta.name))
                 logQueue.task_done()
+            elif logMeta.config == "Invalid":
+                self.TcpSend("Config_Not_Found")
+                self.TcpSend("Config for {} could not be read, skipping download.".format(logMeta.name))
+                logQueue.task_done()
             else:
                 # Write the metadata to a packet and send to client
                 metaData = (str(logMeta.id) + '\u001f' + str(logMeta.project) + '\u001f'
@@ -280,6 +306,9 @@ class TcpClient():
                             + '\u001f' + str(logMeta.date) + '\u001f' + str(logMeta.time)
                             +'\u001f'+ logMeta.loggedBy + '\u001f' + str(logMeta.data_path)
                             + '\u001f' + logMeta.description)
+                # Clients speaking version 1 only know about the main stream
+                if self.protocol > 1:
+                    metaData += '\u001f' + ';'.join(logMeta.stream_paths)
                 self.TcpSend(metaData)
                 # Write data for each pin to a packet and send them to client
                 for pin in logMeta.config:
@@ -343,7 +372,7 @@ class TcpClient():
         if values[6] != "":
             args["description"] = '%' + values[6] + '%'
         if values[7] != "":
-            args["downloaded_by"] = '%' + self.user + '%'
+            args["downloaded_by"] = self.user
 
         try:
             # Searches database using arguments sent from user
@@ -386,17 +415,18 @@ class TcpClient():
             config = file_rw.ReadLogConfig(db.GetConfigPath(requestedConfig))
         except FileNotFoundError:
             self.TcpSend("No_Config_Found")
-            db.DatabaseCheck()
+            db.ReconcileLog(requestedConfig)
+            return
+        # Config file is there but can't be read
+        except ValueError:
+            self.TcpSend("No_Config_Found")
             return
         # Send config metadata to client
         for value in values:
             self.TcpSend(str(value))
         # Write data for each Pin to packet and send each packet to client
         for pin in config:
-            pinData = (str(pin.id) + '\u001f' + pin.name + '\u001f' + str(pin.enabled) + '\u001f' + pin.fName + '\u001f'
-                       + pin.inputType + '\u001f' + str(pin.gain) + '\u001f' + str(pin.scaleMin) + '\u001f'
-                       + str(pin.scaleMax) + '\u001f' + pin.units + '\u001f' + str(Decimal(pin.m)) + '\u001f' + str(Decimal(pin.c)))
-            self.TcpSend(pinData)
+            self.TcpSend(PinPacket(pin, 11 if self.protocol == 1 else 13))
         logWrite(self.user + " Sent config " + db.GetConfigPath(requestedConfig))
         return
 
@@ -422,15 +452,91 @@ class TcpClient():
         return
 
 
+    # Checks whether a config can be met before it is uploaded, using the register costs cached by the planner
+    # Client sends the time interval, then the 16 rows of pin settings as for Upload_Config
+    # Pin rows can optionally end with the time interval and oversample of the pin
+    # Replies with Config_OK, Config_Warning or Config_Refused followed by the numbers the verdict is based on:
+    # fastest time interval possible, fraction of time spent reading, bytes per row of each rate group,
+    # bytes written each second and when the logger was calibrated
+    def CheckConfig(self):
+        try:
+            timeInterval = float(self.TcpReceive())
+            rows = []
+            while len(rows) < 16:
+                rows.append(self.TcpReceive().split('\u001f'))
+            settings = file_rw.ReadSettings()
+            calibration, boardTypes = planner.LoadCalibration(settings)
+            if calibration is None:
+                self.TcpSend("Not_Calibrated")
+                self.TcpSend("Logger has not been calibrated yet. Start a log on the logger to calibrate it.")
+                return
+            # Group the enabled pins by time interval, holding the board and oversample of each pin
+            layouts = {}
+            for row in rows:
+                if row[2] != 'True':
+                    continue
+                board = int(row[1][0])
+                if boardTypes[board] == "":
+                    self.TcpSend("Config_Refused")
+                    self.TcpSend("{} is on a board that isn't connected".format(row[1]))
+                    return
+                interval, oversample = PinRates(row)
+                layouts.setdefault(interval if interval > 0 else timeInterval, []).append((board, oversample))
+        except (ValueError, IndexError):
+            self.TcpSend("Config_Invalid")
+            self.TcpSend("Config could not be read")
+            return
+        if layouts == {}:
+            self.TcpSend("Config_Refused")
+            self.TcpSend("No Inputs set to Log")
+            return
+        groups = planner.PredictGroups(sorted(layouts.items()), boardTypes, calibration,
+                                       settings["Logging"]["fileformat"])
+        report = planner.Assess(groups, settings)
+        self.TcpSend("Config_" + report["verdict"])
+        self.TcpSend(str(round(timeInterval * report["load"], 6)) + '\u001f' + str(round(report["load"], 4))
+                     + '\u001f' + ",".join(str(rowBytes) for rowBytes in report["rowbytes"])
+                     + '\u001f' + str(round(report["bytespersecond"])) + '\u001f' + settings["Calibration"]["measured"])
+        logWrite(self.user + " Config checked: " + report["verdict"])
+
+
+    # Sends the stats counters of the running (or last) log, showing where the time in the log process goes
+    # Replies with Stats_Running or Stats_Stopped, followed by name=value for each counter (see logStats.py)
+    # Times are in seconds
+    def GetStats(self):
+        if self.stats is None:
+            self.TcpSend("Stats_Unavailable")
+            self.TcpSend("Stats are not available")
+            return
+        snapshot = logStats.Snapshot(self.stats)
+        self.TcpSend("Stats_Running" if snapshot["running"] == 1 else "Stats_Stopped")
+        self.TcpSend('\u001f'.join("{}={}".format(name, round(value, 6)) for name, value in snapshot.items()))
+
+
+    # Sets the version of the protocol spoken with the client, see PROTOCOL
+    # Client sends the version it speaks, replies with the version the logger will speak
+    # This is the lower of the two, so clients newer than the logger fall back to what the logger speaks
+    def SetProtocol(self):
+        try:
+            self.protocol = max(1, min(int(self.TcpReceive()), PROTOCOL))
+        except ValueError:
+            """Version not a number, keep speaking the current version"""
+        self.TcpSend(str(self.protocol))
+        logWrite(self.user + " speaking protocol " + str(self.protocol))
+
+
     # Sends list of commands to client (used for interfacing with powershell or other CLI)
     def PrintHelp(self):
         self.TcpSend("Available Commands:")
         self.TcpSend("Request_Recent_Config - Get the most recent config from Logger")
         self.TcpSend("Upload_Config - Upload config to Logger")
+        self.TcpSend("Check_Config - Check a config can be met before uploading it")
+        self.TcpSend("Get_Stats - Get timing and error counters of the running or last log")
         self.TcpSend("Start_Log - Starts a log")
         self.TcpSend("Stop_Log - Stops a log")
         self.TcpSend("Search_Log - Search for and download a log")
         self.TcpSend("Change_User - Change which user is using the session")
+        self.TcpSend("Protocol - Set the version of the protocol spoken, up to {}".format(PROTOCOL))
         self.TcpSend("Export_Database - Returns all the data in the database")
         self.TcpSend("Help - Display this message")
         self.TcpSend("Quit - Disconnect from Logger")
@@ -462,6 +568,10 @@ class TcpClient():
                     self.GetRecentConfig()
                 elif command == "Upload_Config":
                     self.ReceiveLogMeta()
+                elif command == "Check_Config":
+                    self.CheckConfig()
+                elif command == "Get_Stats":
+                    self.GetStats()
                 elif command == "Start_Log":
                     self.StartLog()
                 elif command == "Stop_Log":
@@ -470,6 +580,8 @@ class TcpClient():
                     self.SearchLog()
                 elif command == "Change_User":
                     self.ChangeUser()
+                elif command == "Protocol":
+                    self.SetProtocol()
                 elif command == "Export_Database":
                     self.ExportDatabase()
                 elif command == "Help":
@@ -509,8 +621,29 @@ def logWrite(data):
         file.write(str(datetime.now()) + ": " + data + '\n')
 
 
+# Returns the settings of a pin as a packet to send to the client
+# Laid out as the pin rows received by Upload_Config, cut down to the number of fields in the protocol spoken
+def PinPacket(pin, fields):
+    values = [str(pin.id), pin.name, str(pin.enabled), pin.fName, pin.inputType, str(pin.gain), str(pin.scaleMin),
+              str(pin.scaleMax), pin.units, str(Decimal(pin.m)), str(Decimal(pin.c)), str(pin.interval),
+              str(pin.oversample)]
+    return '\u001f'.join(values[:fields])
+
+
+# Returns the time interval and oversample of a pin from a pin row sent by the client
+# Pins without them log at the log time interval (0) with one conversion
+# Raises ValueError if they can't be read back from the config file by file_rw.ReadLogConfig
+def PinRates(row):
+    interval = float(row[11]) if len(row) > 11 else 0
+    oversample = int(row[12]) if len(row) > 12 else 1
+    # Written this way round so that nan is refused too
+    if not 0 <= interval < float("inf") or oversample < 1:
+        raise ValueError
+    return interval, oversample
+
+
 # This function sets up the TCP server and client thread
-def run(connTcp, exitTcp):
+def run(connTcp, exitTcp, stats=None):
     # Create new section in tcpLog.txt
     with open("tcpLog.txt", "a") as file:
         file.write("\n\n" + ("-" * 75))
@@ -519,6 +652,8 @@ def run(connTcp, exitTcp):
     # Create and setup database
     # Note: If database already exists, this won't recreate the database
     db.setupDatabase()
+    # Keep the database in step with the files in files/outbox in the background
+    reconciler.RECONCILER.Start()
     # Create an INET, STREAMing socket for the TCP server
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -547,7 +682,7 @@ def run(connTcp, exitTcp):
             client_socket.settimeout(None)
             # Create new thread to deal with new client
             # This allows multiple clients to connect at once
-            new_client = TcpClient(client_socket, address, connTcp, exitTcp, lock)
+            new_client = TcpClient(client_socket, address, connTcp, exitTcp, lock, stats)
             # Log Connection
             logWrite(address[0] + " connected.")
             try:
@@ -570,6 +705,7 @@ def run(connTcp, exitTcp):
             # This is fine as it means exitTcp.is_set() is constantly being checked
             # While loop is therefore able to close correctly when program closed
             """No incoming connection"""
+    reconciler.RECONCILER.Stop()
     logWrite("Server closed")
 
 